@@ -0,0 +1,87 @@
+#!/usr/bin/env python3
+"""
+Raw header -> header endpoint card list.
+
+Parses --count raw primary headers (default 20k) and reports headers per
+second, best of --repeat runs (default 3), for:
+  - fits.Header.fromstring() + header_to_list(), as the endpoints used to
+  - fits_header_reader.header_list_from_bytes()
+Both outputs are compared card by card before timing; the run fails if
+they differ. Headers come from synthetic_fits.make_header() plus CONTINUE
+long strings, complex and logical values.
+
+Usage:
+    python benchmarks/header_cards.py --count 20000
+"""
+
+import argparse
+import os
+import sys
+import time
+import warnings
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_ROOT)
+
+from astropy.io import fits
+
+from fits_header_reader import header_list_from_bytes, header_to_list
+from synthetic_fits import make_header
+
+DISTINCT_HEADERS = 200
+
+
+def raw_headers(count):
+    headers = []
+    for i in range(count):
+        header = make_header(fileid=100001 + i, extra=(
+            ('NOTES', 'Observed through thin cirrus; ' * (i % 4 + 1) + "operator's note", 'Long string'),
+            ('PHASE', complex(0.5 + i, -1.25), 'Complex'),
+            ('DITHER', bool(i % 2), 'Dithered'),
+        ))
+        header.add_history(f'Reduced with pipeline v{i % 7}.2')
+        headers.append(header.tostring().encode('ascii'))
+    return headers
+
+
+def astropy_list(data):
+    return header_to_list(fits.Header.fromstring(data))
+
+
+def timed(label, count, func, repeat):
+    """Best of `repeat` runs, so that a busy machine does not skew the ratio"""
+    elapsed = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        elapsed = min(elapsed, time.perf_counter() - start)
+    print(f"{label:<44}{elapsed:>9.2f} s{count / elapsed:>12,.0f} headers/s{elapsed / count * 1e6:>9.1f} us")
+    return elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark raw header card parsing')
+    parser.add_argument('--count', type=int, default=20_000)
+    parser.add_argument('--repeat', type=int, default=3, help='runs of each parser; the best is reported')
+    args = parser.parse_args()
+
+    # HIERARCH keywords such as "INS STATE000" are intended
+    warnings.filterwarnings('ignore', message='Keyword name')
+    distinct = raw_headers(min(DISTINCT_HEADERS, args.count))
+    for data in distinct:
+        if header_list_from_bytes(data) != astropy_list(data):
+            print("header_list_from_bytes() differs from astropy", file=sys.stderr)
+            return 1
+    cycle = [distinct[i % len(distinct)] for i in range(args.count)]
+    print(f"{args.count} headers of {len(astropy_list(distinct[0]))} cards ({len(distinct[0])} bytes), outputs identical\n")
+
+    baseline = timed('Header.fromstring + header_to_list', args.count,
+                     lambda: [astropy_list(d) for d in cycle], args.repeat)
+    parsed = timed('header_list_from_bytes', args.count,
+                   lambda: [header_list_from_bytes(d) for d in cycle], args.repeat)
+    print(f"\nspeedup: {baseline / parsed:.1f}x")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,106 @@
+#!/usr/bin/env python3
+"""
+Header -> fits_headers row conversion at ingest scale.
+
+Converts --count headers (default 100k) and reports headers per second for:
+  - per-keyword Header.get, the way header_to_row() used to read headers
+  - header_mapping.header_to_row() on astropy Headers
+  - header_mapping.header_to_row() on plain dicts (e.g. parsed cards)
+  - headers_to_columns() and the COPY text payload for the whole batch
+With DB_* set and --load, the batch is also upserted with copy_headers()
+(inside a transaction that is rolled back).
+
+Usage:
+    python benchmarks/header_rows.py --count 100000
+"""
+
+import argparse
+import os
+import sys
+import time
+import warnings
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_ROOT)
+
+from header_mapping import (HEADER_COLUMNS, CONVERTERS, header_to_row, headers_to_columns,
+                            copy_payload, copy_headers)
+from synthetic_fits import make_header
+
+# Distinct astropy Headers to cycle through; building 100k of them would
+# take longer than the conversion being measured
+DISTINCT_HEADERS = 500
+
+
+def per_keyword_get(header):
+    """Baseline: one Header.get per column alias, as before the mapping table"""
+    row = {}
+    for column, aliases, kind in HEADER_COLUMNS:
+        convert = CONVERTERS[kind]
+        value = None
+        for keyword in aliases:
+            value = convert(header.get(keyword))
+            if value is not None:
+                break
+        row[column] = value
+    return row
+
+
+def synthetic_headers(count):
+    headers = []
+    for i in range(count):
+        header = make_header(fileid=100001 + i)
+        header['DATE-OBS'] = f'2024-{i % 12 + 1:02d}-{i % 28 + 1:02d}T21:14:05.250'
+        header['TRG ALPH'] = 330.79 + i * 1e-4
+        headers.append(header)
+    return headers
+
+
+def timed(label, count, func):
+    start = time.perf_counter()
+    result = func()
+    elapsed = time.perf_counter() - start
+    print(f"{label:<44}{elapsed:>9.2f} s{count / elapsed:>12,.0f} headers/s{elapsed / count * 1e6:>9.1f} us")
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark header -> row conversion')
+    parser.add_argument('--count', type=int, default=100_000)
+    parser.add_argument('--load', action='store_true', help='Also COPY into Postgres (DB_* env), then roll back')
+    args = parser.parse_args()
+
+    # HIERARCH keywords such as "TRG ALPH" are intended
+    warnings.filterwarnings('ignore', message='Keyword name')
+    astropy_headers = synthetic_headers(min(DISTINCT_HEADERS, args.count))
+    distinct_dicts = [{key: header[key] for key in header.keys()} for header in astropy_headers]
+    dict_headers = [{**distinct_dicts[i % len(distinct_dicts)], 'FILEID': 100001 + i} for i in range(args.count)]
+    cycle = [astropy_headers[i % len(astropy_headers)] for i in range(args.count)]
+    print(f"{args.count} headers of {len(astropy_headers[0])} cards, {len(HEADER_COLUMNS)} columns\n")
+
+    timed('Header.get per keyword (astropy)', args.count, lambda: [per_keyword_get(h) for h in cycle])
+    timed('header_to_row (astropy Header)', args.count, lambda: [header_to_row(h) for h in cycle])
+    rows = timed('header_to_row (dict)', args.count, lambda: [header_to_row(h) for h in dict_headers])
+    timed('headers_to_columns (dict)', args.count, lambda: headers_to_columns(dict_headers))
+    payload = timed('COPY payload', args.count, lambda: copy_payload(rows))
+    print(f"\nCOPY payload: {len(payload.getvalue()) / 1e6:.1f} MB")
+
+    if args.load:
+        import psycopg2
+        conn = psycopg2.connect(
+            host=os.environ.get("DB_HOST", "localhost"),
+            database=os.environ.get("DB_NAME", "observatory"),
+            user=os.environ.get("DB_USER", "observatory_user"),
+            password=os.environ.get("DB_PASS", "observatory_pass"),
+            port=os.environ.get("DB_PORT", "5432"),
+        )
+        try:
+            timed('copy_headers (convert + COPY + upsert)', args.count, lambda: copy_headers(conn, dict_headers))
+        finally:
+            conn.rollback()
+            conn.close()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,462 @@
+#!/usr/bin/env python3
+"""
+End-to-end load test of the Flask backends.
+
+Starts an in-memory S3 server (s3_fake.py) in this process and the two
+backends (minio_fits_backend.py and fits_header.py) under serve.py,
+pointed at it, seeds N synthetic frames through /api/upload-fits/, then
+drives a weighted mix of requests from --concurrency closed-loop workers
+for --duration seconds and reports throughput, latency percentiles and
+errors per operation.
+
+Postgres is not faked: the backends use the usual DB_HOST/DB_PORT/DB_NAME/
+DB_USER/DB_PASS settings (e.g. the database from docker-compose), and the
+fits_headers table is created from database/schema.sql if it is missing.
+With --pg-temp a throwaway cluster is started with initdb/pg_ctl instead.
+--no-db skips Postgres altogether: frames are written straight into the
+S3 server and only the object store endpoints are exercised.
+
+Usage:
+    python benchmarks/load_test.py --frames 200 --concurrency 16 --duration 60
+    python benchmarks/load_test.py --mix header=50,render=20,raw=30 --no-db
+"""
+
+import argparse
+import http.client
+import io
+import json
+import os
+import random
+import shutil
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from collections import defaultdict
+from urllib.parse import urlencode, quote
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_ROOT)
+
+from astropy.io import fits
+
+from s3_fake import make_server, S3Object
+from synthetic_fits import make_header, star_field
+
+BUCKET = 'dataarchive'
+ACCESS_KEY = 'loadtest'
+SECRET_KEY = 'loadtest-secret'
+FIRST_FILEID = 500001
+
+DEFAULT_MIX = 'header=25,metadata=20,metadata_batch=5,render=10,view=5,raw=15,search=10,upload=5,legacy_header=5'
+# Operations that need Postgres (excluded from the mix with --no-db)
+DB_OPERATIONS = {'metadata', 'metadata_batch', 'search', 'upload'}
+
+
+# -- services ---------------------------------------------------------------
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def wait_for_port(port, process, timeout=60):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process is not None and process.poll() is not None:
+            raise RuntimeError(f"Process exited with status {process.returncode} before listening on {port}")
+        try:
+            with socket.create_connection(('127.0.0.1', port), timeout=1):
+                return
+        except OSError:
+            time.sleep(0.2)
+    raise RuntimeError(f"Nothing listening on port {port} after {timeout}s")
+
+
+class TempPostgres:
+    """Throwaway Postgres cluster in a temporary directory (needs initdb and pg_ctl)"""
+
+    def __init__(self):
+        self.bindir = self._find_bindir()
+        self.datadir = tempfile.mkdtemp(prefix='fits_loadtest_pg_')
+        self.port = free_port()
+
+    @staticmethod
+    def _find_bindir():
+        initdb = shutil.which('initdb')
+        if initdb:
+            return os.path.dirname(initdb)
+        pg_config = shutil.which('pg_config')
+        if pg_config:
+            bindir = subprocess.run([pg_config, '--bindir'], capture_output=True, text=True).stdout.strip()
+            if os.path.exists(os.path.join(bindir, 'initdb')):
+                return bindir
+        raise RuntimeError("--pg-temp needs initdb and pg_ctl on PATH (or pg_config)")
+
+    def start(self):
+        subprocess.run(
+            [os.path.join(self.bindir, 'initdb'), '-D', self.datadir, '-U', 'loadtest', '-A', 'trust'],
+            check=True, stdout=subprocess.DEVNULL,
+        )
+        subprocess.run(
+            [os.path.join(self.bindir, 'pg_ctl'), '-D', self.datadir, '-w', '-l',
+             os.path.join(self.datadir, 'server.log'),
+             '-o', f'-p {self.port} -k {self.datadir} -c listen_addresses=127.0.0.1', 'start'],
+            check=True, stdout=subprocess.DEVNULL,
+        )
+        subprocess.run(
+            [os.path.join(self.bindir, 'createdb'), '-h', '127.0.0.1', '-p', str(self.port), '-U', 'loadtest',
+             'observatory'],
+            check=True,
+        )
+        return {'DB_HOST': '127.0.0.1', 'DB_PORT': str(self.port), 'DB_NAME': 'observatory',
+                'DB_USER': 'loadtest', 'DB_PASS': ''}
+
+    def stop(self):
+        subprocess.run([os.path.join(self.bindir, 'pg_ctl'), '-D', self.datadir, '-m', 'fast', 'stop'],
+                       stdout=subprocess.DEVNULL)
+        shutil.rmtree(self.datadir, ignore_errors=True)
+
+
+def prepare_database(db_env, reset):
+    """Create fits_headers from schema.sql if it is missing; optionally empty it"""
+    import psycopg2
+
+    conn = psycopg2.connect(
+        host=db_env['DB_HOST'], port=db_env['DB_PORT'], dbname=db_env['DB_NAME'],
+        user=db_env['DB_USER'], password=db_env['DB_PASS'],
+    )
+    try:
+        with conn, conn.cursor() as cur:
+            cur.execute("SELECT to_regclass('fits_headers')")
+            if cur.fetchone()[0] is None:
+                print("Creating fits_headers from database/schema.sql")
+                with open(os.path.join(REPO_ROOT, 'database', 'schema.sql')) as f:
+                    cur.execute(f.read())
+            elif reset:
+                print("Truncating fits_headers")
+                cur.execute("TRUNCATE fits_headers")
+                # Stale hashes would make the seeding uploads skip the upsert
+                cur.execute("SELECT to_regclass('fits_content_hashes')")
+                if cur.fetchone()[0] is not None:
+                    cur.execute("TRUNCATE fits_content_hashes")
+    finally:
+        conn.close()
+
+
+def start_backend(module, port, env, log_dir, workers):
+    """Run `module`.app with serve.py, as the Docker image does"""
+    command = [sys.executable, 'serve.py', module, '--bind', f'127.0.0.1:{port}', '--workers', str(workers)]
+    log = open(os.path.join(log_dir, f'{module}.log'), 'wb')
+    process = subprocess.Popen(command, cwd=REPO_ROOT, env=env, stdout=log, stderr=subprocess.STDOUT)
+    process.log = log
+    wait_for_port(port, process)
+    return process
+
+
+def stop_process(process):
+    process.terminate()
+    try:
+        process.wait(10)
+    except subprocess.TimeoutExpired:
+        process.kill()
+    process.log.close()
+
+
+# -- frames -----------------------------------------------------------------
+
+class FrameFactory:
+    """Synthetic frames that share pixel data and differ in FILEID and DATE-OBS"""
+
+    TARGETS = ('HD 209458', 'HD 189733', 'WASP-12', 'TOI-1431', 'KELT-9')
+
+    def __init__(self, size, seed=0):
+        self.data = star_field((size, size), seed)
+
+    def frame(self, fileid):
+        day = fileid % 28 + 1
+        header = make_header(fileid)
+        header['DATE-OBS'] = f'2024-11-{day:02d}T21:14:05.250'
+        header['OBJECT'] = self.TARGETS[fileid % len(self.TARGETS)]
+        buffer = io.BytesIO()
+        fits.PrimaryHDU(self.data, header=header).writeto(buffer)
+        return buffer.getvalue()
+
+
+def seed_frames(args, factory, s3_store, backend_port):
+    fileids = list(range(FIRST_FILEID, FIRST_FILEID + args.frames))
+    started = time.perf_counter()
+    if args.no_db:
+        objects = s3_store.buckets[BUCKET]
+        for fileid in fileids:
+            objects[f'{fileid}.fits'] = S3Object(factory.frame(fileid), 'application/octet-stream')
+    else:
+        conn = http.client.HTTPConnection('127.0.0.1', backend_port, timeout=120)
+        for fileid in fileids:
+            status, body = upload(conn, factory.frame(fileid), f'{fileid}.fits')
+            if status != 200:
+                raise RuntimeError(f"Seeding {fileid} failed with {status}: {body[:300]!r}")
+        conn.close()
+    print(f"Seeded {len(fileids)} frames in {time.perf_counter() - started:.1f}s")
+    return fileids
+
+
+def upload(conn, data, filename):
+    boundary = uuid.uuid4().hex
+    body = (
+        f'--{boundary}\r\nContent-Disposition: form-data; name="file"; filename="{filename}"\r\n'
+        f'Content-Type: application/octet-stream\r\n\r\n'
+    ).encode() + data + f'\r\n--{boundary}--\r\n'.encode()
+    conn.request('POST', '/api/upload-fits/', body,
+                 {'Content-Type': f'multipart/form-data; boundary={boundary}'})
+    response = conn.getresponse()
+    return response.status, response.read()
+
+
+# -- workload ---------------------------------------------------------------
+
+class Workload:
+    """Builds one request per operation; runs on every worker thread"""
+
+    def __init__(self, fileids, backend_port, header_port, factory):
+        self.fileids = fileids
+        self.backend_port = backend_port
+        self.header_port = header_port
+        self.factory = factory
+        self._next_upload = FIRST_FILEID + 1_000_000
+        self._lock = threading.Lock()
+
+    def _file(self, rng):
+        return f'{rng.choice(self.fileids)}.fits'
+
+    def request(self, operation, rng):
+        """(port, method, path, body, headers) for one request of `operation`"""
+        backend, legacy = self.backend_port, self.header_port
+        if operation == 'header':
+            return backend, 'GET', '/api/fits-header/?' + urlencode({'file': self._file(rng)}), None, {}
+        if operation == 'metadata':
+            return backend, 'GET', '/api/fits-metadata/?' + urlencode({'file': self._file(rng)}), None, {}
+        if operation == 'metadata_batch':
+            body = json.dumps({'fileids': rng.sample(self.fileids, min(50, len(self.fileids)))}).encode()
+            return backend, 'POST', '/api/fits-metadata/batch/', body, {'Content-Type': 'application/json'}
+        if operation == 'render':
+            return backend, 'GET', '/api/fits-image-data/?' + urlencode({'file': self._file(rng)}), None, {}
+        if operation == 'raw':
+            start = rng.randrange(0, 100_000)
+            return (backend, 'GET', '/api/fits-raw/' + quote(self._file(rng)), None,
+                    {'Range': f'bytes={start}-{start + 65535}'})
+        if operation == 'search':
+            params = {'format': 'csv', 'target': rng.choice(FrameFactory.TARGETS)}
+            return backend, 'GET', '/api/export/?' + urlencode(params), None, {}
+        if operation == 'legacy_header':
+            return legacy, 'GET', '/fits-header?' + urlencode({'file': self._file(rng)}), None, {}
+        if operation == 'view':
+            return legacy, 'GET', '/view-fits?' + urlencode({'file': self._file(rng)}), None, {}
+        if operation == 'upload':
+            with self._lock:
+                fileid = self._next_upload
+                self._next_upload += 1
+            return backend, 'POST', '/api/upload-fits/', self.factory.frame(fileid), {'fileid': fileid}
+        raise ValueError(f"Unknown operation: {operation}")
+
+
+class Results:
+    def __init__(self):
+        self.latencies = defaultdict(list)
+        self.errors = defaultdict(int)
+        self.error_samples = {}
+        self.bytes = defaultdict(int)
+        self._lock = threading.Lock()
+
+    def record(self, operation, seconds, ok, size, detail=None):
+        with self._lock:
+            self.latencies[operation].append(seconds)
+            self.bytes[operation] += size
+            if not ok:
+                self.errors[operation] += 1
+                self.error_samples.setdefault(operation, detail)
+
+
+def percentile(sorted_values, fraction):
+    """Nearest-rank percentile of an already sorted list"""
+    index = max(int(round(fraction * len(sorted_values) + 0.5)) - 1, 0)
+    return sorted_values[min(index, len(sorted_values) - 1)]
+
+
+def worker(workload, operations, weights, stop, measure_from, results, seed):
+    rng = random.Random(seed)
+    connections = {}
+    while not stop.is_set():
+        operation = rng.choices(operations, weights)[0]
+        port, method, path, body, headers = workload.request(operation, rng)
+        conn = connections.get(port)
+        if conn is None:
+            conn = connections[port] = http.client.HTTPConnection('127.0.0.1', port, timeout=120)
+
+        started = time.perf_counter()
+        try:
+            if operation == 'upload':
+                status, payload = upload(conn, body, f"{headers['fileid']}.fits")
+            else:
+                conn.request(method, path, body, headers)
+                response = conn.getresponse()
+                status, payload = response.status, response.read()
+                if response.will_close:
+                    conn.close()
+                    connections.pop(port)
+            ok = 200 <= status < 300
+            detail = None if ok else f'{status}: {payload[:200]!r}'
+        except (OSError, http.client.HTTPException) as e:
+            conn.close()
+            connections.pop(port, None)
+            ok, payload, detail = False, b'', f'{type(e).__name__}: {e}'
+        elapsed = time.perf_counter() - started
+
+        if started >= measure_from:
+            results.record(operation, elapsed, ok, len(payload), detail)
+
+    for conn in connections.values():
+        conn.close()
+
+
+def run_load(workload, mix, concurrency, duration, warmup, seed):
+    operations = list(mix)
+    weights = [mix[op] for op in operations]
+    results = Results()
+    stop = threading.Event()
+    measure_from = time.perf_counter() + warmup
+    threads = [
+        threading.Thread(target=worker, daemon=True,
+                         args=(workload, operations, weights, stop, measure_from, results, seed + i))
+        for i in range(concurrency)
+    ]
+    for thread in threads:
+        thread.start()
+    time.sleep(warmup + duration)
+    stop.set()
+    for thread in threads:
+        thread.join(120)
+    return results
+
+
+def summarize(results, duration):
+    summary = {}
+    for operation in sorted(results.latencies):
+        values = sorted(results.latencies[operation])
+        summary[operation] = {
+            'requests': len(values),
+            'errors': results.errors[operation],
+            'rps': len(values) / duration,
+            'mb_per_s': results.bytes[operation] / duration / 1e6,
+            'mean_ms': statistics.fmean(values) * 1000,
+            'p50_ms': percentile(values, 0.50) * 1000,
+            'p95_ms': percentile(values, 0.95) * 1000,
+            'p99_ms': percentile(values, 0.99) * 1000,
+            'max_ms': values[-1] * 1000,
+        }
+    return summary
+
+
+def print_summary(summary, results):
+    print(f"\n{'operation':<16}{'requests':>9}{'errors':>8}{'req/s':>9}{'MB/s':>8}"
+          f"{'mean ms':>10}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}{'max ms':>9}")
+    for operation, s in summary.items():
+        print(f"{operation:<16}{s['requests']:>9}{s['errors']:>8}{s['rps']:>9.1f}{s['mb_per_s']:>8.2f}"
+              f"{s['mean_ms']:>10.1f}{s['p50_ms']:>9.1f}{s['p95_ms']:>9.1f}{s['p99_ms']:>9.1f}{s['max_ms']:>9.1f}")
+    total = sum(s['requests'] for s in summary.values())
+    errors = sum(s['errors'] for s in summary.values())
+    print(f"{'total':<16}{total:>9}{errors:>8}{sum(s['rps'] for s in summary.values()):>9.1f}")
+    for operation, detail in results.error_samples.items():
+        print(f"first {operation} error: {detail}")
+
+
+def parse_mix(value):
+    mix = {}
+    for item in value.split(','):
+        if item.strip():
+            name, _, weight = item.partition('=')
+            mix[name.strip()] = float(weight or 1)
+    return mix
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Load test the FITS backends against an in-memory S3 server')
+    parser.add_argument('--frames', type=int, default=100, help='Frames to seed (default: 100)')
+    parser.add_argument('--frame-size', type=int, default=512, help='Image side in pixels (default: 512)')
+    parser.add_argument('--concurrency', type=int, default=8, help='Concurrent workers (default: 8)')
+    parser.add_argument('--duration', type=float, default=30, help='Measured seconds (default: 30)')
+    parser.add_argument('--warmup', type=float, default=5, help='Unmeasured seconds first (default: 5)')
+    parser.add_argument('--mix', default=DEFAULT_MIX, help=f'Operation weights (default: {DEFAULT_MIX})')
+    parser.add_argument('--workers', type=int, default=1, help='serve.py workers per backend (default: 1)')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--pg-temp', action='store_true', help='Start a throwaway Postgres with initdb')
+    parser.add_argument('--reset-db', action='store_true', help='Truncate fits_headers before seeding')
+    parser.add_argument('--no-db', action='store_true', help='Skip Postgres and the operations that need it')
+    parser.add_argument('--output', help='Write the summary as JSON')
+    args = parser.parse_args()
+
+    mix = parse_mix(args.mix)
+    if args.no_db:
+        mix = {op: w for op, w in mix.items() if op not in DB_OPERATIONS}
+    if not mix:
+        parser.error('the mix is empty')
+
+    s3 = make_server(buckets=[BUCKET])
+    threading.Thread(target=s3.serve_forever, daemon=True).start()
+    s3_endpoint = f'127.0.0.1:{s3.server_address[1]}'
+
+    env = dict(os.environ, MINIO_ENDPOINT=s3_endpoint, MINIO_ACCESS_KEY=ACCESS_KEY,
+               MINIO_SECRET_KEY=SECRET_KEY, MINIO_BUCKET=BUCKET, PYTHONUNBUFFERED='1')
+    postgres = None
+    processes = []
+    log_dir = tempfile.mkdtemp(prefix='fits_loadtest_logs_')
+    try:
+        if args.pg_temp and not args.no_db:
+            postgres = TempPostgres()
+            env.update(postgres.start())
+        if not args.no_db:
+            db_env = {key: env.get(key, default) for key, default in (
+                ('DB_HOST', 'localhost'), ('DB_PORT', '5432'), ('DB_NAME', 'observatory'),
+                ('DB_USER', 'observatory_user'), ('DB_PASS', 'observatory_pass'))}
+            prepare_database(db_env, args.reset_db)
+
+        backend_port, header_port = free_port(), free_port()
+        processes.append(start_backend('minio_fits_backend', backend_port, env, log_dir, args.workers))
+        processes.append(start_backend('fits_header', header_port, env, log_dir, args.workers))
+        print(f"S3 at {s3_endpoint}, backend at :{backend_port}, fits_header at :{header_port}, logs in {log_dir}")
+
+        factory = FrameFactory(args.frame_size, args.seed)
+        fileids = seed_frames(args, factory, s3.store, backend_port)
+
+        workload = Workload(fileids, backend_port, header_port, factory)
+        print(f"Running {args.concurrency} workers for {args.duration:g}s "
+              f"(+{args.warmup:g}s warm-up), mix {mix}")
+        results = run_load(workload, mix, args.concurrency, args.duration, args.warmup, args.seed)
+        summary = summarize(results, args.duration)
+        print_summary(summary, results)
+
+        if args.output:
+            with open(args.output, 'w') as f:
+                json.dump({
+                    'created': time.strftime('%Y-%m-%dT%H:%M:%S'),
+                    'frames': args.frames, 'frame_size': args.frame_size,
+                    'concurrency': args.concurrency, 'duration': args.duration,
+                    'mix': mix, 'results': summary,
+                }, f, indent=2)
+            print(f"\nResults written to {args.output}")
+        return 1 if any(s['errors'] for s in summary.values()) else 0
+    finally:
+        for process in processes:
+            stop_process(process)
+        s3.shutdown()
+        if postgres is not None:
+            postgres.stop()
+
+
+if __name__ == '__main__':
+    sys.exit(main())
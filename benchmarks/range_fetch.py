@@ -0,0 +1,107 @@
+#!/usr/bin/env python3
+"""
+Single-stream fget_object versus parallel_fetch.RangeSpool.
+
+Uploads a float32 cube (--planes x --size x --size) and reports, for each
+fetcher, the time until the first plane is in memory and until the whole
+file is. By default the object is served by the in-memory S3 server
+(benchmarks/s3_fake.py); pass --endpoint to measure against a real MinIO,
+where the gain of several connections is what matters.
+
+Usage:
+    python benchmarks/range_fetch.py --size 2048 --planes 16
+    python benchmarks/range_fetch.py --endpoint localhost:9000 --access-key ... --secret-key ... --bucket dataarchive
+"""
+
+import argparse
+import os
+import sys
+import tempfile
+import threading
+import time
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_ROOT)
+
+import numpy as np
+from astropy.io import fits
+from minio import Minio
+
+from fits_compression import first_plane
+from parallel_fetch import RangeSpool, PART_SIZE, WORKERS
+
+OBJECT_NAME = 'range_fetch_benchmark.fits'
+
+
+def fget(client, bucket):
+    start = time.perf_counter()
+    with tempfile.NamedTemporaryFile(suffix='.fits') as tmp:
+        client.fget_object(bucket, OBJECT_NAME, tmp.name)
+        with fits.open(tmp.name) as hdul:
+            plane = np.array(first_plane(hdul[0]))
+            first = time.perf_counter() - start
+            hdul[0].data.sum()
+    return plane, first, time.perf_counter() - start
+
+
+def spool(client, bucket, part_size, workers):
+    start = time.perf_counter()
+    with RangeSpool(client, bucket, OBJECT_NAME, part_size=part_size, workers=workers) as s:
+        hdu = s.open()[0]
+        s.wait_for(hdu, planes=1)
+        plane = np.array(first_plane(hdu))
+        first = time.perf_counter() - start
+        s.wait_for(hdu)
+        hdu.data.sum()
+    return plane, first, time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark ranged parallel downloads')
+    parser.add_argument('--size', type=int, default=2048)
+    parser.add_argument('--planes', type=int, default=16)
+    parser.add_argument('--part-mb', type=int, default=PART_SIZE // (1024 * 1024))
+    parser.add_argument('--workers', type=int, default=WORKERS)
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--endpoint', help='MinIO endpoint (default: in-memory S3 server)')
+    parser.add_argument('--access-key', default='benchmark')
+    parser.add_argument('--secret-key', default='benchmark')
+    parser.add_argument('--bucket', default='benchmark')
+    args = parser.parse_args()
+
+    if args.endpoint:
+        endpoint = args.endpoint
+    else:
+        import s3_fake
+        server = s3_fake.make_server(buckets=[args.bucket])
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        endpoint = f'127.0.0.1:{server.server_address[1]}'
+    client = Minio(endpoint, access_key=args.access_key, secret_key=args.secret_key,
+                   secure=False, region='us-east-1')
+
+    cube = np.random.default_rng(0).normal(size=(args.planes, args.size, args.size)).astype(np.float32)
+    with tempfile.NamedTemporaryFile(suffix='.fits') as tmp:
+        fits.PrimaryHDU(cube).writeto(tmp.name, overwrite=True)
+        client.fput_object(args.bucket, OBJECT_NAME, tmp.name)
+    print(f"{cube.nbytes / 2**20:.0f} MiB cube, {args.part_mb} MiB ranges on {args.workers} connections\n")
+
+    try:
+        for label, fetch in (('fget_object', lambda: fget(client, args.bucket)),
+                             ('RangeSpool', lambda: spool(client, args.bucket, args.part_mb * 1024 * 1024,
+                                                          args.workers))):
+            runs = []
+            for _ in range(args.repeat):
+                plane, first, total = fetch()
+                if not np.array_equal(plane, cube[0]):
+                    print(f"{label} returned a wrong first plane", file=sys.stderr)
+                    return 1
+                runs.append((first, total))
+            first, total = min(runs)
+            print(f"{label:<14}first plane {first:>7.3f} s   whole file {total:>7.3f} s")
+    finally:
+        client.remove_object(args.bucket, OBJECT_NAME)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,229 @@
+#!/usr/bin/env python3
+"""
+Micro-benchmarks for the FITS processing paths.
+
+Times process_fits_image, FITSViewer._process_fits_file, header_to_row,
+matches_filters and the two render-to-PNG paths on synthetic files (see
+synthetic_fits.py) at several image sizes. Each case reports the best and
+median wall time over --repeat runs, plus the peak Python heap use
+(tracemalloc, which includes numpy arrays) measured in one extra run so it
+does not distort the timings.
+
+Usage:
+    python benchmarks/run_benchmarks.py --sizes 512,2048 --output results.json
+    python benchmarks/run_benchmarks.py --compare results.json --threshold 0.2
+
+--compare exits with status 1 if any case got slower by more than the
+threshold (fraction of the baseline median).
+"""
+
+import argparse
+import json
+import logging
+import os
+import platform
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_ROOT)
+
+import numpy as np
+from astropy.io import fits
+
+from synthetic_fits import SHAPES, generate_all
+
+# Micro-benchmarks run the call this many times per timing sample
+MICRO_LOOPS = 200
+
+FILTERS = {
+    'telescopes': ['2.5m'],
+    'instruments': ['PARAS2'],
+    'observationTypes': ['SCIENCE'],
+    'mode': '',
+    'observer': '',
+    'target': 'hd 209458',
+}
+
+
+def _load_targets():
+    """Import the code under test; the backends are imported without MinIO or DB access"""
+    import fits_header
+    import minio_fits_backend
+    from fits_viewer import FITSViewer
+    from fits_compression import primary_image_hdu, first_plane
+
+    viewer = FITSViewer(None, 'benchmark')
+
+    def process_image(path):
+        hdul = fits.open(path)
+        return lambda: fits_header.process_fits_image(hdul), hdul
+
+    def viewer_png(path):
+        return lambda: viewer._process_fits_file(path), None
+
+    def header_png(path):
+        hdul = fits.open(path)
+        return lambda: fits_header.render_png(hdul, 'benchmark'), hdul
+
+    def matplotlib_png(path):
+        hdul = fits.open(path)
+        return lambda: minio_fits_backend.render_image_png(first_plane(primary_image_hdu(hdul))), hdul
+
+    def header_to_row(path):
+        header = fits.getheader(path)
+
+        def run():
+            for _ in range(MICRO_LOOPS):
+                minio_fits_backend.header_to_row(header)
+        return run, None
+
+    def matches_filters(path):
+        header_list = [
+            {'Keyword': card.keyword, 'Value': str(card.value), 'Comment': card.comment}
+            for card in fits.getheader(path).cards
+        ]
+
+        def run():
+            for _ in range(MICRO_LOOPS):
+                fits_header.matches_filters(header_list, FILTERS)
+        return run, None
+
+    # name: (setup(path) -> (callable, hdul to close), shapes it applies to)
+    return {
+        'process_fits_image': (process_image, SHAPES),
+        'FITSViewer._process_fits_file': (viewer_png, ('mef_sci',)),
+        'fits_header.render_png': (header_png, SHAPES),
+        'render_image_png (matplotlib)': (matplotlib_png, ('float32_2d', 'int16_scaled', 'cube', 'float32_2d_gz')),
+        f'header_to_row x{MICRO_LOOPS}': (header_to_row, ('float32_2d',)),
+        f'matches_filters x{MICRO_LOOPS}': (matches_filters, ('float32_2d',)),
+    }
+
+
+def _run_once(setup, path, trace_memory=False):
+    # Setup (fits.open etc.) is not timed; every run reopens the file so
+    # lazy data loading is part of the measurement
+    func, hdul = setup(path)
+    try:
+        if trace_memory:
+            tracemalloc.start()
+            func()
+            peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+            return peak
+        start = time.perf_counter()
+        func()
+        return time.perf_counter() - start
+    finally:
+        if hdul is not None:
+            hdul.close()
+
+
+def run_case(setup, path, repeat):
+    times = [_run_once(setup, path) for _ in range(repeat)]
+    peak = _run_once(setup, path, trace_memory=True)
+    return {
+        'best_s': min(times),
+        'median_s': statistics.median(times),
+        'peak_mb': peak / 1e6,
+        'file_mb': os.path.getsize(path) / 1e6,
+    }
+
+
+def run(sizes, repeat, data_dir, only=None):
+    targets = _load_targets()
+    results = []
+    for size in sizes:
+        paths = generate_all(os.path.join(data_dir, str(size)), size)
+        for name, (setup, shapes) in targets.items():
+            if only and only not in name:
+                continue
+            for shape_name in shapes:
+                case = {'target': name, 'shape': shape_name, 'size': size}
+                try:
+                    case.update(run_case(setup, paths[shape_name], repeat))
+                except Exception as e:
+                    case['error'] = f'{type(e).__name__}: {e}'
+                results.append(case)
+                print(_format_row(case), flush=True)
+    return results
+
+
+def _format_row(case):
+    label = f"{case['target']:<32}{case['shape']:<15}{case['size']:>6}"
+    if 'error' in case:
+        return f"{label}  error: {case['error']}"
+    return (f"{label}{case['best_s'] * 1000:>11.1f}{case['median_s'] * 1000:>11.1f}"
+            f"{case['peak_mb']:>10.1f}{case['file_mb']:>9.1f}")
+
+
+def compare(results, baseline, threshold):
+    """Print cases slower than the baseline by more than threshold; return their count"""
+    previous = {(c['target'], c['shape'], c['size']): c for c in baseline['results'] if 'error' not in c}
+    regressions = 0
+    for case in results:
+        old = previous.get((case['target'], case['shape'], case['size']))
+        if old is None or 'error' in case:
+            continue
+        change = case['median_s'] / old['median_s'] - 1
+        if change > threshold:
+            regressions += 1
+            print(f"REGRESSION {case['target']} {case['shape']} {case['size']}: "
+                  f"{old['median_s'] * 1000:.1f} ms -> {case['median_s'] * 1000:.1f} ms ({change:+.0%})")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark FITS processing paths')
+    parser.add_argument('--sizes', default='512,2048', help='Comma separated image sides (default: 512,2048)')
+    parser.add_argument('--repeat', type=int, default=5, help='Timed runs per case (default: 5)')
+    parser.add_argument('--only', help='Run only targets whose name contains this string')
+    parser.add_argument('--data-dir', help='Keep generated files here (default: a temporary directory)')
+    parser.add_argument('--output', help='Write results as JSON')
+    parser.add_argument('--compare', help='Baseline JSON from an earlier --output run')
+    parser.add_argument('--threshold', type=float, default=0.2,
+                        help='Allowed median slowdown for --compare (default: 0.2 = 20%%)')
+    args = parser.parse_args()
+
+    # Benchmark at production log levels, whatever FITS_LOG_LEVELS says
+    logging.getLogger().setLevel(logging.WARNING)
+    for name in ('fits_header', 'fits_viewer', 'fits_image_cache'):
+        logging.getLogger(name).setLevel(logging.WARNING)
+
+    sizes = [int(s) for s in args.sizes.split(',') if s.strip()]
+    print(f"{'target':<32}{'shape':<15}{'size':>6}{'best ms':>11}{'median ms':>11}{'peak MB':>10}{'file MB':>9}")
+
+    if args.data_dir:
+        results = run(sizes, args.repeat, args.data_dir, args.only)
+    else:
+        with tempfile.TemporaryDirectory() as data_dir:
+            results = run(sizes, args.repeat, data_dir, args.only)
+
+    report = {
+        'created': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'astropy': __import__('astropy').__version__,
+        'machine': platform.machine(),
+        'repeat': args.repeat,
+        'results': results,
+    }
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+        print(f"\nResults written to {args.output}")
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        regressions = compare(results, baseline, args.threshold)
+        print(f"\n{regressions} regression(s) above {args.threshold:.0%}")
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
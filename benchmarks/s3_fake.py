@@ -0,0 +1,344 @@
+#!/usr/bin/env python3
+"""
+In-memory S3-compatible server for load tests.
+
+Implements the subset of the S3 API the backends use through the MinIO
+client: bucket create/exists/location, ListObjectsV2, GET (with Range),
+HEAD, PUT, DELETE and multipart uploads. Requests are not authenticated;
+any access key is accepted, so presigned URLs work as well.
+
+Usage:
+    python benchmarks/s3_fake.py --port 9100 --bucket dataarchive
+"""
+
+import argparse
+import hashlib
+import sys
+import threading
+import uuid
+from datetime import datetime, timezone
+from email.utils import format_datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit, parse_qs, unquote
+from xml.etree import ElementTree
+from xml.sax.saxutils import escape
+
+S3_NS = 'http://s3.amazonaws.com/doc/2006-03-01/'
+
+
+class S3Object:
+    __slots__ = ('data', 'etag', 'last_modified', 'content_type')
+
+    def __init__(self, data, content_type, etag=None):
+        self.data = data
+        self.etag = etag or hashlib.md5(data).hexdigest()
+        self.last_modified = datetime.now(timezone.utc)
+        self.content_type = content_type or 'application/octet-stream'
+
+
+class S3Store:
+    """Buckets, objects and pending multipart uploads, guarded by one lock"""
+
+    def __init__(self):
+        self.buckets = {}
+        self.uploads = {}
+        self.lock = threading.Lock()
+
+    def create_bucket(self, bucket):
+        with self.lock:
+            self.buckets.setdefault(bucket, {})
+
+
+class S3Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    server_version = 'S3Fake/1.0'
+    store = None
+
+    def log_message(self, format, *args):
+        pass
+
+    # -- helpers ---------------------------------------------------------
+
+    def _parse(self):
+        parts = urlsplit(self.path)
+        query = {k: v[0] for k, v in parse_qs(parts.query, keep_blank_values=True).items()}
+        path = unquote(parts.path).lstrip('/')
+        bucket, _, key = path.partition('/')
+        return bucket, key, query
+
+    def _body(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        data = self.rfile.read(length) if length else b''
+        if self.headers.get('x-amz-content-sha256', '').startswith('STREAMING-'):
+            data = _decode_aws_chunked(data)
+        return data
+
+    def _send(self, status, body=b'', headers=None, head=False):
+        self.send_response(status)
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.send_header('Content-Length', str(len(body)))
+        self.send_header('x-amz-request-id', uuid.uuid4().hex[:16].upper())
+        self.end_headers()
+        if body and not head:
+            self.wfile.write(body)
+
+    def _xml(self, status, xml, head=False):
+        body = ('<?xml version="1.0" encoding="UTF-8"?>\n' + xml).encode('utf-8')
+        self._send(status, body, {'Content-Type': 'application/xml'}, head)
+
+    def _error(self, status, code, message, bucket='', key='', head=False):
+        self._xml(status, (
+            f'<Error><Code>{code}</Code><Message>{escape(message)}</Message>'
+            f'<BucketName>{escape(bucket)}</BucketName><Key>{escape(key)}</Key>'
+            f'<Resource>/{escape(bucket)}/{escape(key)}</Resource>'
+            f'<RequestId>fake</RequestId><HostId>fake</HostId></Error>'
+        ), head)
+
+    def _object_headers(self, obj):
+        return {
+            'ETag': f'"{obj.etag}"',
+            'Last-Modified': format_datetime(obj.last_modified, usegmt=True),
+            'Content-Type': obj.content_type,
+            'Accept-Ranges': 'bytes',
+        }
+
+    def _bucket(self, bucket, key='', head=False):
+        objects = self.store.buckets.get(bucket)
+        if objects is None:
+            self._error(404, 'NoSuchBucket', 'The specified bucket does not exist', bucket, key, head)
+        return objects
+
+    # -- verbs -----------------------------------------------------------
+
+    def do_HEAD(self):
+        self._get(head=True)
+
+    def do_GET(self):
+        self._get(head=False)
+
+    def _get(self, head):
+        if self.path.startswith('/minio/health/'):
+            # Liveness probe of minio_cluster.MinioCluster
+            return self._send(200, head=head)
+        bucket, key, query = self._parse()
+        if not bucket:
+            names = ''.join(f'<Bucket><Name>{escape(b)}</Name></Bucket>' for b in sorted(self.store.buckets))
+            return self._xml(200, f'<ListAllMyBucketsResult xmlns="{S3_NS}"><Buckets>{names}</Buckets></ListAllMyBucketsResult>', head)
+        objects = self._bucket(bucket, key, head)
+        if objects is None:
+            return
+        if not key:
+            if 'location' in query:
+                return self._xml(200, f'<LocationConstraint xmlns="{S3_NS}"></LocationConstraint>', head)
+            if head:
+                return self._send(200, head=True)
+            if 'uploads' in query:
+                return self._xml(200, f'<ListMultipartUploadsResult xmlns="{S3_NS}"><Bucket>{escape(bucket)}</Bucket>'
+                                      f'<IsTruncated>false</IsTruncated></ListMultipartUploadsResult>')
+            return self._list_objects(bucket, objects, query)
+
+        if 'uploadId' in query:
+            return self._list_parts(bucket, key, query['uploadId'])
+
+        with self.store.lock:
+            obj = objects.get(key)
+        if obj is None:
+            return self._error(404, 'NoSuchKey', 'The specified key does not exist.', bucket, key, head)
+
+        headers = self._object_headers(obj)
+        size = len(obj.data)
+        byte_range = self.headers.get('Range')
+        if byte_range and byte_range.startswith('bytes='):
+            first, _, last = byte_range[6:].split(',')[0].partition('-')
+            if first:
+                start = int(first)
+                end = min(int(last), size - 1) if last else size - 1
+            else:
+                start, end = max(size - int(last), 0), size - 1
+            if start >= size or start > end:
+                return self._error(416, 'InvalidRange', 'The requested range is not satisfiable', bucket, key, head)
+            headers['Content-Range'] = f'bytes {start}-{end}/{size}'
+            return self._send(206, obj.data[start:end + 1], headers, head)
+        return self._send(200, obj.data, headers, head)
+
+    def _list_objects(self, bucket, objects, query):
+        prefix = query.get('prefix', '')
+        delimiter = query.get('delimiter', '')
+        max_keys = int(query.get('max-keys') or 1000)
+        after = query.get('continuation-token') or query.get('start-after') or ''
+        with self.store.lock:
+            names = sorted(k for k in objects if k.startswith(prefix) and k > after)
+            snapshot = {k: objects[k] for k in names}
+
+        contents, prefixes, seen_prefixes = [], [], set()
+        truncated, last_key = False, ''
+        for name in names:
+            if len(contents) + len(prefixes) >= max_keys:
+                truncated = True
+                break
+            last_key = name
+            if delimiter and delimiter in name[len(prefix):]:
+                common = name[:len(prefix) + name[len(prefix):].index(delimiter) + len(delimiter)]
+                if common not in seen_prefixes:
+                    seen_prefixes.add(common)
+                    prefixes.append(f'<CommonPrefixes><Prefix>{escape(common)}</Prefix></CommonPrefixes>')
+                continue
+            obj = snapshot[name]
+            contents.append(
+                f'<Contents><Key>{escape(name)}</Key>'
+                f'<LastModified>{obj.last_modified.strftime("%Y-%m-%dT%H:%M:%S.000Z")}</LastModified>'
+                f'<ETag>"{obj.etag}"</ETag><Size>{len(obj.data)}</Size>'
+                f'<StorageClass>STANDARD</StorageClass></Contents>'
+            )
+
+        token = f'<NextContinuationToken>{escape(last_key)}</NextContinuationToken>' if truncated else ''
+        self._xml(200, (
+            f'<ListBucketResult xmlns="{S3_NS}"><Name>{escape(bucket)}</Name>'
+            f'<Prefix>{escape(prefix)}</Prefix><KeyCount>{len(contents) + len(prefixes)}</KeyCount>'
+            f'<MaxKeys>{max_keys}</MaxKeys><Delimiter>{escape(delimiter)}</Delimiter>'
+            f'<IsTruncated>{"true" if truncated else "false"}</IsTruncated>{token}'
+            + ''.join(contents) + ''.join(prefixes) + '</ListBucketResult>'
+        ))
+
+    def _list_parts(self, bucket, key, upload_id):
+        with self.store.lock:
+            upload = self.store.uploads.get(upload_id)
+            parts = sorted(upload['parts'].items()) if upload else None
+        if parts is None:
+            return self._error(404, 'NoSuchUpload', 'The specified upload does not exist.', bucket, key)
+        xml = ''.join(
+            f'<Part><PartNumber>{n}</PartNumber><ETag>"{hashlib.md5(d).hexdigest()}"</ETag>'
+            f'<Size>{len(d)}</Size><LastModified>2000-01-01T00:00:00.000Z</LastModified></Part>'
+            for n, d in parts
+        )
+        self._xml(200, (
+            f'<ListPartsResult xmlns="{S3_NS}"><Bucket>{escape(bucket)}</Bucket><Key>{escape(key)}</Key>'
+            f'<UploadId>{upload_id}</UploadId><IsTruncated>false</IsTruncated>{xml}</ListPartsResult>'
+        ))
+
+    def do_PUT(self):
+        bucket, key, query = self._parse()
+        body = self._body()
+        if not key:
+            self.store.create_bucket(bucket)
+            return self._send(200)
+        objects = self._bucket(bucket, key)
+        if objects is None:
+            return
+
+        if 'uploadId' in query:
+            with self.store.lock:
+                upload = self.store.uploads.get(query['uploadId'])
+                if upload is not None:
+                    upload['parts'][int(query['partNumber'])] = body
+            if upload is None:
+                return self._error(404, 'NoSuchUpload', 'The specified upload does not exist.', bucket, key)
+            return self._send(200, headers={'ETag': f'"{hashlib.md5(body).hexdigest()}"'})
+
+        obj = S3Object(body, self.headers.get('Content-Type'))
+        with self.store.lock:
+            objects[key] = obj
+        self._send(200, headers={'ETag': f'"{obj.etag}"'})
+
+    def do_POST(self):
+        bucket, key, query = self._parse()
+        body = self._body()
+        objects = self._bucket(bucket, key)
+        if objects is None:
+            return
+
+        if 'uploads' in query:
+            upload_id = uuid.uuid4().hex
+            with self.store.lock:
+                self.store.uploads[upload_id] = {
+                    'bucket': bucket, 'key': key, 'parts': {},
+                    'content_type': self.headers.get('Content-Type'),
+                }
+            return self._xml(200, (
+                f'<InitiateMultipartUploadResult xmlns="{S3_NS}"><Bucket>{escape(bucket)}</Bucket>'
+                f'<Key>{escape(key)}</Key><UploadId>{upload_id}</UploadId></InitiateMultipartUploadResult>'
+            ))
+
+        if 'uploadId' in query:
+            numbers = [
+                int(el.text) for el in ElementTree.fromstring(body).iter()
+                if el.tag.endswith('PartNumber')
+            ]
+            with self.store.lock:
+                upload = self.store.uploads.pop(query['uploadId'], None)
+            if upload is None:
+                return self._error(404, 'NoSuchUpload', 'The specified upload does not exist.', bucket, key)
+            try:
+                data = b''.join(upload['parts'][n] for n in numbers)
+            except KeyError:
+                return self._error(400, 'InvalidPart', 'One or more of the specified parts could not be found.', bucket, key)
+            digests = b''.join(hashlib.md5(upload['parts'][n]).digest() for n in numbers)
+            obj = S3Object(data, upload['content_type'], f'{hashlib.md5(digests).hexdigest()}-{len(numbers)}')
+            with self.store.lock:
+                objects[key] = obj
+            return self._xml(200, (
+                f'<CompleteMultipartUploadResult xmlns="{S3_NS}"><Bucket>{escape(bucket)}</Bucket>'
+                f'<Key>{escape(key)}</Key><ETag>"{obj.etag}"</ETag></CompleteMultipartUploadResult>'
+            ))
+
+        self._error(400, 'NotImplemented', 'Unsupported POST request', bucket, key)
+
+    def do_DELETE(self):
+        bucket, key, query = self._parse()
+        objects = self._bucket(bucket, key)
+        if objects is None:
+            return
+        with self.store.lock:
+            if 'uploadId' in query:
+                self.store.uploads.pop(query['uploadId'], None)
+            else:
+                objects.pop(key, None)
+        self._send(204)
+
+
+def _decode_aws_chunked(data):
+    """Strip aws-chunked framing (`<hex size>;chunk-signature=...\\r\\n<data>\\r\\n`)"""
+    out = bytearray()
+    pos = 0
+    while pos < len(data):
+        line_end = data.index(b'\r\n', pos)
+        size = int(data[pos:line_end].split(b';')[0], 16)
+        if size == 0:
+            break
+        start = line_end + 2
+        out += data[start:start + size]
+        pos = start + size + 2
+    return bytes(out)
+
+
+def make_server(host='127.0.0.1', port=0, buckets=()):
+    """Create (but do not start) a threaded fake S3 server; port 0 picks a free port"""
+    store = S3Store()
+    for bucket in buckets:
+        store.create_bucket(bucket)
+    handler = type('BoundS3Handler', (S3Handler,), {'store': store})
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    server.store = store
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description='In-memory S3-compatible server')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=9100)
+    parser.add_argument('--bucket', action='append', default=[], help='Bucket to create (repeatable)')
+    args = parser.parse_args()
+
+    server = make_server(args.host, args.port, args.bucket)
+    print(f"Fake S3 listening on http://{args.host}:{server.server_address[1]}", flush=True)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,137 @@
+#!/usr/bin/env python3
+"""
+Synthetic FITS files shaped like the archive's real data.
+
+Each generator writes a star field (sky background, read noise and Gaussian
+sources) with a header carrying the keywords the ingest and search code
+reads. Output is deterministic for a given seed, so benchmark runs compare
+like with like.
+
+Usage:
+    python benchmarks/synthetic_fits.py <output_dir> [--size 1024]
+writes one file per shape into output_dir.
+"""
+
+import argparse
+import os
+import sys
+
+import numpy as np
+from astropy.io import fits
+
+# Keywords read by header_to_row() and matches_filters()
+BASE_HEADER = [
+    ('FILEID', 100001, 'Archive file id'),
+    ('DATE-OBS', '2024-11-02T21:14:05.250', 'UTC start of exposure'),
+    ('TELESCOP', '2.5m', 'Telescope'),
+    ('INSTRUME', 'PARAS2', 'Instrument'),
+    ('OBSTYPE', 'SCIENCE', 'Observation type'),
+    ('MODE', 'HR', 'Instrument mode'),
+    ('OBSERVER', 'SYNTHETIC', 'Observer'),
+    ('OBJECT', 'HD 209458', 'Target name'),
+    ('TARGNAME', 'HD209458', 'Target name'),
+    ('RA', '22:03:10.77', 'Right ascension'),
+    ('DEC', '+18:53:03.5', 'Declination'),
+    ('EQUINOX', 2000.0, 'Equinox of coordinates'),
+    ('AIRMASS', 1.132, 'Airmass at start'),
+    ('MOONANGL', 47.5, 'Moon angle [deg]'),
+    ('EXPTIME', 600.0, 'Exposure time [s]'),
+]
+
+# Real headers carry ~150 cards of instrument state
+FILLER_CARDS = 120
+
+SHAPES = ('float32_2d', 'int16_scaled', 'rgb', 'cube', 'mef_sci', 'float32_2d_gz')
+
+
+def star_field(shape, seed=0, n_stars=200, dtype=np.float32):
+    """Sky background plus noise and Gaussian stars, in ADU"""
+    rng = np.random.default_rng(seed)
+    ny, nx = shape
+    image = rng.normal(1000.0, 12.0, size=shape).astype(dtype)
+    ys = rng.uniform(0, ny, n_stars)
+    xs = rng.uniform(0, nx, n_stars)
+    fluxes = rng.lognormal(8.0, 1.2, n_stars)
+    sigma = 2.0
+    radius = int(4 * sigma)
+    for y, x, flux in zip(ys, xs, fluxes):
+        y0, y1 = max(int(y) - radius, 0), min(int(y) + radius + 1, ny)
+        x0, x1 = max(int(x) - radius, 0), min(int(x) + radius + 1, nx)
+        yy, xx = np.mgrid[y0:y1, x0:x1]
+        image[y0:y1, x0:x1] += (flux * np.exp(-((yy - y) ** 2 + (xx - x) ** 2) / (2 * sigma ** 2))).astype(dtype)
+    return image
+
+
+def make_header(fileid=100001, extra=()):
+    header = fits.Header()
+    for key, value, comment in BASE_HEADER:
+        header[key] = (fileid if key == 'FILEID' else value, comment)
+    for i in range(FILLER_CARDS):
+        header[f'HIERARCH INS STATE{i:03d}'] = (float(i) * 0.5, 'Instrument state')
+    for key, value, comment in extra:
+        header[key] = (value, comment)
+    return header
+
+
+def write_shape(shape_name, path, size, seed=0, fileid=100001):
+    """Write one synthetic file of the given shape; size is the image side in pixels"""
+    header = make_header(fileid)
+    if shape_name in ('float32_2d', 'float32_2d_gz'):
+        hdul = fits.HDUList([fits.PrimaryHDU(star_field((size, size), seed), header=header)])
+    elif shape_name == 'int16_scaled':
+        # Unsigned 16-bit detector counts stored as int16 with BZERO=32768
+        counts = np.clip(star_field((size, size), seed), 0, 65535).astype(np.uint16)
+        hdu = fits.PrimaryHDU(header=header)
+        hdu.data = counts
+        hdu.scale('int16', bzero=32768, bscale=1)
+        hdul = fits.HDUList([hdu])
+    elif shape_name == 'rgb':
+        planes = np.stack([star_field((size, size), seed + i) for i in range(3)])
+        hdul = fits.HDUList([fits.PrimaryHDU(planes, header=header)])
+    elif shape_name == 'cube':
+        # Deep cubes: many planes of half the side length
+        side = max(size // 2, 64)
+        planes = np.stack([star_field((side, side), seed + i, n_stars=50) for i in range(32)])
+        hdul = fits.HDUList([fits.PrimaryHDU(planes, header=header)])
+    elif shape_name == 'mef_sci':
+        # Empty primary with the image in a SCI extension, as FITSViewer expects
+        sci = fits.ImageHDU(star_field((size, size), seed), name='SCI')
+        err = fits.ImageHDU(np.full((size // 4, size // 4), 12.0, dtype=np.float32), name='ERR')
+        hdul = fits.HDUList([fits.PrimaryHDU(header=header), sci, err])
+    else:
+        raise ValueError(f"Unknown shape: {shape_name}")
+    hdul.writeto(path, overwrite=True)
+    return path
+
+
+def file_name(shape_name, size):
+    suffix = '.fits.gz' if shape_name.endswith('_gz') else '.fits'
+    return f'{shape_name}_{size}{suffix}'
+
+
+def generate_all(output_dir, size, seed=0):
+    """Write every shape at `size` into output_dir and return {shape: path}"""
+    os.makedirs(output_dir, exist_ok=True)
+    paths = {}
+    for i, shape_name in enumerate(SHAPES):
+        path = os.path.join(output_dir, file_name(shape_name, size))
+        if not os.path.exists(path):
+            write_shape(shape_name, path, size, seed=seed, fileid=100001 + i)
+        paths[shape_name] = path
+    return paths
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Write synthetic FITS files for benchmarking')
+    parser.add_argument('output_dir')
+    parser.add_argument('--size', type=int, default=1024, help='Image side in pixels (default: 1024)')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    for shape_name, path in generate_all(args.output_dir, args.size, args.seed).items():
+        print(f"{shape_name:<15} {os.path.getsize(path) / 1e6:8.2f} MB  {path}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
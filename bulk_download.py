@@ -0,0 +1,381 @@
+from flask import request, jsonify, Response, stream_with_context
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+import hashlib
+import json
+import queue
+import tarfile
+import threading
+import time
+import zipfile
+import logging
+
+from fits_search import build_search_query, SEARCH_PARAMS
+
+logger = logging.getLogger(__name__)
+
+# Object names tried, in order, for a fileid
+OBJECT_SUFFIXES = ('.fits', '.fits.fz', '.fits.gz')
+
+CHUNK_SIZE = 1024 * 1024
+# Chunks of the next object read ahead while the current one is streamed
+PREFETCH_CHUNKS = 8
+MAX_ENTRIES = 20000
+STAT_WORKERS = 16
+
+MANIFEST_NAME = 'MANIFEST.json'
+# Parameters of the archive itself; everything else must be a search filter
+ARCHIVE_PARAMS = frozenset({'files', 'fileids', 'format', 'resume_after', 'exclude'})
+
+
+class _StreamSink:
+    """
+    Write-only, non-seekable file object. zipfile falls back to data
+    descriptors for sinks without tell(), so nothing is ever rewritten.
+    """
+
+    def __init__(self):
+        self.chunks = []
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        data = b''.join(self.chunks)
+        self.chunks = []
+        return data
+
+
+class _PrefetchedObject:
+    """
+    Reads an object from MinIO on a background thread into a bounded queue,
+    so the next archive member downloads while the current one is sent.
+    """
+
+    _DONE = object()
+
+    def __init__(self, minio_client, bucket_name, entry):
+        self.entry = entry
+        self.chunks = queue.Queue(maxsize=PREFETCH_CHUNKS)
+        self.error = None
+        self.cancelled = False
+        self.thread = threading.Thread(
+            target=self._run, args=(minio_client, bucket_name), daemon=True
+        )
+        self.thread.start()
+
+    def _put(self, item):
+        while not self.cancelled:
+            try:
+                self.chunks.put(item, timeout=1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def _run(self, minio_client, bucket_name):
+        response = None
+        try:
+            response = minio_client.get_object(bucket_name, self.entry['name'])
+            for chunk in response.stream(CHUNK_SIZE):
+                if not self._put(chunk):
+                    return
+        except Exception as e:
+            self.error = e
+        finally:
+            if response is not None:
+                response.close()
+                response.release_conn()
+            self._put(self._DONE)
+
+    def __iter__(self):
+        while True:
+            chunk = self.chunks.get()
+            if chunk is self._DONE:
+                if self.error:
+                    raise self.error
+                return
+            yield chunk
+
+    def cancel(self):
+        self.cancelled = True
+
+
+def _tar_header(entry):
+    info = tarfile.TarInfo(entry['name'])
+    info.size = entry['size']
+    info.mtime = int(entry.get('mtime') or time.time())
+    info.mode = 0o644
+    return info.tobuf(format=tarfile.PAX_FORMAT)
+
+
+def _tar_padding(size):
+    return b'\0' * ((tarfile.BLOCKSIZE - size % tarfile.BLOCKSIZE) % tarfile.BLOCKSIZE)
+
+
+def build_manifest(entries, archive_format):
+    """Manifest describing an archive; the id changes if any object changes"""
+    digest = hashlib.sha256()
+    for entry in entries:
+        digest.update(f"{entry['name']}\0{entry['size']}\0{entry['etag']}\n".encode())
+    return {
+        'manifest_id': digest.hexdigest(),
+        'format': archive_format,
+        'created': datetime.now(timezone.utc).isoformat(),
+        'total_bytes': sum(e['size'] for e in entries),
+        'entries': [
+            {'name': e['name'], 'size': e['size'], 'etag': e['etag']} for e in entries
+        ],
+    }
+
+
+def tar_archive_size(entries, manifest_bytes):
+    """Exact byte size of the tar stream_archive() produces"""
+    size = len(_tar_header({'name': MANIFEST_NAME, 'size': len(manifest_bytes)}))
+    size += len(manifest_bytes) + len(_tar_padding(len(manifest_bytes)))
+    for entry in entries:
+        size += len(_tar_header(entry)) + entry['size'] + len(_tar_padding(entry['size']))
+    return size + 2 * tarfile.BLOCKSIZE
+
+
+def stream_archive(minio_client, bucket_name, entries, archive_format, manifest_bytes):
+    """
+    Yield a ZIP or tar archive of `entries`, with MANIFEST.json as the first
+    member. Object data is forwarded chunk by chunk; the next object is
+    prefetched while the current one is written.
+    """
+    sink = _StreamSink()
+    zf = None
+
+    if archive_format == 'zip':
+        zf = zipfile.ZipFile(sink, mode='w', compression=zipfile.ZIP_STORED, allowZip64=True)
+        zf.writestr(MANIFEST_NAME, manifest_bytes)
+        yield sink.drain()
+    else:
+        yield _tar_header({'name': MANIFEST_NAME, 'size': len(manifest_bytes)})
+        yield manifest_bytes + _tar_padding(len(manifest_bytes))
+
+    current = None
+    pending = _PrefetchedObject(minio_client, bucket_name, entries[0]) if entries else None
+    try:
+        for i, entry in enumerate(entries):
+            current = pending
+            pending = None
+            if i + 1 < len(entries):
+                pending = _PrefetchedObject(minio_client, bucket_name, entries[i + 1])
+
+            if zf is not None:
+                mtime = entry.get('mtime') or time.time()
+                info = zipfile.ZipInfo(entry['name'], date_time=time.localtime(mtime)[:6])
+                info.file_size = entry['size']
+                info.compress_type = zipfile.ZIP_STORED
+                with zf.open(info, mode='w') as member:
+                    for chunk in current:
+                        member.write(chunk)
+                        yield sink.drain()
+                yield sink.drain()
+            else:
+                yield _tar_header(entry)
+                written = 0
+                for chunk in current:
+                    written += len(chunk)
+                    yield chunk
+                if written != entry['size']:
+                    raise IOError(f"{entry['name']} changed size during download")
+                yield _tar_padding(entry['size'])
+
+            logger.debug("Archived %s (%d bytes)", entry['name'], entry['size'])
+
+        if zf is not None:
+            zf.close()
+            yield sink.drain()
+        else:
+            yield b'\0' * (2 * tarfile.BLOCKSIZE)
+    finally:
+        # Stops the reader threads if the client disconnected mid-archive
+        for reader in (current, pending):
+            if reader is not None:
+                reader.cancel()
+
+
+def setup_bulk_download_route(app, minio_client, bucket_name, get_conn, release_conn):
+    """Register the bulk download endpoints on `app`"""
+
+    def stat_entry(name):
+        stat = minio_client.stat_object(bucket_name, name)
+        return {
+            'name': name,
+            'size': stat.size,
+            'etag': stat.etag,
+            'mtime': stat.last_modified.timestamp() if stat.last_modified else None,
+        }
+
+    def resolve_fileid(fileid):
+        for suffix in OBJECT_SUFFIXES:
+            try:
+                return stat_entry(f"{fileid}{suffix}")
+            except Exception:
+                continue
+        return None
+
+    def resolve_entries(params):
+        """Turn files / fileids / search parameters into sorted archive entries"""
+        files = params.get('files') or []
+        fileids = params.get('fileids') or []
+        if isinstance(files, str):
+            files = [f for f in files.split(',') if f.strip()]
+        if isinstance(fileids, str):
+            fileids = [f for f in fileids.split(',') if f.strip()]
+
+        search = params.get('search')
+        if search is not None:
+            conn = get_conn()
+            try:
+                sql, sql_params = build_search_query(search, ['fileid'])
+                with conn.cursor() as cur:
+                    cur.execute(sql + f" LIMIT {MAX_ENTRIES + 1}", sql_params)
+                    fileids = list(fileids) + [r[0] for r in cur.fetchall()]
+                conn.rollback()
+            finally:
+                release_conn(conn)
+
+        if len(files) + len(fileids) > MAX_ENTRIES:
+            raise ValueError(f"At most {MAX_ENTRIES} files per archive")
+
+        missing = []
+        with ThreadPoolExecutor(max_workers=STAT_WORKERS) as pool:
+            by_name = list(pool.map(lambda n: (n, _try(stat_entry, n)), files))
+            by_id = list(pool.map(lambda f: (f, resolve_fileid(int(f))), fileids))
+
+        entries = {}
+        for key, entry in by_name + by_id:
+            if entry is None:
+                missing.append(str(key))
+            else:
+                entries[entry['name']] = entry
+        return [entries[name] for name in sorted(entries)], missing
+
+    def read_params():
+        """
+        Request parameters; ValueError for unknown ones, so that a typo or a
+        cache-buster does not turn into a search of the whole archive
+        """
+        if request.method == 'POST':
+            params = request.get_json(silent=True) or {}
+            unknown = set(params) - ARCHIVE_PARAMS - {'search'}
+        else:
+            params = request.args.to_dict()
+            # Search filters are the query parameters fits_search knows
+            search = {k: v for k, v in params.items() if k in SEARCH_PARAMS and k != 'fileids' and v.strip()}
+            if search:
+                params['search'] = search
+            unknown = set(request.args) - ARCHIVE_PARAMS - SEARCH_PARAMS
+        search = params.get('search')
+        if search is not None and not isinstance(search, dict):
+            raise ValueError("search must be an object of search parameters")
+        if isinstance(search, dict):
+            unknown |= set(search) - SEARCH_PARAMS
+            if not any(search.values()):
+                raise ValueError("search needs at least one filter")
+        if unknown:
+            raise ValueError(f"Unknown parameters: {', '.join(sorted(unknown))}")
+        return params
+
+    @app.route('/api/bulk-download/manifest/', methods=['GET', 'POST'])
+    def bulk_download_manifest():
+        """
+        List the objects an archive request would contain, with sizes and
+        ETags. Accepts the same parameters as /api/bulk-download/.
+        """
+        try:
+            params = read_params()
+            archive_format = params.get('format', 'zip')
+            entries, missing = resolve_entries(params)
+        except (ValueError, TypeError) as e:
+            return jsonify({'error': str(e)}), 400
+        except Exception as e:
+            logger.error("Error building manifest: %s", e)
+            return jsonify({'error': str(e)}), 500
+
+        manifest = build_manifest(entries, archive_format)
+        manifest['missing'] = missing
+        return jsonify(manifest)
+
+    @app.route('/api/bulk-download/', methods=['GET', 'POST'])
+    def bulk_download():
+        """
+        Stream many FITS objects as one ZIP or tar archive.
+
+        Parameters (JSON body for POST, query string for GET):
+            files: object names
+            fileids: file ids, resolved to <fileid>.fits, .fits.fz or .fits.gz
+            search: fits_headers search filters (see fits_search.py);
+                    for GET, the filters are given as query parameters
+                    (start, end, instruments, ...); other parameters are
+                    rejected
+            format: zip (default) or tar
+            resume_after: skip entries up to and including this object name
+            exclude: object names already downloaded
+
+        Entries are sorted by name and MANIFEST.json is written first, so an
+        interrupted download can be resumed with resume_after set to the
+        last complete member.
+        """
+        try:
+            params = read_params()
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        archive_format = params.get('format', 'zip')
+        if archive_format not in ('zip', 'tar'):
+            return jsonify({'error': 'format must be zip or tar'}), 400
+
+        try:
+            entries, missing = resolve_entries(params)
+        except (ValueError, TypeError) as e:
+            return jsonify({'error': str(e)}), 400
+        except Exception as e:
+            logger.error("Error resolving bulk download: %s", e)
+            return jsonify({'error': str(e)}), 500
+
+        if not entries:
+            return jsonify({'error': 'No matching objects found', 'missing': missing}), 404
+
+        manifest = build_manifest(entries, archive_format)
+        manifest['missing'] = missing
+
+        resume_after = params.get('resume_after')
+        if resume_after:
+            entries = [e for e in entries if e['name'] > resume_after]
+        exclude = params.get('exclude') or []
+        if isinstance(exclude, str):
+            exclude = exclude.split(',')
+        if exclude:
+            exclude = set(exclude)
+            entries = [e for e in entries if e['name'] not in exclude]
+
+        logger.info("Bulk download of %d objects (%d bytes) as %s",
+                    len(entries), sum(e['size'] for e in entries), archive_format)
+
+        manifest_bytes = json.dumps(manifest, indent=2).encode('utf-8')
+        filename = f"fits_{manifest['manifest_id'][:12]}.{archive_format}"
+        response = Response(
+            stream_with_context(stream_archive(minio_client, bucket_name, entries, archive_format, manifest_bytes)),
+            mimetype='application/zip' if archive_format == 'zip' else 'application/x-tar'
+        )
+        response.headers['Content-Disposition'] = f'attachment; filename="{filename}"'
+        response.headers['X-Manifest-Id'] = manifest['manifest_id']
+        if archive_format == 'tar':
+            # The tar layout is fully determined by the entry sizes
+            response.headers['Content-Length'] = str(tar_archive_size(entries, manifest_bytes))
+        return response
+
+
+def _try(func, *args):
+    try:
+        return func(*args)
+    except Exception:
+        return None
@@ -0,0 +1,114 @@
+from flask import request
+from collections import OrderedDict
+from datetime import timezone
+import hashlib
+import os
+import threading
+import time
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Bump when a renderer's output changes for the same source object, so
+# clients holding old ETags re-download
+RENDER_VERSION = '1'
+
+# Seconds a source object's validators are trusted without asking MinIO or
+# Postgres again. invalidate() only reaches the worker it is called in, so
+# other serve.py workers may answer with the previous version for this long
+VALIDATOR_TTL = int(os.environ.get('VALIDATOR_TTL', '10'))
+
+
+class ValidatorCache:
+    def __init__(self, ttl=VALIDATOR_TTL, max_entries=50000):
+        """
+        Short-lived cache of (etag, last_modified) per source, so a revalidation
+        can be answered with 304 without touching MinIO or the database.
+
+        Args:
+            ttl (int): seconds an entry is used before the source is checked again
+            max_entries (int): least recently used entries beyond this are dropped
+        """
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, loader):
+        """
+        Return cached validators for `key`, calling loader() on a miss. A
+        None result (no such row or object) is not cached, so a file stored
+        meanwhile, possibly by another worker, is found at once.
+        """
+        now = time.monotonic()
+        with self._lock:
+            cached = self._entries.get(key)
+            if cached is not None and cached[0] > now:
+                self._entries.move_to_end(key)
+                return cached[1]
+
+        validators = loader()
+        if validators is None:
+            return None
+        with self._lock:
+            self._entries[key] = (now + self.ttl, validators)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return validators
+
+    def invalidate(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+
+def stat_validators(minio_client, bucket_name, object_name):
+    """(etag, last_modified) of a MinIO object"""
+    stat = minio_client.stat_object(bucket_name, object_name)
+    return stat.etag, stat.last_modified
+
+
+def make_etag(source_tag, *params):
+    """
+    Strong ETag for an artifact derived from a source version (object ETag
+    or row timestamp) and the parameters it was rendered with.
+    """
+    digest = hashlib.sha256(RENDER_VERSION.encode())
+    for part in (source_tag,) + params:
+        digest.update(b'\0' + str(part).encode())
+    return digest.hexdigest()[:32]
+
+
+def not_modified(app, etag, last_modified=None):
+    """
+    Return a 304 response if the request's If-None-Match or If-Modified-Since
+    shows the client's copy is current, otherwise None. If-None-Match takes
+    precedence over If-Modified-Since (RFC 9110 13.2.2).
+    """
+    if request.if_none_match:
+        fresh = request.if_none_match.contains(etag)
+    elif request.if_modified_since and last_modified is not None:
+        # HTTP dates have one second resolution
+        fresh = _to_utc(last_modified).replace(microsecond=0) <= _to_utc(request.if_modified_since)
+    else:
+        fresh = False
+
+    if not fresh:
+        return None
+    response = app.response_class(status=304)
+    return set_validators(response, etag, last_modified)
+
+
+def set_validators(response, etag, last_modified=None, cache_control='no-cache'):
+    """Attach ETag, Last-Modified and Cache-Control to a response"""
+    response.set_etag(etag)
+    if last_modified is not None:
+        response.last_modified = _to_utc(last_modified)
+    response.headers['Cache-Control'] = cache_control
+    return response
+
+
+def _to_utc(value):
+    if value.tzinfo is None:
+        return value.replace(tzinfo=timezone.utc)
+    return value.astimezone(timezone.utc)
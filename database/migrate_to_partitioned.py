@@ -0,0 +1,198 @@
+#!/usr/bin/env python3
+"""
+Migrate an existing fits_headers heap table to the partitioned layout in schema.sql
+
+The old table is renamed to fits_headers_legacy, the partitioned table is
+created from schema.sql, monthly partitions are created for every month that
+has data (plus a few months ahead), and rows are copied one month at a time in
+observation order so the BRIN indexes stay tight. Each month is committed on
+its own, so an interrupted run can simply be started again.
+
+Usage:
+    python database/migrate_to_partitioned.py [--months-ahead 3] [--drop-legacy] [--dry-run]
+"""
+
+import argparse
+import os
+import sys
+from datetime import date
+
+import psycopg2
+
+DB_CONFIG = {
+    "host": os.environ.get("DB_HOST", "localhost"),
+    "database": os.environ.get("DB_NAME", "observatory"),
+    "user": os.environ.get("DB_USER", "observatory_user"),
+    "password": os.environ.get("DB_PASS", "observatory_pass"),
+    "port": os.environ.get("DB_PORT", "5432")
+}
+
+SCHEMA_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "schema.sql")
+
+LEGACY_TABLE = "fits_headers_legacy"
+
+
+def add_months(d, months):
+    """Return the first day of the month `months` after the month of `d`"""
+    month_index = d.year * 12 + (d.month - 1) + months
+    return date(month_index // 12, month_index % 12 + 1, 1)
+
+
+def table_kind(cur, name):
+    """Return pg_class.relkind for a table ('r' heap, 'p' partitioned) or None"""
+    cur.execute("SELECT relkind FROM pg_class WHERE oid = to_regclass(%s)", (name,))
+    row = cur.fetchone()
+    return row[0] if row else None
+
+
+def legacy_columns(cur):
+    cur.execute("""
+        SELECT column_name FROM information_schema.columns
+        WHERE table_name = %s ORDER BY ordinal_position
+    """, (LEGACY_TABLE,))
+    return [r[0] for r in cur.fetchall()]
+
+
+def create_partitioned_table(conn, dry_run):
+    """Rename the heap table out of the way and create the partitioned one"""
+    with open(SCHEMA_PATH) as f:
+        schema_sql = f.read()
+
+    with conn.cursor() as cur:
+        print(f"Renaming fits_headers to {LEGACY_TABLE}")
+        cur.execute(f"ALTER TABLE fits_headers RENAME TO {LEGACY_TABLE}")
+        # Free the sequence name so the new BIGSERIAL gets the usual one
+        cur.execute(f"ALTER SEQUENCE IF EXISTS fits_headers_id_seq RENAME TO {LEGACY_TABLE}_id_seq")
+        print("Creating partitioned fits_headers from schema.sql")
+        cur.execute(schema_sql)
+
+    if dry_run:
+        conn.rollback()
+    else:
+        conn.commit()
+
+
+def copy_rows(conn, months_ahead, dry_run):
+    with conn.cursor() as cur:
+        cols = ", ".join(legacy_columns(cur))
+        cur.execute(f"SELECT min(obs_date), max(obs_date), count(*) FROM {LEGACY_TABLE}")
+        first_night, last_night, total = cur.fetchone()
+        print(f"{total} rows to migrate, nights {first_night} .. {last_night}")
+
+    months = []
+    if first_night is not None:
+        month = add_months(first_night, 0)
+        while month <= last_night:
+            months.append(month)
+            month = add_months(month, 1)
+
+    # Pre-create upcoming months so ingest never has to
+    this_month = add_months(date.today(), 0)
+    for i in range(months_ahead + 1):
+        upcoming = add_months(this_month, i)
+        if upcoming not in months:
+            with conn.cursor() as cur:
+                cur.execute("SELECT fits_headers_ensure_partition(%s)", (upcoming,))
+                print(f"Created partition {cur.fetchone()[0]}")
+            if not dry_run:
+                conn.commit()
+
+    copy_query = f"""
+        INSERT INTO fits_headers ({cols})
+        SELECT {cols} FROM {LEGACY_TABLE}
+        WHERE {{where}}
+        ORDER BY date_obs NULLS LAST, id
+        ON CONFLICT (fileid, obs_date) DO NOTHING
+    """
+
+    copied = 0
+    for month in months:
+        with conn.cursor() as cur:
+            cur.execute("SELECT fits_headers_ensure_partition(%s)", (month,))
+            partition = cur.fetchone()[0]
+            cur.execute(
+                copy_query.format(where="obs_date >= %s AND obs_date < %s"),
+                (month, add_months(month, 1))
+            )
+            copied += cur.rowcount
+            print(f"{partition}: {cur.rowcount} rows")
+        if dry_run:
+            conn.rollback()
+        else:
+            conn.commit()
+
+    with conn.cursor() as cur:
+        cur.execute(copy_query.format(where="obs_date IS NULL"))
+        copied += cur.rowcount
+        print(f"fits_headers_default: {cur.rowcount} rows without obs_date")
+
+        cur.execute("SELECT setval(pg_get_serial_sequence('fits_headers', 'id'), "
+                    f"GREATEST((SELECT max(id) FROM {LEGACY_TABLE}), 1))")
+        cur.execute("ANALYZE fits_headers")
+    if dry_run:
+        conn.rollback()
+    else:
+        conn.commit()
+
+    return total, copied
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Migrate fits_headers to the partitioned schema")
+    parser.add_argument("--months-ahead", type=int, default=3,
+                        help="Number of future monthly partitions to create (default: 3)")
+    parser.add_argument("--drop-legacy", action="store_true",
+                        help=f"Drop {LEGACY_TABLE} after a complete copy")
+    parser.add_argument("--dry-run", action="store_true",
+                        help="Create the new schema in a transaction and roll it back")
+    args = parser.parse_args()
+
+    conn = psycopg2.connect(**DB_CONFIG)
+    conn.autocommit = False
+
+    try:
+        with conn.cursor() as cur:
+            current = table_kind(cur, "fits_headers")
+            legacy = table_kind(cur, LEGACY_TABLE)
+
+        if current == "r":
+            create_partitioned_table(conn, args.dry_run)
+            if args.dry_run:
+                print("Dry run: stopping after the schema step, nothing was changed")
+                return 0
+        elif current == "p" and legacy is None:
+            print("fits_headers is already partitioned, nothing to migrate")
+            return 0
+        elif current is None:
+            print("fits_headers does not exist, load schema.sql instead")
+            return 1
+        else:
+            print(f"Resuming copy from existing {LEGACY_TABLE}")
+
+        total, copied = copy_rows(conn, args.months_ahead, args.dry_run)
+
+        with conn.cursor() as cur:
+            cur.execute("SELECT count(*) FROM fits_headers")
+            migrated = cur.fetchone()[0]
+        print(f"Copied {copied} rows this run, fits_headers now holds {migrated}/{total}")
+
+        if args.drop_legacy:
+            if migrated < total:
+                print(f"Not dropping {LEGACY_TABLE}: copy is incomplete")
+                return 1
+            with conn.cursor() as cur:
+                cur.execute(f"DROP TABLE {LEGACY_TABLE}")
+            conn.commit()
+            print(f"Dropped {LEGACY_TABLE}")
+        return 0
+
+    except Exception as e:
+        conn.rollback()
+        print(f"Migration failed: {e}")
+        return 1
+    finally:
+        conn.close()
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,8 +1,14 @@
+-- fits_headers is range-partitioned by observation night (obs_date), one
+-- partition per month. Rows without a DATE-OBS land in the default partition.
+-- Partitions are created on demand by fits_headers_ensure_partition(), which
+-- header_mapping.ensure_partitions() calls in an autocommit transaction of
+-- its own before an upsert starts (creating a partition locks fits_headers
+-- until commit), and ahead of time by database/migrate_to_partitioned.py.
     CREATE TABLE fits_headers (
 
     -- Primary identity
-    id BIGSERIAL PRIMARY KEY,
-    fileid BIGINT UNIQUE NOT NULL,
+    id BIGSERIAL NOT NULL,
+    fileid BIGINT NOT NULL,
 
     -- FITS core
     simple BOOLEAN,
@@ -74,9 +80,64 @@
 
     -- FITS scaling
     o_bzero INTEGER,
-    bscale INTEGER,
-    bzero INTEGER,
+    bscale DOUBLE PRECISION,
+    bzero DOUBLE PRECISION,
 
     -- Metadata
-    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    -- Set on every upsert; Last-Modified/ETag of /api/fits-metadata/
+    updated_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+
+    -- A unique index on a partitioned table must contain the partition key,
+    -- so uniqueness is on (fileid, obs_date). NULLS NOT DISTINCT keeps files
+    -- without an observation date unique too. insert_header() upserts with
+    -- ON CONFLICT (fileid, obs_date) and removes the row from its old night
+    -- first if a file's DATE-OBS changes, so fileid stays unique overall.
+    CONSTRAINT fits_headers_fileid_obs_date_key UNIQUE NULLS NOT DISTINCT (fileid, obs_date)
+) PARTITION BY RANGE (obs_date);
+
+CREATE TABLE fits_headers_default PARTITION OF fits_headers DEFAULT;
+
+-- Frames are inserted roughly in observation order, so within a partition
+-- the physical order follows time and BRIN summaries stay tight while costing
+-- a few pages per partition. The B-tree serves lookups by id.
+CREATE INDEX fits_headers_date_obs_brin ON fits_headers USING BRIN (date_obs) WITH (pages_per_range = 32);
+CREATE INDEX fits_headers_obs_date_brin ON fits_headers USING BRIN (obs_date) WITH (pages_per_range = 32);
+CREATE INDEX fits_headers_obs_mjd_brin ON fits_headers USING BRIN (obs_mjd) WITH (pages_per_range = 32);
+CREATE INDEX fits_headers_id_idx ON fits_headers (id);
+
+-- Create the monthly partition holding `night` if it does not exist yet and
+-- return its name. Safe to call before every insert: the common case is a
+-- single catalog lookup.
+CREATE OR REPLACE FUNCTION fits_headers_ensure_partition(night DATE)
+RETURNS TEXT AS $$
+DECLARE
+    month_start DATE := date_trunc('month', night)::DATE;
+    month_end DATE := (date_trunc('month', night) + INTERVAL '1 month')::DATE;
+    partition_name TEXT := 'fits_headers_' || to_char(night, 'YYYY_MM');
+BEGIN
+    IF to_regclass(partition_name) IS NULL THEN
+        EXECUTE format(
+            'CREATE TABLE IF NOT EXISTS %I PARTITION OF fits_headers FOR VALUES FROM (%L) TO (%L)',
+            partition_name, month_start, month_end
+        );
+    END IF;
+    RETURN partition_name;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Content hashes of files uploaded through /api/upload-fits/, so that
+-- uploading the same bytes again skips the MinIO write and the upsert (see
+-- ingest_dedup.py). `storage` is the compression the object was stored
+-- with ('' or 'gz' for as uploaded); uploading a fileid again replaces its entries.
+CREATE TABLE fits_content_hashes (
+    content_hash CHAR(64) NOT NULL,
+    storage VARCHAR(50) NOT NULL,
+    fileid BIGINT NOT NULL,
+    object_name TEXT NOT NULL,
+    size BIGINT NOT NULL,
+    created_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+    PRIMARY KEY (content_hash, storage)
 );
+
+CREATE INDEX fits_content_hashes_fileid_idx ON fits_content_hashes (fileid);
@@ -0,0 +1,230 @@
+#!/usr/bin/env python3
+"""
+FITS tile compression (the fpack layout) for ingest, and helpers that let
+read paths treat compressed and uncompressed files the same way.
+
+Compressed files keep an empty primary HDU and store each image as a
+CompImageHDU extension; when the original primary array is compressed its
+keywords move to that extension (ZSIMPLE = T). astropy decompresses
+CompImageHDU transparently, and `.section` decompresses only the tiles that
+overlap the requested slice.
+
+Usage:
+    python fits_compression.py <fits_file> [--type RICE_1] [--quantize-level 16]
+reports space savings and read latency of the compressed copy against the
+original file.
+"""
+
+import argparse
+import os
+import sys
+import tempfile
+import time
+import logging
+
+import numpy as np
+from astropy.io import fits
+
+logger = logging.getLogger(__name__)
+
+COMPRESSION_TYPES = {
+    'rice': 'RICE_1',
+    'hcompress': 'HCOMPRESS_1',
+    'gzip': 'GZIP_2',
+    'plio': 'PLIO_1',
+}
+
+COMPRESSED_SUFFIX = '.fits.fz'
+
+# PLIO only stores integers in [0, 2**24): masks and similar images
+PLIO_MAX = 2 ** 24
+
+
+def _plio_range(data):
+    """True if PLIO can store `data`: integers, all in [0, PLIO_MAX)"""
+    if not np.issubdtype(data.dtype, np.integer):
+        return False
+    return data.size == 0 or (int(data.min()) >= 0 and int(data.max()) < PLIO_MAX)
+
+
+def _compressed_hdu(data, header, compression_type, quantize_level):
+    """Build a CompImageHDU, keeping float data lossless unless quantization was asked for"""
+    if compression_type == 'PLIO_1' and not _plio_range(data):
+        logger.info("Image is not integer data in [0, %d); using RICE_1 instead of PLIO_1", PLIO_MAX)
+        compression_type = 'RICE_1'
+    kwargs = {'compression_type': compression_type}
+    if np.issubdtype(data.dtype, np.floating):
+        if quantize_level is None:
+            # Rice and HCOMPRESS always quantize floats; only GZIP without
+            # quantization is lossless
+            kwargs = {'compression_type': 'GZIP_2', 'quantize_level': 0}
+        else:
+            kwargs['quantize_level'] = quantize_level
+    if compression_type == 'HCOMPRESS_1' and data.ndim > 2:
+        # HCOMPRESS tiles must be 2D
+        kwargs['tile_shape'] = (1,) * (data.ndim - 2) + data.shape[-2:]
+    hdu = fits.CompImageHDU(data=data, header=header, do_not_scale_image_data=True, **kwargs)
+    # The constructor drops the scaling keywords of the stored integers
+    for key in ('BSCALE', 'BZERO', 'BLANK'):
+        if key in header:
+            hdu.header[key] = header[key]
+    return hdu
+
+
+def compress_fits_file(src_path, dst_path, compression_type='RICE_1', quantize_level=None):
+    """
+    Write a tile-compressed copy of a FITS file (plain or .gz).
+
+    Image HDUs with data are compressed, everything else is copied as is.
+    Integer images are compressed losslessly with any algorithm; float
+    images are only quantized (lossy) when quantize_level is given. PLIO_1
+    is only used for integer images within [0, 2**24), such as masks;
+    other images get RICE_1.
+
+    Returns:
+        dict: compression_type (as actually used), raw_bytes, image_bytes,
+        compressed_bytes, ratio, seconds
+    """
+    start = time.perf_counter()
+    out = []
+    used_types = set()
+    # Keep the stored integers and BSCALE/BZERO, so nothing is rescaled
+    with fits.open(src_path, do_not_scale_image_data=True) as hdul:
+        raw_bytes = 0
+        for i, hdu in enumerate(hdul):
+            is_image = isinstance(hdu, (fits.PrimaryHDU, fits.ImageHDU))
+            if is_image and hdu.data is not None:
+                raw_bytes += hdu.data.nbytes
+                header = hdu.header.copy()
+                if i == 0:
+                    out.append(fits.PrimaryHDU())
+                compressed = _compressed_hdu(hdu.data, header, compression_type, quantize_level)
+                used_types.add(compressed.compression_type)
+                out.append(compressed)
+            else:
+                out.append(hdu.copy() if i > 0 else fits.PrimaryHDU(header=hdu.header.copy()))
+        fits.HDUList(out).writeto(dst_path, overwrite=True)
+
+    compressed_bytes = os.path.getsize(dst_path)
+    file_bytes = os.path.getsize(src_path)
+    return {
+        'compression_type': ', '.join(sorted(used_types)) or None,
+        'raw_bytes': file_bytes,
+        'image_bytes': raw_bytes,
+        'compressed_bytes': compressed_bytes,
+        'ratio': round(file_bytes / compressed_bytes, 3) if compressed_bytes else None,
+        'seconds': round(time.perf_counter() - start, 3),
+    }
+
+
+def is_compressed_primary(hdul):
+    """True if the primary image of this file was moved into a CompImageHDU"""
+    return (
+        len(hdul) > 1
+        and hdul[0].header.get('NAXIS', 0) == 0
+        and isinstance(hdul[1], fits.CompImageHDU)
+        and hdul[1].header.get('SIMPLE', False)
+    )
+
+
+def primary_image_hdu(hdul):
+    """The HDU holding what was the primary image, compressed or not"""
+    if is_compressed_primary(hdul):
+        return hdul[1]
+    return hdul[0]
+
+
+def primary_header(hdul):
+    """Header of the primary image as it was before compression"""
+    return primary_image_hdu(hdul).header
+
+
+def first_plane(hdu):
+    """
+    First 2D plane of an image HDU. For compressed HDUs only the tiles of
+    that plane are decompressed. Read through `section`, so nothing is
+    loaded onto the HDU (which may be shared, see hdul_pool.py).
+    """
+    ndim = hdu.header.get('NAXIS', 0)
+    if ndim > 2:
+        return hdu.section[(0,) * (ndim - 2)]
+    if ndim == 2:
+        return hdu.section[:, :]
+    return hdu.data
+
+
+def cutout(hdu, x, y, width, height, plane=0):
+    """
+    Return a 2D cutout [y:y+height, x:x+width] of an image HDU. Works on
+    plain (memmapped) and compressed HDUs without reading the full image.
+    """
+    ndim = hdu.header.get('NAXIS', 0)
+    index = (plane,) * (ndim - 2) if ndim > 2 else ()
+    return hdu.section[index + (slice(y, y + height), slice(x, x + width))]
+
+
+def _time(func, repeat=3):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def report(file_path, compression_type, quantize_level):
+    """Print space savings and read latency of a compressed copy versus the original"""
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        dst = os.path.join(tmp_dir, os.path.basename(file_path) + '.fz')
+        stats = compress_fits_file(file_path, dst, compression_type, quantize_level)
+
+        print(f"Compression:     {stats['compression_type']}")
+        print(f"Original size:   {stats['raw_bytes'] / 1e6:.2f} MB")
+        print(f"Compressed size: {stats['compressed_bytes'] / 1e6:.2f} MB "
+              f"(ratio {stats['ratio']}, saves {100 * (1 - 1 / stats['ratio']):.1f}%)")
+        print(f"Compress time:   {stats['seconds']:.3f} s")
+
+        def read_header(path):
+            with fits.open(path) as hdul:
+                list(primary_header(hdul).cards)
+
+        def read_full(path):
+            with fits.open(path) as hdul:
+                primary_image_hdu(hdul).data.sum()
+
+        def read_plane(path):
+            with fits.open(path) as hdul:
+                np.asarray(first_plane(primary_image_hdu(hdul))).sum()
+
+        def read_cutout(path):
+            with fits.open(path) as hdul:
+                hdu = primary_image_hdu(hdul)
+                np.asarray(cutout(hdu, 0, 0, 256, 256)).sum()
+
+        print(f"\n{'read path':<12}{'original':>12}{'compressed':>12}")
+        for name, func in (('header', read_header), ('full data', read_full),
+                           ('first plane', read_plane), ('cutout 256', read_cutout)):
+            original = _time(lambda: func(file_path))
+            compressed = _time(lambda: func(dst))
+            print(f"{name:<12}{original * 1000:>10.1f}ms{compressed * 1000:>10.1f}ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Tile-compress a FITS file and report savings')
+    parser.add_argument('file', help='FITS file (.fits or .fits.gz)')
+    parser.add_argument('--type', default='rice', choices=sorted(COMPRESSION_TYPES),
+                        help='Compression algorithm (default: rice)')
+    parser.add_argument('--quantize-level', type=float, default=None,
+                        help='Quantize float images (lossy); default keeps floats lossless')
+    args = parser.parse_args()
+
+    if not os.path.exists(args.file):
+        print(f"Error: File '{args.file}' not found.")
+        return 1
+    report(args.file, COMPRESSION_TYPES[args.type], args.quantize_level)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,286 @@
+from flask import request, jsonify, Response, stream_with_context
+from datetime import datetime, date, time
+from xml.sax.saxutils import escape
+import csv
+import io
+import uuid
+import logging
+
+import psycopg2
+
+from fits_search import build_search_query
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CHUNK_SIZE = 5000
+MIN_CHUNK_SIZE = 100
+MAX_CHUNK_SIZE = 100000
+PARQUET_CODECS = ('zstd', 'snappy', 'gzip', 'brotli', 'lz4', 'none')
+
+# Postgres type OIDs returned in cursor.description
+PG_BOOL, PG_INT8, PG_INT2, PG_INT4, PG_TEXT = 16, 20, 21, 23, 25
+PG_FLOAT4, PG_FLOAT8, PG_VARCHAR = 700, 701, 1043
+PG_DATE, PG_TIME, PG_TIMESTAMP, PG_TIMESTAMPTZ = 1082, 1083, 1114, 1184
+
+
+def _format_value(val):
+    """Text form of a value for CSV and VOTable cells"""
+    if val is None:
+        return ''
+    if isinstance(val, (datetime, date, time)):
+        return val.isoformat()
+    return str(val)
+
+
+class CSVExportWriter:
+    """Writes rows as CSV, one chunk of text per batch of rows"""
+    mimetype = 'text/csv'
+    extension = 'csv'
+
+    def __init__(self):
+        self.buffer = io.StringIO()
+        self.writer = csv.writer(self.buffer)
+
+    def _drain(self):
+        data = self.buffer.getvalue().encode('utf-8')
+        self.buffer.seek(0)
+        self.buffer.truncate()
+        return data
+
+    def header(self, description):
+        self.writer.writerow([col.name for col in description])
+        return self._drain()
+
+    def rows(self, rows):
+        self.writer.writerows([[_format_value(v) for v in row] for row in rows])
+        return self._drain()
+
+    def footer(self):
+        return b''
+
+
+class VOTableExportWriter:
+    """Writes rows as a VOTable 1.4 document with an inline TABLEDATA section"""
+    mimetype = 'application/x-votable+xml'
+    extension = 'vot'
+
+    DATATYPES = {
+        PG_BOOL: 'boolean', PG_INT8: 'long', PG_INT2: 'short', PG_INT4: 'int',
+        PG_FLOAT4: 'float', PG_FLOAT8: 'double',
+    }
+
+    def header(self, description):
+        fields = []
+        for col in description:
+            datatype = self.DATATYPES.get(col.type_code)
+            if datatype:
+                fields.append(f'<FIELD name="{escape(col.name)}" datatype="{datatype}"/>')
+            else:
+                fields.append(f'<FIELD name="{escape(col.name)}" datatype="char" arraysize="*"/>')
+        return (
+            '<?xml version="1.0" encoding="utf-8"?>\n'
+            '<VOTABLE version="1.4" xmlns="http://www.ivoa.net/xml/VOTable/v1.3">\n'
+            '<RESOURCE type="results">\n<TABLE name="fits_headers">\n'
+            + '\n'.join(fields) +
+            '\n<DATA>\n<TABLEDATA>\n'
+        ).encode('utf-8')
+
+    def rows(self, rows):
+        out = []
+        for row in rows:
+            out.append('<TR>' + ''.join(f'<TD>{escape(_format_value(v))}</TD>' for v in row) + '</TR>\n')
+        return ''.join(out).encode('utf-8')
+
+    def footer(self):
+        return b'</TABLEDATA>\n</DATA>\n</TABLE>\n</RESOURCE>\n</VOTABLE>\n'
+
+
+class _ChunkSink:
+    """Minimal writable file object that hands written bytes back in chunks"""
+
+    def __init__(self):
+        self.chunks = []
+        self.position = 0
+        self.closed = False
+
+    def write(self, data):
+        data = bytes(data)
+        self.chunks.append(data)
+        self.position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self.position
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+    def drain(self):
+        data = b''.join(self.chunks)
+        self.chunks = []
+        return data
+
+
+class ParquetExportWriter:
+    """
+    Writes rows as Parquet, one row group per batch. The schema comes from
+    the cursor description so every row group has identical column types.
+    """
+    mimetype = 'application/vnd.apache.parquet'
+    extension = 'parquet'
+
+    def __init__(self, compression='zstd'):
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+        # Checked here, before the response starts: ParquetWriter would only
+        # reject the codec once the 200 has been sent
+        compression = compression.lower()
+        if compression not in PARQUET_CODECS or \
+                (compression != 'none' and not pa.Codec.is_available(compression)):
+            raise ValueError(f'Unsupported compression: {compression}. Use one of {", ".join(PARQUET_CODECS)}')
+        self.pa = pa
+        self.pq = pq
+        self.compression = compression
+        self.sink = _ChunkSink()
+        self.writer = None
+        self.schema = None
+
+    def _arrow_type(self, type_code):
+        pa = self.pa
+        return {
+            PG_BOOL: pa.bool_(), PG_INT8: pa.int64(), PG_INT2: pa.int16(), PG_INT4: pa.int32(),
+            PG_FLOAT4: pa.float32(), PG_FLOAT8: pa.float64(),
+            PG_DATE: pa.date32(), PG_TIME: pa.time64('us'),
+            PG_TIMESTAMP: pa.timestamp('us'), PG_TIMESTAMPTZ: pa.timestamp('us', tz='UTC'),
+        }.get(type_code, pa.string())
+
+    def header(self, description):
+        self.schema = self.pa.schema([(col.name, self._arrow_type(col.type_code)) for col in description])
+        self.string_columns = {
+            i for i, field in enumerate(self.schema) if field.type == self.pa.string()
+        }
+        self.writer = self.pq.ParquetWriter(self.sink, self.schema, compression=self.compression)
+        return self.sink.drain()
+
+    def rows(self, rows):
+        columns = list(zip(*rows)) if rows else [[] for _ in self.schema]
+        arrays = []
+        for i, field in enumerate(self.schema):
+            values = columns[i]
+            if i in self.string_columns:
+                values = [None if v is None else str(v) for v in values]
+            arrays.append(self.pa.array(values, type=field.type))
+        self.writer.write_table(self.pa.Table.from_arrays(arrays, schema=self.schema))
+        return self.sink.drain()
+
+    def footer(self):
+        self.writer.close()
+        return self.sink.drain()
+
+
+EXPORT_FORMATS = {
+    'csv': CSVExportWriter,
+    'votable': VOTableExportWriter,
+    'parquet': ParquetExportWriter,
+}
+
+
+def setup_export_route(app, get_conn, release_conn, get_columns):
+    """
+    Register /api/export/ on `app`.
+
+    get_conn/release_conn check connections out of the backend's pool and
+    get_columns(conn) returns the column names of fits_headers.
+    """
+
+    @app.route('/api/export/', methods=['GET'])
+    def export_search():
+        """
+        Stream the rows of a fits_headers search as CSV, Parquet or VOTable.
+
+        Query parameters:
+            format: csv (default), parquet or votable
+            compression: parquet codec, one of PARQUET_CODECS (default: zstd)
+            chunk_size: rows fetched from the server-side cursor per batch
+            columns: optional comma separated column projection
+            plus any filter accepted by fits_search.build_search_query
+        """
+        export_format = request.args.get('format', 'csv').lower()
+        if export_format not in EXPORT_FORMATS:
+            return jsonify({'error': f'Unsupported format: {export_format}. Use one of {", ".join(EXPORT_FORMATS)}'}), 400
+
+        try:
+            chunk_size = int(request.args.get('chunk_size', DEFAULT_CHUNK_SIZE))
+        except ValueError:
+            return jsonify({'error': 'chunk_size must be an integer'}), 400
+        chunk_size = max(MIN_CHUNK_SIZE, min(chunk_size, MAX_CHUNK_SIZE))
+
+        try:
+            if export_format == 'parquet':
+                writer = ParquetExportWriter(request.args.get('compression', 'zstd'))
+            else:
+                writer = EXPORT_FORMATS[export_format]()
+        except ImportError:
+            return jsonify({'error': 'Parquet export requires pyarrow to be installed'}), 501
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+
+        conn = get_conn()
+        try:
+            all_columns = get_columns(conn)
+            columns = [c.strip() for c in request.args.get('columns', '').split(',') if c.strip()]
+            unknown = [c for c in columns if c not in all_columns]
+            if unknown:
+                release_conn(conn)
+                return jsonify({'error': f'Unknown columns: {", ".join(unknown)}'}), 400
+            sql, params = build_search_query(request.args, columns or all_columns)
+        except Exception as e:
+            release_conn(conn)
+            return jsonify({'error': str(e)}), 400
+
+        # Run the query before answering, so that a filter the database
+        # rejects is a 400 rather than a truncated 200. A named cursor keeps
+        # the result set on the server; only chunk_size rows are held in
+        # memory at any time
+        cur = conn.cursor(name=f"export_{uuid.uuid4().hex}")
+        try:
+            cur.itersize = chunk_size
+            cur.execute(sql, params)
+            rows = cur.fetchmany(chunk_size)
+        except psycopg2.DataError as e:
+            conn.rollback()
+            release_conn(conn)
+            return jsonify({'error': str(e).strip()}), 400
+        except Exception:
+            conn.rollback()
+            release_conn(conn)
+            raise
+
+        def close():
+            # Runs when the response is closed, also when generate() never
+            # started (HEAD, client gone before the first chunk)
+            try:
+                cur.close()
+            except psycopg2.Error:
+                pass
+            conn.rollback()
+            release_conn(conn)
+
+        def generate(rows):
+            exported = 0
+            yield writer.header(cur.description)
+            while rows:
+                exported += len(rows)
+                yield writer.rows(rows)
+                rows = cur.fetchmany(chunk_size)
+            yield writer.footer()
+            logger.info("Exported %d rows as %s", exported, export_format)
+
+        filename = f"fits_export_{datetime.now().strftime('%Y%m%dT%H%M%S')}.{writer.extension}"
+        response = Response(stream_with_context(generate(rows)), mimetype=writer.mimetype)
+        response.headers['Content-Disposition'] = f'attachment; filename="{filename}"'
+        response.call_on_close(close)
+        return response
@@ -1,16 +1,12 @@
 from astropy.io import fits
-from astropy.visualization import ZScaleInterval, AsinhStretch
 import numpy as np
-from flask import Flask, request, jsonify
+from flask import Flask, request, jsonify, send_file
 from PIL import Image
 import io
 import sys
 import json
 import argparse
-import matplotlib.pyplot as plt
 from flask_cors import CORS
-from minio import Minio
-import tempfile
 import os
 import logging
 import sys
@@ -47,13 +43,23 @@ except ImportError:
 
 from fits_viewer import FITSViewer
 from view_fits_route import setup_view_fits_route
+from presign_cache import PresignedURLCache
+from fits_compression import primary_header
+from fits_header_reader import read_primary_header_list, header_to_list
+from metrics import setup_metrics, InstrumentedMinio, render_stage
+from request_timing import setup_request_timing, server_timing
+from conditional_get import ValidatorCache, stat_validators, make_etag, not_modified, set_validators
+from structured_logging import setup_logging, LogSampler
+from object_cache import ObjectCache
+from hdul_pool import HDUListPool
+from minio_cluster import MinioCluster, MINIO_NODES, endpoints_from_env
+from spectrum_preview import spectrum_hdus, read_spectra, render_spectra, to_png
 
-# Configure logging
-logging.basicConfig(
-    level=logging.DEBUG,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
-)
+# Configure logging (levels and format from FITS_LOG_* environment variables)
+setup_logging('fits_header')
 logger = logging.getLogger(__name__)
+# Per-file debug output of filtered searches is sampled
+filter_log = LogSampler(logger)
 
 def normalize(value):
     """Normalize string values for consistent comparison"""
@@ -79,8 +85,8 @@ CORS(app, origins=[
 # Add request logging middleware
 @app.before_request
 def log_request_info():
-    logger.debug('Headers: %s', dict(request.headers))
-    logger.debug('Args: %s', dict(request.args))
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug('Args: %s', dict(request.args))
 
 # Add response logging
 @app.after_request
@@ -89,41 +95,48 @@ def log_response_info(response):
     return response
 
 # MinIO configuration
-# Available MinIO console endpoints in the cluster:
-# - Console Endpoints: localhost:9001, localhost:9003, localhost:9005, localhost:9007
-# Using one of the working console endpoints (9001 was reported as failing)
-MINIO_ENDPOINT = "localhost:9002"  # Using minio2 console endpoint which is working
-# Alternative endpoints to try if one fails:
-# MINIO_ENDPOINT = "localhost:9005"  # minio3 console endpoint
-# MINIO_ENDPOINT = "localhost:9007"  # minio4 console endpoint
-MINIO_ACCESS_KEY = "Laav10user"
-MINIO_SECRET_KEY = "Laav10pass"
-MINIO_BUCKET = "dataarchive"
+# Requests are balanced over the nodes of the cluster and fail over when a
+# node is down (minio_cluster.py). MINIO_ENDPOINT overrides the node list,
+# comma separated, e.g. for the load-test harness
+MINIO_ENDPOINTS = endpoints_from_env(MINIO_NODES)
+MINIO_ACCESS_KEY = os.environ.get("MINIO_ACCESS_KEY", "Laav10user")
+MINIO_SECRET_KEY = os.environ.get("MINIO_SECRET_KEY", "Laav10pass")
+MINIO_BUCKET = os.environ.get("MINIO_BUCKET", "dataarchive")
 
 # Initialize MinIO client
 try:
-    minio_client = Minio(
-        MINIO_ENDPOINT,
+    minio_client = InstrumentedMinio(MinioCluster(
+        MINIO_ENDPOINTS,
         access_key=MINIO_ACCESS_KEY,
         secret_key=MINIO_SECRET_KEY,
         secure=False
-    )
+    ))
     print("MinIO client initialized successfully")
 except Exception as e:
     print(f"Error initializing MinIO client: {e}")
     minio_client = None
 
-def get_presigned_url(bucket_name: str, object_name: str, expires=3600):
-    """Generate a presigned URL for an object"""
+presign_cache = PresignedURLCache(minio_client, expires=3600)
+validators = ValidatorCache()
+# Objects read by the render and compressed-header paths, on local disk.
+# Header reads use pooled HDULists; the renders load whole HDUs and do not
+object_cache = ObjectCache(minio_client, MINIO_BUCKET)
+hdul_pool = HDUListPool(object_cache)
+
+def object_validators(object_name):
+    """(etag, last_modified) of a MinIO object, cached briefly"""
+    return validators.get(
+        ('object', object_name),
+        lambda: stat_validators(minio_client, MINIO_BUCKET, object_name)
+    )
+
+def get_presigned_url(bucket_name: str, object_name: str):
+    """Generate a presigned URL for an object, reusing a cached one while it is still valid"""
     try:
-        url = minio_client.presigned_get_object(
-            bucket_name,
-            object_name,
-            expires=expires
-        )
+        url, _ = presign_cache.get(bucket_name, object_name)
         return url
     except Exception as e:
-        logger.error(f"Error generating presigned URL: {e}")
+        logger.error("Error generating presigned URL: %s", e)
         return None
 
 def get_header_value(header_list, keyword):
@@ -151,10 +164,8 @@ def matches_filters(header_list, filters):
     normalized_mode = mode.strip().upper() if mode else ''
     normalized_observer = observer.strip().upper() if observer else ''
     
-    logger.debug(f"Processing file with normalized values:")
-    logger.debug(f"  Telescope: {telescope} -> {normalized_telescope}")
-    logger.debug(f"  Instrument: {instrument} -> {normalized_instrument}")
-    logger.debug(f"Applied filters: {filters}")
+    filter_log.debug("Processing file with normalized values: telescope %s -> %s, instrument %s -> %s",
+                     telescope, normalized_telescope, instrument, normalized_instrument)
     
     # Apply filters with AND logic
     # If filter is empty/not provided, it matches all (no restriction)
@@ -162,62 +173,62 @@ def matches_filters(header_list, filters):
     # Telescope filter - only apply if telescopes array is not empty
     if filters.get('telescopes') and len(filters['telescopes']) > 0:
         if not telescope:  # If file has no telescope, it doesn't match
-            logger.debug(f"Rejected: File has no telescope value")
+            filter_log.debug("Rejected: File has no telescope value")
             return False
             
         normalized_filter_telescopes = [normalizeTelescopeName(t) for t in filters['telescopes']]
         if normalized_telescope not in normalized_filter_telescopes:
-            logger.debug(f"Rejected: Telescope '{telescope}' (normalized: {normalized_telescope}) not in {normalized_filter_telescopes}")
+            filter_log.debug("Rejected: Telescope '%s' (normalized: %s) not in %s", telescope, normalized_telescope, normalized_filter_telescopes)
             return False
-        logger.debug(f"Matched telescope: {telescope} (normalized: {normalized_telescope})")
+        filter_log.debug("Matched telescope: %s (normalized: %s)", telescope, normalized_telescope)
     
     # Instrument filter - only apply if instruments array is not empty
     if filters.get('instruments') and len(filters['instruments']) > 0:
         if not instrument:  # If file has no instrument, it doesn't match
-            logger.debug(f"Rejected: File has no instrument value")
+            filter_log.debug("Rejected: File has no instrument value")
             return False
             
         normalized_filter_instruments = [i.strip().upper() for i in filters['instruments']]
         if normalized_instrument not in normalized_filter_instruments:
-            logger.debug(f"Rejected: Instrument '{instrument}' (normalized: {normalized_instrument}) not in {normalized_filter_instruments}")
+            filter_log.debug("Rejected: Instrument '%s' (normalized: %s) not in %s", instrument, normalized_instrument, normalized_filter_instruments)
             return False
-        logger.debug(f"Matched instrument: {instrument} (normalized: {normalized_instrument})")
+        filter_log.debug("Matched instrument: %s (normalized: %s)", instrument, normalized_instrument)
     
     # Observation type filter - only apply if observationTypes array is not empty
     if filters.get('observationTypes') and len(filters['observationTypes']) > 0:
         if not obs_type:  # If file has no observation type, it doesn't match
-            logger.debug(f"Rejected: File has no observation type value")
+            filter_log.debug("Rejected: File has no observation type value")
             return False
             
         normalized_filter_obs_types = [ot.strip().upper() for ot in filters['observationTypes']]
         if normalized_obs_type not in normalized_filter_obs_types:
-            logger.debug(f"Rejected: Observation type '{obs_type}' (normalized: {normalized_obs_type}) not in {normalized_filter_obs_types}")
+            filter_log.debug("Rejected: Observation type '%s' (normalized: %s) not in %s", obs_type, normalized_obs_type, normalized_filter_obs_types)
             return False
-        logger.debug(f"Matched observation type: {obs_type} (normalized: {normalized_obs_type})")
+        filter_log.debug("Matched observation type: %s (normalized: %s)", obs_type, normalized_obs_type)
     
     # Mode filter - only apply if mode is not empty
     if filters.get('mode') and filters['mode'].strip():
         if not mode:  # If file has no mode, it doesn't match
-            logger.debug(f"Rejected: File has no mode value")
+            filter_log.debug("Rejected: File has no mode value")
             return False
             
         normalized_filter_mode = filters['mode'].strip().upper()
         if normalized_mode != normalized_filter_mode:
-            logger.debug(f"Rejected: Mode '{mode}' (normalized: {normalized_mode}) != '{filters['mode']}' (normalized: {normalized_filter_mode})")
+            filter_log.debug("Rejected: Mode '%s' (normalized: %s) != '%s' (normalized: %s)", mode, normalized_mode, filters['mode'], normalized_filter_mode)
             return False
-        logger.debug(f"Matched mode: {mode} (normalized: {normalized_mode})")
+        filter_log.debug("Matched mode: %s (normalized: %s)", mode, normalized_mode)
     
     # Observer filter - only apply if observer is not empty
     if filters.get('observer') and filters['observer'].strip():
         if not observer:  # If file has no observer, it doesn't match
-            logger.debug(f"Rejected: File has no observer value")
+            filter_log.debug("Rejected: File has no observer value")
             return False
             
         normalized_filter_observer = filters['observer'].strip().upper()
         if normalized_observer != normalized_filter_observer:
-            logger.debug(f"Rejected: Observer '{observer}' (normalized: {normalized_observer}) != '{filters['observer']}' (normalized: {normalized_filter_observer})")
+            filter_log.debug("Rejected: Observer '%s' (normalized: %s) != '%s' (normalized: %s)", observer, normalized_observer, filters['observer'], normalized_filter_observer)
             return False
-        logger.debug(f"Matched observer: {observer} (normalized: {normalized_observer})")
+        filter_log.debug("Matched observer: %s (normalized: %s)", observer, normalized_observer)
     
     # Target filter - check OBJECT or TARGET keywords 
     if filters.get('target'):
@@ -234,17 +245,20 @@ def matches_filters(header_list, filters):
             target_found = True
             
         if not target_found:
-            logger.debug(f"Rejected: Target '{filters['target']}' not found in OBJECT='{object_name}' or TARGET='{target_name}' or TARGNAME='{targ_name}'")
+            filter_log.debug("Rejected: Target '%s' not found in OBJECT='%s' or TARGET='%s' or TARGNAME='%s'", filters['target'], object_name, target_name, targ_name)
             return False
         
-        logger.debug(f"Matched target: '{filters['target']}' found in fields: OBJECT='{object_name}' or TARGET='{target_name}' or TARGNAME='{targ_name}'")
+        filter_log.debug("Matched target: '%s' found in fields: OBJECT='%s' or TARGET='%s' or TARGNAME='%s'", filters['target'], object_name, target_name, targ_name)
 
-    logger.debug("File matches all filters")
+    filter_log.debug("File matches all filters")
     return True
 
 def process_fits_image(hdul):
     """Process FITS data into viewable image with enhanced error handling for 32-bit float data"""
-    logger.debug(f"Processing FITS image with {len(hdul)} HDUs")
+    # Imported here to keep the import of this module (and worker start) fast
+    from astropy.visualization import ZScaleInterval, AsinhStretch
+
+    logger.debug("Processing FITS image with %s HDUs", len(hdul))
 
     # Initialize variables to track suitable HDUs
     image_data = None
@@ -263,11 +277,11 @@ def process_fits_image(hdul):
                 
                 # Ensure dtype compatibility - check for any float32 variant
                 if not (str(dtype_info).endswith('f4') or dtype_info == np.float32):
-                    logger.warning(f"HDU {i} has unexpected data type: {dtype_info}")
-                    logger.debug(f"Looking for float32 data (f4), found {dtype_info}")
+                    logger.warning("HDU %s has unexpected data type: %s", i, dtype_info)
+                    logger.debug("Looking for float32 data (f4), found %s", dtype_info)
                     continue  # Skip non-float32 data
             
-                logger.debug(f"HDU {i}: Type={hdu_type}, Shape={shape_info}, Data type={dtype_info}")
+                logger.debug("HDU %s: Type=%s, Shape=%s, Data type=%s", i, hdu_type, shape_info, dtype_info)
                 
                 # Record if primary HDU has data
                 if i == 0 and shape_info:
@@ -276,7 +290,7 @@ def process_fits_image(hdul):
                 # Check for potentially usable image data (at least 2D)
                 if shape_info and len(shape_info) >= 2:
                     pixel_count = np.prod(shape_info)
-                    logger.debug(f"HDU {i} has {pixel_count} pixels with shape {shape_info}")
+                    logger.debug("HDU %s has %s pixels with shape %s", i, pixel_count, shape_info)
                     
                     # Add to candidates with metadata
                     candidate_hdus.append({
@@ -287,14 +301,14 @@ def process_fits_image(hdul):
                         'hdu': hdu
                     })
             else:
-                logger.debug(f"HDU {i} has no data")
+                logger.debug("HDU %s has no data", i)
         except Exception as e:
-            logger.debug(f"Error analyzing HDU {i}: {str(e)}")
+            logger.debug("Error analyzing HDU %s: %s", i, e)
     
     # Log candidate HDUs
-    logger.debug(f"Found {len(candidate_hdus)} HDUs with potential image data")
+    logger.debug("Found %s HDUs with potential image data", len(candidate_hdus))
     for candidate in candidate_hdus:
-        logger.debug(f"Candidate HDU {candidate['index']}: {candidate['dimensions']}D with shape {candidate['shape']}")
+        logger.debug("Candidate HDU %s: %sD with shape %s", candidate['index'], candidate['dimensions'], candidate['shape'])
     
     # Select the best HDU for image processing
     if not candidate_hdus:
@@ -309,30 +323,30 @@ def process_fits_image(hdul):
     primary_candidates = [c for c in candidate_hdus if c['index'] == 0]
     if primary_candidates:
         selected_hdu = primary_candidates[0]
-        logger.debug(f"Selected primary HDU (index 0) with shape {selected_hdu['shape']}")
+        logger.debug("Selected primary HDU (index 0) with shape %s", selected_hdu['shape'])
     else:
         # Look for 2D candidates first
         two_d_candidates = [c for c in candidate_hdus if c['dimensions'] == 2]
         if two_d_candidates:
             # Select the 2D candidate with the most pixels
             selected_hdu = max(two_d_candidates, key=lambda c: c['pixel_count'])
-            logger.debug(f"Selected 2D HDU {selected_hdu['index']} with shape {selected_hdu['shape']}")
+            logger.debug("Selected 2D HDU %s with shape %s", selected_hdu['index'], selected_hdu['shape'])
         else:
             # Otherwise select the candidate with the least dimensions
             selected_hdu = min(candidate_hdus, key=lambda c: c['dimensions'])
-            logger.debug(f"Selected HDU {selected_hdu['index']} with {selected_hdu['dimensions']}D and shape {selected_hdu['shape']}")
+            logger.debug("Selected HDU %s with %sD and shape %s", selected_hdu['index'], selected_hdu['dimensions'], selected_hdu['shape'])
     
     # Get the image data from selected HDU
     image_data = selected_hdu['hdu'].data
-    logger.debug(f"Using image data from HDU {selected_hdu['index']} with shape {image_data.shape}")
+    logger.debug("Using image data from HDU %s with shape %s", selected_hdu['index'], image_data.shape)
     # Check data type - handle different float32 representations
     if not (str(image_data.dtype).endswith('f4') or image_data.dtype == np.float32):
-        logger.warning(f"Selected image data is not 32-bit float (found {image_data.dtype}), modifications might be needed for accurate processing.")
+        logger.warning("Selected image data is not 32-bit float (found %s), modifications might be needed for accurate processing.", image_data.dtype)
     
     # Handle multi-dimensional data (3D or higher)
     if len(image_data.shape) > 2:
         original_shape = image_data.shape
-        logger.debug(f"Processing multi-dimensional data with shape {original_shape}")
+        logger.debug("Processing multi-dimensional data with shape %s", original_shape)
         
         try:
             # For 3D data, typically the first dimension is the frame/channel
@@ -365,29 +379,29 @@ def process_fits_image(hdul):
             elif len(image_data.shape) == 3:
                 # If first dimension is small (like RGB channels but not exactly 3), handle differently
                 if image_data.shape[0] <= 3:
-                    logger.debug(f"Detected possible channel data with {image_data.shape[0]} channels")
+                    logger.debug("Detected possible channel data with %s channels", image_data.shape[0])
                     # For RGB-like data, use the first channel or average
                     image_data = image_data[0]
                 else:
                     # For cube data, use middle slice from first dimension
                     middle_slice = image_data.shape[0] // 2
-                    logger.debug(f"Using middle slice ({middle_slice}) from first dimension")
+                    logger.debug("Using middle slice (%s) from first dimension", middle_slice)
                     image_data = image_data[middle_slice]
             # For 4D or higher, take middle slices of all but the last two dimensions
             elif len(image_data.shape) >= 4:
-                logger.debug(f"Handling {len(image_data.shape)}D data by taking middle slices")
+                logger.debug("Handling %sD data by taking middle slices", len(image_data.shape))
                 indices = tuple(shape // 2 for shape in image_data.shape[:-2])
                 image_data = image_data[indices]
             
-            logger.debug(f"Reduced multi-dimensional data from {original_shape} to {image_data.shape}")
+            logger.debug("Reduced multi-dimensional data from %s to %s", original_shape, image_data.shape)
         except Exception as e:
-            logger.error(f"Error processing multi-dimensional data: {str(e)}")
+            logger.error("Error processing multi-dimensional data: %s", e)
             # Fallback to simpler method if the sophisticated approach fails
             logger.debug("Using fallback method for multi-dimensional data")
             # Keep slicing first dimension until we get a 2D array
             while len(image_data.shape) > 2:
                 image_data = image_data[image_data.shape[0]//2]
-            logger.debug(f"Fallback resulted in shape {image_data.shape}")
+            logger.debug("Fallback resulted in shape %s", image_data.shape)
     
     # Check for valid data values
     try:
@@ -402,10 +416,10 @@ def process_fits_image(hdul):
             float32_warning_issued = True
         
         if has_nans or has_infs:
-            logger.debug(f"Found {non_finite_count} non-finite values (NaN/Inf) in image data")
+            logger.debug("Found %s non-finite values (NaN/Inf) in image data", non_finite_count)
             image_data = np.nan_to_num(image_data)
     except Exception as e:
-        logger.warning(f"Error checking data validity: {e}")
+        logger.warning("Error checking data validity: %s", e)
     
     # Check for empty or all-zero array
     if image_data.size == 0:
@@ -419,24 +433,26 @@ def process_fits_image(hdul):
     # Check data range to detect potential issues
     data_min = np.min(image_data)
     data_max = np.max(image_data)
-    logger.debug(f"Raw data range: min={data_min}, max={data_max}, mean={np.mean(image_data):.2f}")
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug("Raw data range: min=%s, max=%s, mean=%.2f", data_min, data_max, np.mean(image_data))
     
     # Use ZScale for automatic scaling
     zscale = ZScaleInterval()
     try:
-        vmin, vmax = zscale.get_limits(image_data)
-        logger.debug(f"ZScale limits: vmin={vmin}, vmax={vmax}")
+        with server_timing('zscale'):
+            vmin, vmax = zscale.get_limits(image_data)
+        logger.debug("ZScale limits: vmin=%s, vmax=%s", vmin, vmax)
         
         # Sanity check on ZScale limits
         if vmin >= vmax:
-            logger.warning(f"Invalid ZScale limits (vmin={vmin} >= vmax={vmax}), using data min/max instead")
+            logger.warning("Invalid ZScale limits (vmin=%s >= vmax=%s), using data min/max instead", vmin, vmax)
             vmin, vmax = data_min, data_max
             # Ensure there's a range to prevent division by zero
             if vmin == vmax:
                 logger.warning("Image has uniform values, applying offset to prevent division by zero")
                 vmax = vmin + 1
     except Exception as e:
-        logger.warning(f"Error calculating ZScale limits: {e}. Using min/max values instead.")
+        logger.warning("Error calculating ZScale limits: %s. Using min/max values instead.", e)
         vmin, vmax = data_min, data_max
         # Prevent division by zero if min equals max
         if vmin == vmax:
@@ -446,12 +462,14 @@ def process_fits_image(hdul):
     # Normalize the data
     try:
         normalized = np.clip((image_data - vmin) / (vmax - vmin), 0, 1)
-        logger.debug(f"Normalized data range: min={np.min(normalized):.4f}, max={np.max(normalized):.4f}")
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("Normalized data range: min=%.4f, max=%.4f", np.min(normalized), np.max(normalized))
         
         # Apply asinh stretch for better dynamic range
         stretch = AsinhStretch()
         stretched = stretch(normalized)
-        logger.debug(f"Stretched data range: min={np.min(stretched):.4f}, max={np.max(stretched):.4f}")
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("Stretched data range: min=%.4f, max=%.4f", np.min(stretched), np.max(stretched))
         
         # Check if stretch produced valid results
         if not np.isfinite(stretched).all() or np.min(stretched) < 0 or np.max(stretched) > 1:
@@ -460,20 +478,62 @@ def process_fits_image(hdul):
         
         # Convert to 8-bit image
         final_image = (stretched * 255).astype(np.uint8)
-        logger.debug(f"Final 8-bit image range: min={np.min(final_image)}, max={np.max(final_image)}")
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("Final 8-bit image range: min=%s, max=%s", np.min(final_image), np.max(final_image))
         
         # Check if the image has enough variance to be useful
         std_dev = np.std(final_image)
         if std_dev < 1.0:
-            logger.warning(f"Image has very low variance (std={std_dev:.2f}), may appear nearly blank")
+            logger.warning("Image has very low variance (std=%.2f), may appear nearly blank", std_dev)
         
-        logger.debug(f"Successfully processed image data to shape {final_image.shape}")
+        logger.debug("Successfully processed image data to shape %s", final_image.shape)
         return final_image
     
     except Exception as e:
-        logger.error(f"Error in final image processing: {str(e)}")
+        logger.error("Error in final image processing: %s", e)
         raise
 
+def render_png(hdul, renderer):
+    """
+    Render an open FITS file to PNG with process_fits_image, or with
+    spectrum_preview for spectra, timing each stage
+    """
+    hdus = spectrum_hdus(hdul)
+    if hdus:
+        with render_stage(renderer, 'decode'):
+            spectra = read_spectra(hdus)
+        with render_stage(renderer, 'normalize'):
+            image_data = render_spectra(spectra)
+        with render_stage(renderer, 'encode'):
+            return io.BytesIO(to_png(image_data))
+
+    with render_stage(renderer, 'decode'):
+        # Load every HDU up front so decoding is timed apart from normalization
+        for hdu in hdul:
+            hdu.data
+    with render_stage(renderer, 'normalize'):
+        image_data = process_fits_image(hdul)
+    with render_stage(renderer, 'encode'):
+        image = Image.fromarray(image_data)
+        img_byte_arr = io.BytesIO()
+        image.save(img_byte_arr, format='PNG', optimize=True)
+        img_byte_arr.seek(0)
+    return img_byte_arr
+
+def read_header_list(object_name):
+    """
+    Primary header cards of an object. Plain and gzipped files are read with
+    ranged requests up to the END card and parsed without astropy;
+    tile-compressed files are read from the object cache as soon as their
+    headers arrive.
+    """
+    header_list = read_primary_header_list(minio_client, MINIO_BUCKET, object_name)
+    if header_list is not None:
+        return header_list
+
+    with hdul_pool.fetch(object_name, object_validators(object_name)[0]) as spool:
+        return header_to_list(primary_header(spool.open()))
+
 @app.route('/fits-header', methods=['GET'])
 def fits_header():
     fits_file = request.args.get('file')
@@ -481,25 +541,14 @@ def fits_header():
         return jsonify({'error': 'No file specified'}), 400
     
     try:
-        # Download file from MinIO to temporary location
-        with tempfile.NamedTemporaryFile(delete=False, suffix='.fits') as temp_file:
-            minio_client.fget_object(MINIO_BUCKET, fits_file, temp_file.name)
-            temp_file_path = temp_file.name
-        
-        # Read FITS header
-        with fits.open(temp_file_path) as hdul:
-            header = hdul[0].header
-            header_list = [
-                {'Keyword': card.keyword, 'Value': str(card.value), 'Comment': card.comment}
-                for card in header.cards
-            ]
-        
-        # Clean up temporary file
-        os.unlink(temp_file_path)
-        
-        return jsonify(header_list)
+        source_etag, last_modified = object_validators(fits_file)
+        etag = make_etag(source_etag, 'header')
+        cached = not_modified(app, etag, last_modified)
+        if cached:
+            return cached
+        return set_validators(jsonify(read_header_list(fits_file)), etag, last_modified)
     except Exception as e:
-        print(f"Error processing FITS file: {e}")
+        logger.error("Error processing FITS file: %s", e)
         return jsonify({'error': str(e)}), 500
 
 @app.route('/filtered-search', methods=['GET'])
@@ -522,7 +571,7 @@ def filtered_search():
         observation_types = [ot.strip().upper() for ot in observation_types if ot.strip()]
         
         # Log the normalized filters
-        logger.info(f"Normalized filters: telescopes={telescopes}, instruments={instruments}")
+        logger.info("Normalized filters: telescopes=%s, instruments=%s", telescopes, instruments)
         
         filters = {
             'telescopes': telescopes,
@@ -533,11 +582,9 @@ def filtered_search():
             'target': target.strip().lower()
         }
         
-        logger.info(f"Applied filters: {filters}")
-        logger.info(f"Raw query params: telescopes='{request.args.get('telescopes')}', instruments='{request.args.get('instruments')}', observationTypes='{request.args.get('observationTypes')}', mode='{mode}', observer='{observer}', target='{target}'")
-        
-        # Enable debug logging
-        logger.setLevel(logging.DEBUG)
+        logger.info("Applied filters: %s", filters)
+        logger.info("Raw query params: telescopes='%s', instruments='%s', observationTypes='%s', mode='%s', observer='%s', target='%s'", request.args.get('telescopes'), request.args.get('instruments'), request.args.get('observationTypes'), mode, observer, target)
+
             
         # List all FITS files
         objects = minio_client.list_objects(MINIO_BUCKET, recursive=True)
@@ -546,24 +593,11 @@ def filtered_search():
         matched_files = 0
         
         for obj in objects:
-            if obj.object_name.lower().endswith(('.fits', '.fit')):
+            if obj.object_name.lower().endswith(('.fits', '.fit', '.fits.fz', '.fits.gz')):
                 total_files_processed += 1
                 try:
-                    # Download file temporarily to read header
-                    with tempfile.NamedTemporaryFile(delete=False, suffix='.fits') as temp_file:
-                        minio_client.fget_object(MINIO_BUCKET, obj.object_name, temp_file.name)
-                        temp_file_path = temp_file.name
-                    
-                    # Read FITS header
-                    with fits.open(temp_file_path) as hdul:
-                        header = hdul[0].header
-                        header_list = [
-                            {'Keyword': card.keyword, 'Value': str(card.value), 'Comment': card.comment}
-                            for card in header.cards
-                        ]
-                    
-                    # Clean up temporary file
-                    os.unlink(temp_file_path)
+                    # Read only the header bytes of each file
+                    header_list = read_header_list(obj.object_name)
                     
                     # Check if file matches filters
                     if matches_filters(header_list, filters):
@@ -599,10 +633,10 @@ def filtered_search():
                         })
                         
                 except Exception as e:
-                    logger.error(f"Error processing file {obj.object_name}: {e}")
+                    logger.error("Error processing file %s: %s", obj.object_name, e)
                     continue
         
-        logger.info(f"Filtering complete: {matched_files}/{total_files_processed} files matched")
+        logger.info("Filtering complete: %s/%s files matched", matched_files, total_files_processed)
         
         return jsonify({
             'files': files,
@@ -613,7 +647,7 @@ def filtered_search():
         })
         
     except Exception as e:
-        logger.error(f"Error in filtered search: {e}")
+        logger.error("Error in filtered search: %s", e)
         return jsonify({'error': str(e)}), 500
 
 @app.route('/api/files/', methods=['GET'])
@@ -646,49 +680,48 @@ def fits_image():
     if not fits_file:
         return jsonify({'error': 'No file specified'}), 400
     
-    logger.info(f"Processing FITS image request for file: {fits_file}")
+    logger.info("Processing FITS image request for file: %s", fits_file)
     
     try:
         # Create a temporary processed file name
         processed_name = f"processed_{fits_file.replace('.fits', '.png').replace('.fit', '.png')}"
         
+        # A cached URL means the processed image was found recently
+        cached = presign_cache.peek(MINIO_BUCKET, processed_name)
+        if cached:
+            logger.info("Using cached presigned URL for %s", processed_name)
+            return jsonify({'url': cached[0]})
+        
         # Check if processed image already exists
         try:
             minio_client.stat_object(MINIO_BUCKET, processed_name)
-            logger.info(f"Found existing processed image: {processed_name}")
+            logger.info("Found existing processed image: %s", processed_name)
             # If exists, return presigned URL
             url = get_presigned_url(MINIO_BUCKET, processed_name)
             if url:
-                logger.info(f"Generated presigned URL for existing image")
+                logger.info("Generated presigned URL for existing image")
                 return jsonify({'url': url})
             else:
                 logger.error("Failed to generate presigned URL for existing image")
                 raise Exception("Failed to generate presigned URL")
         except Exception as e:
-            logger.info(f"No existing processed image found or error accessing it: {str(e)}")
+            logger.info("No existing processed image found or error accessing it: %s", e)
             # Process and save if doesn't exist
-            temp_file_path = None
             try:
-                with tempfile.NamedTemporaryFile(delete=False, suffix='.fits') as temp_file:
-                    logger.debug(f"Downloading FITS file from MinIO: {fits_file}")
-                    minio_client.fget_object(MINIO_BUCKET, fits_file, temp_file.name)
-                    temp_file_path = temp_file.name
-                
-                # Process FITS file
-                logger.debug(f"Opening FITS file: {temp_file_path}")
-                with fits.open(temp_file_path) as hdul:
+                with object_cache.fetch(fits_file) as spool:
+                    with render_stage('fits_image', 'download'):
+                        logger.debug("Downloading FITS file from MinIO: %s", fits_file)
+                        hdul = spool.open()
+                        # process_fits_image() looks at the data of every HDU
+                        spool.wait_all()
+                    
                     try:
-                        image_data = process_fits_image(hdul)
-                        
                         # Convert to PNG
                         logger.debug("Converting processed data to PNG image")
-                        image = Image.fromarray(image_data)
-                        img_byte_arr = io.BytesIO()
-                        image.save(img_byte_arr, format='PNG', optimize=True)
-                        img_byte_arr.seek(0)
+                        img_byte_arr = render_png(hdul, 'fits_image')
                         
                         # Save processed image to MinIO
-                        logger.debug(f"Saving processed image to MinIO: {processed_name}")
+                        logger.debug("Saving processed image to MinIO: %s", processed_name)
                         minio_client.put_object(
                             MINIO_BUCKET,
                             processed_name,
@@ -704,45 +737,39 @@ def fits_image():
                             logger.error("Failed to generate presigned URL for new image")
                             raise Exception("Failed to generate presigned URL")
                         
-                        logger.info(f"Successfully processed and generated URL for {fits_file}")
+                        logger.info("Successfully processed and generated URL for %s", fits_file)
                         return jsonify({'url': url})
                     except Exception as e:
-                        logger.error(f"Error processing FITS image: {str(e)}", exc_info=True)
+                        logger.error("Error processing FITS image: %s", e, exc_info=True)
                         return jsonify({'error': f'Error processing image: {str(e)}'}), 500
             except Exception as e:
-                logger.error(f"Error downloading or opening FITS file: {str(e)}", exc_info=True)
+                logger.error("Error downloading or opening FITS file: %s", e, exc_info=True)
                 return jsonify({'error': f'Error accessing FITS file: {str(e)}'}), 500
-            finally:
-                # Ensure temp file is cleaned up even if processing fails
-                if temp_file_path and os.path.exists(temp_file_path):
-                    logger.debug(f"Cleaning up temporary file: {temp_file_path}")
-                    try:
-                        os.unlink(temp_file_path)
-                    except Exception as e:
-                        logger.warning(f"Failed to clean up temporary file: {str(e)}")
                 
     except Exception as e:
-        logger.error(f"Error in fits-image endpoint: {str(e)}", exc_info=True)
+        logger.error("Error in fits-image endpoint: %s", e, exc_info=True)
         return jsonify({'error': str(e)}), 500
 
 def view_fits_directly(fits_file):
     """Display a FITS image using matplotlib with detailed subplots for multi-channel data."""
+    import matplotlib.pyplot as plt
+
     try:
         with fits.open(fits_file) as hdul:
-            logger.info(f"Opening FITS file: {fits_file}")
+            logger.info("Opening FITS file: %s", fits_file)
             
             # Identify the image data
             data = hdul[0].data
             
             if data is None:
-                logger.error(f"No data found in FITS file: {fits_file}")
+                logger.error("No data found in FITS file: %s", fits_file)
                 return
             
             plt.figure(figsize=(12, 10))
             
             if len(data.shape) == 3 and data.shape[0] == 3:
                 # Assume RGB order (or similar)
-                logger.info(f"Displaying 3-channel FITS data with shape {data.shape}")
+                logger.info("Displaying 3-channel FITS data with shape %s", data.shape)
                 ax1 = plt.subplot(2, 2, 1)
                 ax1.imshow(data[0], vmin=np.percentile(data[0], 1), vmax=np.percentile(data[0], 99), cmap='viridis', origin='lower')
                 ax1.set_title("Channel 1")
@@ -765,7 +792,7 @@ def view_fits_directly(fits_file):
                 ax4.set_title("Composite RGB")
             else:
                 # Assume 2D grayscale image
-                logger.info(f"Displaying single-channel FITS data with shape {data.shape}")
+                logger.info("Displaying single-channel FITS data with shape %s", data.shape)
                 plt.imshow(data, cmap='viridis', origin='lower', vmin=np.percentile(data, 1), vmax=np.percentile(data, 99))
                 plt.colorbar(label='Intensity')
                 plt.title(f"FITS Image: {os.path.basename(fits_file)}")
@@ -776,7 +803,7 @@ def view_fits_directly(fits_file):
             plt.tight_layout(rect=[0, 0, 1, 0.95])
             plt.show()
     except Exception as e:
-        logger.error(f"Error while viewing FITS file directly: {str(e)}")
+        logger.error("Error while viewing FITS file directly: %s", e)
         
 
 @app.route('/view-fits', methods=['GET'])
@@ -787,31 +814,46 @@ def view_fits_endpoint():
         return jsonify({'error': 'No file specified'}), 400
     
     try:
-        # Download file from MinIO to temporary location
-        with tempfile.NamedTemporaryFile(delete=False, suffix='.fits') as temp_file:
-            minio_client.fget_object(MINIO_BUCKET, fits_file, temp_file.name)
-            temp_file_path = temp_file.name
-        
-        # Generate visualization data
-        with fits.open(temp_file_path) as hdul:
-            # Use the existing process_fits_image function
-            image_data = process_fits_image(hdul)
-            
-            # Convert to PNG
-            image = Image.fromarray(image_data)
-            img_byte_arr = io.BytesIO()
-            image.save(img_byte_arr, format='PNG', optimize=True)
-            img_byte_arr.seek(0)
+        source_etag, last_modified = object_validators(fits_file)
+        etag = make_etag(source_etag, 'view')
+        cached = not_modified(app, etag, last_modified)
+        if cached:
+            return cached
+
+        # Read the file from the object cache or MinIO
+        with object_cache.fetch(fits_file, source_etag) as spool:
+            with render_stage('view_fits', 'download'):
+                hdul = spool.open()
+                spool.wait_all()
             
-            # Clean up temporary file
-            os.unlink(temp_file_path)
+            # Generate visualization data (process_fits_image, then PNG)
+            img_byte_arr = render_png(hdul, 'view_fits')
             
             # Return PNG as response
-            return send_file(img_byte_arr, mimetype='image/png')
+            response = send_file(img_byte_arr, mimetype='image/png')
+            return set_validators(response, etag, last_modified, 'public, max-age=3600')
     except Exception as e:
-        logger.error(f"Error viewing FITS file: {e}")
+        logger.error("Error viewing FITS file: %s", e)
         return jsonify({'error': str(e)}), 500
 
+setup_metrics(app, 'fits_header')
+setup_request_timing(app)
+
+
+def preload():
+    """
+    Import the rendering stack and fill astropy's caches without touching
+    the network; serve.py runs this before forking workers.
+    """
+    data = np.random.default_rng(0).normal(1000.0, 10.0, (64, 64)).astype(np.float32)
+    image = process_fits_image(fits.HDUList([fits.PrimaryHDU(data)]))
+    Image.fromarray(image).save(io.BytesIO(), format='PNG')
+
+
+def warm_up():
+    """Open a MinIO connection and cache the bucket region; run in each worker after fork"""
+    minio_client.bucket_exists(MINIO_BUCKET)
+
 if __name__ == '__main__':
     # Support legacy command-line arguments but default to running server
     import sys
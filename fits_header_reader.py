@@ -0,0 +1,373 @@
+import re
+import zlib
+import logging
+
+logger = logging.getLogger(__name__)
+
+BLOCK_SIZE = 2880
+CARD_SIZE = 80
+END_CARD = b'END' + b' ' * 77
+GZIP_MAGIC = b'\x1f\x8b'
+
+# First ranged read; doubled on every further read
+INITIAL_RANGE = 4 * BLOCK_SIZE
+# Give up on headers larger than this (decompressed)
+MAX_HEADER_BYTES = 64 * 1024 * 1024
+
+COMMENTARY_PREFIXES = ('COMMENT ', 'HISTORY ', ' ' * 8)
+# Keywords astropy never parses as "KEYWORD = value" cards
+SPECIAL_KEYWORDS = {'COMMENT', 'HISTORY', 'END', 'CONTINUE'}
+_KEYWORD_RE = re.compile(r'[A-Z0-9_-]{1,8} *= ')
+_NUMBER_RE = re.compile(r'[+-]?(\.\d+|\d+(\.\d*)?)([DEde][+-]?\d+)?')
+# The common case in one match: a numeric or logical value and a comment
+# (matched against the card with trailing whitespace removed). Standard and
+# HIERARCH keywords have a pattern each; an alternation of the two makes
+# every match slower.
+_SCALAR_VALUE = (
+    r'\s*(?:([+-]?(?:\.\d+|\d+\.?\d*)([DEde][+-]?\d+)?)|([TF]))'
+    r' *(?:/ *(.*))?$'
+)
+_SCALAR_CARD_RE = re.compile(r'(?=[^=]{8}= )([A-Z0-9_-]{1,8}) *= ' + _SCALAR_VALUE)
+_HIERARCH_SCALAR_CARD_RE = re.compile(r'HIERARCH ([^=]*)= ' + _SCALAR_VALUE)
+_COMPLEX_RE = re.compile(r'\( *([^ ,]+) *, *([^ )]+) *\)')
+_FIX_EXPONENT = str.maketrans('dD', 'eE')
+
+
+def find_header_end(buf, start=0):
+    """
+    Return the length of the header in `buf` (a multiple of 2880 bytes,
+    including the END card's block) or None if END is not in `buf` yet.
+    `start` is a block-aligned offset already known to contain no END card.
+    """
+    usable = len(buf) - len(buf) % BLOCK_SIZE
+    for block_start in range(start, usable, BLOCK_SIZE):
+        block = buf[block_start:block_start + BLOCK_SIZE]
+        for card_start in range(0, BLOCK_SIZE, CARD_SIZE):
+            if block[card_start:card_start + CARD_SIZE] == END_CARD:
+                return block_start + BLOCK_SIZE
+    return None
+
+
+class _RangedReader:
+    """Reads an object from MinIO in growing byte ranges"""
+
+    def __init__(self, minio_client, bucket_name, object_name):
+        self.minio_client = minio_client
+        self.bucket_name = bucket_name
+        self.object_name = object_name
+        self.offset = 0
+        self.range_size = INITIAL_RANGE
+        self.eof = False
+
+    def read(self):
+        """Return the next range of bytes (empty at end of object)"""
+        if self.eof:
+            return b''
+        response = None
+        try:
+            response = self.minio_client.get_object(
+                self.bucket_name, self.object_name, offset=self.offset, length=self.range_size
+            )
+            data = response.read()
+        except Exception as e:
+            # Reading at or past the end of the object answers 416
+            if getattr(e, 'code', None) == 'InvalidRange':
+                self.eof = True
+                return b''
+            raise
+        finally:
+            if response is not None:
+                response.close()
+                response.release_conn()
+        if len(data) < self.range_size:
+            self.eof = True
+        self.offset += len(data)
+        self.range_size *= 2
+        return data
+
+
+class _HeaderScanner:
+    """Collects the start of a FITS or gzipped FITS file until its END card"""
+
+    def __init__(self, first):
+        self.inflater = zlib.decompressobj(16 + zlib.MAX_WBITS) if first.startswith(GZIP_MAGIC) else None
+        self.buf = bytearray()
+        self.checked = 0
+
+    def feed(self, chunk):
+        """Add the next bytes of the file; return the header once END is seen, else None"""
+        if self.inflater is None:
+            return self._add(chunk)
+        # Inflate in bounded steps so a tiny compressed range of a large
+        # file doesn't expand into megabytes past the header
+        data = self.inflater.decompress(chunk, 4 * BLOCK_SIZE)
+        while True:
+            header = self._add(data)
+            if header is not None or not self.inflater.unconsumed_tail:
+                return header
+            data = self.inflater.decompress(self.inflater.unconsumed_tail, 4 * BLOCK_SIZE)
+
+    def _add(self, data):
+        self.buf.extend(data)
+        end = find_header_end(self.buf, self.checked)
+        if end is not None:
+            return bytes(self.buf[:end])
+        self.checked = len(self.buf) - len(self.buf) % BLOCK_SIZE
+        return None
+
+
+def read_header_bytes(minio_client, bucket_name, object_name):
+    """
+    Read the raw primary header of a FITS or gzipped FITS object.
+
+    Only byte ranges up to the END card are fetched. Gzip data is inflated
+    incrementally, stopping as soon as END has been decoded, so a header
+    costs about the same for .fits.gz as for .fits.
+    """
+    reader = _RangedReader(minio_client, bucket_name, object_name)
+    chunk = reader.read()
+    scanner = _HeaderScanner(chunk)
+    while True:
+        header = scanner.feed(chunk)
+        if header is not None:
+            return header
+        if reader.eof or len(scanner.buf) > MAX_HEADER_BYTES:
+            raise ValueError(f"No END card found in the header of {object_name}")
+        chunk = reader.read()
+
+
+def header_bytes_from_prefix(data):
+    """
+    The raw primary header from the first bytes of a FITS or gzipped FITS
+    file, or None if its END card is not within `data`
+    """
+    return _HeaderScanner(data).feed(data)
+
+
+def read_primary_header(minio_client, bucket_name, object_name):
+    """
+    Return the primary header of a FITS object as an astropy Header, using
+    ranged reads only. Returns None for tile-compressed (.fits.fz) objects,
+    whose image header lives in an extension; callers fall back to opening
+    the full file for those.
+    """
+    from astropy.io import fits
+
+    header = fits.Header.fromstring(read_header_bytes(minio_client, bucket_name, object_name))
+    if header.get('NAXIS', 0) == 0 and object_name.lower().endswith('.fz'):
+        return None
+    return header
+
+
+def header_to_list(header):
+    """Header cards in the shape returned by the header endpoints"""
+    return [
+        {'Keyword': card.keyword, 'Value': str(card.value), 'Comment': card.comment}
+        for card in header.cards
+    ]
+
+
+
+def _scan_string(text):
+    """
+    Split "'quoted' / comment" into the raw quoted text and the rest, the
+    way astropy does: the string ends at the first quote followed only by
+    spaces and an optional comment. Returns None if there is no such quote
+    or the text is not printable ASCII.
+    """
+    end = text.find("'", 1)
+    while end != -1:
+        rest = text[end + 1:].lstrip(' ')
+        if not rest or rest[0] == '/':
+            raw = text[1:end]
+            if not raw.isascii() or not raw.isprintable():
+                return None
+            return raw, rest
+        end = text.find("'", end + 1)
+    return None
+
+
+def _comment(rest):
+    """Comment text of the part of a card after its value"""
+    return rest[1:].lstrip(' ').rstrip() if rest else ''
+
+
+def _number(text):
+    """str() of a FITS integer or real, as astropy parses it (None if invalid)"""
+    match = _NUMBER_RE.fullmatch(text)
+    if match is None:
+        return None
+    if match.group(3) is None and '.' not in text:
+        return int(text)
+    return float(text.translate(_FIX_EXPONENT))
+
+
+def _parse_value(valuecomment):
+    """
+    (value, comment) of a card's value field, with the value formatted as
+    str(card.value). Returns None for anything astropy would treat specially
+    (undefined values, record-valued keywords, malformed values).
+    """
+    if valuecomment[:1] == "'":
+        scanned = _scan_string(valuecomment)
+        if scanned is None:
+            return None
+        raw, rest = scanned
+        # 'DP1.AXIS.1: 2' style strings may be record-valued keyword cards
+        if ': ' in raw:
+            return None
+        return raw.replace("''", "'").rstrip(), _comment(rest)
+
+    value, sep, comment = valuecomment.partition('/')
+    value = value.rstrip(' ')
+    comment = comment.lstrip(' ').rstrip() if sep else ''
+    if value == 'T' or value == 'F':
+        return str(value == 'T'), comment
+    if value[:1] == '(':
+        match = _COMPLEX_RE.fullmatch(value)
+        if match is None:
+            return None
+        real, imag = _number(match.group(1)), _number(match.group(2))
+        if real is None or imag is None:
+            return None
+        return str(real + imag * 1j), comment
+    number = _number(value)
+    if number is None:
+        return None
+    return str(number), comment
+
+
+def _parse_long_string(images):
+    """(value, comment) of a string card followed by CONTINUE cards"""
+    values = []
+    comments = []
+    for i, image in enumerate(images):
+        valuecomment = image.split('= ', 1)[1].strip() if i == 0 else image[8:].strip()
+        if valuecomment[:1] != "'":
+            return None
+        scanned = _scan_string(valuecomment)
+        if scanned is None:
+            return None
+        raw, rest = scanned
+        value = raw.rstrip()
+        if value.endswith('&'):
+            value = value[:-1]
+        values.append(value)
+        comment = _comment(rest)
+        if comment:
+            comments.append(comment)
+    # astropy re-parses the joined card, so do the same
+    return _parse_value(f"'{''.join(values)}' / {' '.join(comments)}")
+
+
+def _parse_card(images):
+    """
+    (keyword, value, comment) of one logical card (an 80-character image
+    plus any CONTINUE images) that _SCALAR_CARD_RE did not match, or None
+    if it needs astropy's parser
+    """
+    image = images[0]
+    if len(images) == 1 and image[:8] in COMMENTARY_PREFIXES:
+        return image[:8].strip(), image[8:].rstrip(), ''
+
+    if image[:9] == 'HIERARCH ' and '= ' in image:
+        keyword, valuecomment = image.split('= ', 1)
+        keyword = keyword[9:].strip()
+    elif _KEYWORD_RE.match(image) and image.find('= ') == 8 and image[:8].rstrip() not in SPECIAL_KEYWORDS:
+        keyword = image[:8].rstrip()
+        valuecomment = image[10:]
+    else:
+        return None
+
+    if len(images) > 1:
+        parsed = _parse_long_string(images)
+    else:
+        parsed = _parse_value(valuecomment.strip())
+    if parsed is None:
+        return None
+    return (keyword,) + parsed
+
+
+def _astropy_card(images):
+    from astropy.io import fits
+
+    card = fits.Card.fromstring(''.join(images))
+    return card.keyword, str(card.value), card.comment
+
+
+def parse_header_cards(data):
+    """
+    Parse a raw header (bytes, as returned by read_header_bytes) into
+    (keyword, value, comment) tuples, the same as iterating
+    fits.Header.fromstring(data).cards with values passed through str().
+
+    CONTINUE long strings, HIERARCH keywords, commentary cards and string,
+    logical, integer, real and complex values are parsed here; anything
+    else (undefined values, record-valued keywords, malformed cards) is
+    handed to astropy one card at a time.
+    """
+    text = data.decode('latin1')
+    if len(text) % CARD_SIZE:
+        text = text.ljust(len(text) + CARD_SIZE - len(text) % CARD_SIZE)
+    images = [text[start:start + CARD_SIZE] for start in range(0, len(text), CARD_SIZE)]
+    end_card = END_CARD.decode('ascii')
+    scalar_card = _SCALAR_CARD_RE.match
+    hierarch_card = _HIERARCH_SCALAR_CARD_RE.match
+    has_continue = 'CONTINUE' in text
+    cards = []
+    append = cards.append
+    i, count = 0, len(images)
+    while i < count:
+        image = images[i]
+        if image == end_card:
+            break
+        following = i + 1
+        if has_continue:
+            while following < count and images[following][:8] == 'CONTINUE':
+                following += 1
+        if following == i + 1:
+            # Most cards are a number or a logical: one match, inlined
+            hierarch = image[:9] == 'HIERARCH '
+            match = (hierarch_card if hierarch else scalar_card)(image.rstrip())
+            if match is not None:
+                keyword, number, exponent, logical, comment = match.groups()
+                if hierarch:
+                    keyword = keyword.strip()
+                if keyword not in SPECIAL_KEYWORDS:
+                    if logical is not None:
+                        value = str(logical == 'T')
+                    elif exponent is None and '.' not in number:
+                        value = str(int(number))
+                    elif exponent is None or exponent[0] in 'Ee':
+                        value = str(float(number))
+                    else:
+                        value = str(float(number.translate(_FIX_EXPONENT)))
+                    append((keyword, value, comment or ''))
+                    i = following
+                    continue
+        card = images[i:following]
+        append(_parse_card(card) or _astropy_card(card))
+        i = following
+    return cards
+
+
+def header_list_from_bytes(data):
+    """Cards of a raw header in the shape returned by the header endpoints"""
+    return [
+        {'Keyword': keyword, 'Value': value, 'Comment': comment}
+        for keyword, value, comment in parse_header_cards(data)
+    ]
+
+
+def read_primary_header_list(minio_client, bucket_name, object_name):
+    """
+    Primary header cards of a FITS object, from ranged reads and without
+    building an astropy Header. Returns None for tile-compressed objects,
+    like read_primary_header().
+    """
+    cards = header_list_from_bytes(read_header_bytes(minio_client, bucket_name, object_name))
+    if object_name.lower().endswith('.fz'):
+        naxis = next((card['Value'] for card in cards if card['Keyword'] == 'NAXIS'), '0')
+        if naxis == '0':
+            return None
+    return cards
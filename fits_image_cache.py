@@ -2,10 +2,10 @@ from flask import Flask, jsonify, send_file
 import os
 import logging
 import hashlib
+from metrics import IMAGE_CACHE_LOOKUPS
 from datetime import datetime, timedelta
 
 # Configure logging
-logging.basicConfig(level=logging.DEBUG)
 logger = logging.getLogger(__name__)
 
 class FITSImageCache:
@@ -19,7 +19,7 @@ class FITSImageCache:
         """Create the cache directory if it doesn't exist"""
         if not os.path.exists(self.cache_dir):
             os.makedirs(self.cache_dir)
-            logger.info(f"Created cache directory: {self.cache_dir}")
+            logger.info("Created cache directory: %s", self.cache_dir)
     
     def _get_cache_path(self, fits_file):
         """Generate a unique cache path for a FITS file"""
@@ -35,12 +35,16 @@ class FITSImageCache:
             # Check if cache is expired
             cache_time = datetime.fromtimestamp(os.path.getmtime(cache_path))
             if datetime.now() - cache_time < self.max_age:
-                logger.debug(f"Cache hit for {fits_file}")
+                logger.debug("Cache hit for %s", fits_file)
+                IMAGE_CACHE_LOOKUPS.labels('hit').inc()
                 return cache_path
             else:
-                logger.debug(f"Cache expired for {fits_file}")
+                logger.debug("Cache expired for %s", fits_file)
+                IMAGE_CACHE_LOOKUPS.labels('expired').inc()
                 os.remove(cache_path)
+                return None
         
+        IMAGE_CACHE_LOOKUPS.labels('miss').inc()
         return None
     
     def store_image(self, fits_file, image_data):
@@ -49,10 +53,10 @@ class FITSImageCache:
         try:
             with open(cache_path, 'wb') as f:
                 f.write(image_data)
-            logger.debug(f"Stored image in cache: {fits_file}")
+            logger.debug("Stored image in cache: %s", fits_file)
             return cache_path
         except Exception as e:
-            logger.error(f"Error storing image in cache: {str(e)}")
+            logger.error("Error storing image in cache: %s", e)
             return None
 
 # Example usage:
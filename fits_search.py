@@ -0,0 +1,117 @@
+from datetime import date
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Filters accepted by the database-backed search. Names follow the
+# /filtered-search query parameters so the same query string works for both.
+LIST_FILTERS = {
+    # query parameter: (column, case folding applied to both sides)
+    'telescopes': ('telescope', 'lower'),
+    'instruments': ('instrume', 'upper'),
+    'observationTypes': ('obs_type', 'upper'),
+}
+
+# Every parameter build_search_query reads
+SEARCH_PARAMS = frozenset({*LIST_FILTERS, 'observer', 'target', 'start', 'end', 'mjd_min', 'mjd_max', 'fileids'})
+
+
+def _split_list(param, value):
+    """
+    Non-empty values of a list parameter: a comma separated string (query
+    string) or a list of strings or numbers (JSON); ValueError otherwise
+    """
+    if not value:
+        return []
+    if isinstance(value, str):
+        value = value.split(',')
+    elif isinstance(value, (list, tuple)) and \
+            all(isinstance(v, (str, int, float)) and not isinstance(v, bool) for v in value):
+        value = [str(v) for v in value]
+    else:
+        raise ValueError(f"{param} must be a comma separated string or a list")
+    return [v.strip() for v in value if v.strip()]
+
+
+def _text(param, value):
+    """A string parameter, stripped; ValueError naming the parameter otherwise"""
+    if value is None:
+        return ''
+    if not isinstance(value, str):
+        raise ValueError(f"{param} must be a string")
+    return value.strip()
+
+
+def _parse_date(param, value):
+    """A YYYY-MM-DD parameter as a date; ValueError naming the parameter otherwise"""
+    try:
+        return date.fromisoformat(_text(param, value))
+    except ValueError:
+        raise ValueError(f"{param} must be a date (YYYY-MM-DD), got {value!r}") from None
+
+
+def build_search_query(args, columns=None):
+    """
+    Build a SELECT over fits_headers from search parameters.
+
+    Args:
+        args: mapping of query parameters (e.g. request.args)
+            telescopes, instruments, observationTypes: comma separated lists
+                (or lists, from a JSON body)
+            observer: exact match (case-insensitive)
+            target: substring of trg_name (case-insensitive)
+            start, end: obs_date range (YYYY-MM-DD, inclusive)
+            mjd_min, mjd_max: obs_mjd range
+            fileids: comma separated list of file ids
+        columns (list): columns to select, already validated by the caller
+
+    Returns:
+        tuple: (sql, params) ordered by date_obs, fileid
+    """
+    where = []
+    params = []
+
+    for param, (column, case) in LIST_FILTERS.items():
+        values = _split_list(param, args.get(param))
+        if values:
+            where.append(f"{case}({column}) = ANY(%s)")
+            params.append([getattr(v, case)() for v in values])
+
+    observer = _text('observer', args.get('observer'))
+    if observer:
+        where.append("upper(observer) = %s")
+        params.append(observer.upper())
+
+    target = _text('target', args.get('target'))
+    if target:
+        where.append("trg_name ILIKE %s")
+        params.append(f"%{target}%")
+
+    # obs_date is the partition key, so these ranges prune partitions
+    if args.get('start'):
+        where.append("obs_date >= %s")
+        params.append(_parse_date('start', args.get('start')))
+    if args.get('end'):
+        where.append("obs_date <= %s")
+        params.append(_parse_date('end', args.get('end')))
+
+    if args.get('mjd_min'):
+        where.append("obs_mjd >= %s")
+        params.append(float(args.get('mjd_min')))
+    if args.get('mjd_max'):
+        where.append("obs_mjd <= %s")
+        params.append(float(args.get('mjd_max')))
+
+    fileids = _split_list('fileids', args.get('fileids'))
+    if fileids:
+        where.append("fileid = ANY(%s::bigint[])")
+        params.append([int(f) for f in fileids])
+
+    select = ', '.join(columns) if columns else '*'
+    sql = f"SELECT {select} FROM fits_headers"
+    if where:
+        sql += " WHERE " + " AND ".join(where)
+    sql += " ORDER BY date_obs NULLS LAST, fileid"
+
+    logger.debug("Search query: %s params=%s", sql, params)
+    return sql, params
@@ -0,0 +1,299 @@
+"""
+Out-of-core statistics and histograms of FITS images.
+
+image_stats() reads an image HDU through `section` in blocks of at most
+FITS_STATS_BLOCK_MB, so a cube of any size is summarized in bounded memory.
+Scaled (BZERO/BSCALE) and tile-compressed images are read the same way.
+It returns:
+
+- exact count, non-finite counts (NaN, +Inf, -Inf), min, max, mean and
+  standard deviation, merged block by block (Chan et al.);
+- a histogram with fixed-width bins over [min, max] or a given range;
+- approximate quantiles from a QuantileSketch.
+
+The blocks are read twice: once for the statistics, then for the
+histogram, whose bins span the exact min and max unless a range is given.
+bins=0 skips the histogram and its second pass.
+
+QuantileSketch is a DDSketch: values fall into logarithmic buckets, so
+every quantile is within a relative error `alpha` of a true sample value.
+Sketches of blocks, HDUs or files can be merged without loss, and the
+number of buckets is capped (the smallest magnitudes are collapsed first).
+
+/api/fits-stats/ (setup_stats_route) serves this for the archive, and
+`python verify_fits.py --stats <file>` for local files.
+"""
+
+from flask import request, jsonify
+import math
+import os
+import logging
+
+import numpy as np
+
+from conditional_get import make_etag, not_modified, set_validators
+from fits_compression import primary_image_hdu
+
+logger = logging.getLogger(__name__)
+
+BLOCK_BYTES = int(os.environ.get('FITS_STATS_BLOCK_MB', '16')) * 1024 * 1024
+DEFAULT_BINS = 256
+MAX_BINS = 10000
+DEFAULT_QUANTILES = (0.001, 0.01, 0.05, 0.25, 0.5, 0.75, 0.95, 0.99, 0.999)
+
+
+class _BucketStore:
+    """Counts of consecutive integer bucket indices"""
+
+    def __init__(self):
+        self.offset = 0
+        self.counts = np.zeros(0, dtype=np.int64)
+
+    def add(self, indices, counts=None):
+        if len(indices) == 0:
+            return
+        low, high = int(indices.min()), int(indices.max())
+        self._extend(low, high)
+        self.counts[low - self.offset:high - self.offset + 1] += np.bincount(
+            indices - low, weights=counts, minlength=high - low + 1
+        ).astype(np.int64)
+
+    def _extend(self, low, high):
+        if not len(self.counts):
+            self.offset = low
+            self.counts = np.zeros(high - low + 1, dtype=np.int64)
+            return
+        new_low, new_high = min(low, self.offset), max(high, self.offset + len(self.counts) - 1)
+        if new_low == self.offset and new_high == self.offset + len(self.counts) - 1:
+            return
+        counts = np.zeros(new_high - new_low + 1, dtype=np.int64)
+        counts[self.offset - new_low:self.offset - new_low + len(self.counts)] = self.counts
+        self.offset, self.counts = new_low, counts
+
+    def collapse(self, max_buckets):
+        """Fold the lowest buckets into one so that at most `max_buckets` remain"""
+        excess = len(self.counts) - max_buckets
+        if excess > 0:
+            self.counts[excess] += self.counts[:excess].sum()
+            self.counts = self.counts[excess:]
+            self.offset += excess
+
+    def merge(self, other):
+        if len(other.counts):
+            self.add(np.arange(other.offset, other.offset + len(other.counts)), other.counts)
+
+    @property
+    def total(self):
+        return int(self.counts.sum())
+
+
+class QuantileSketch:
+    """Mergeable quantile sketch with relative error `alpha` (DDSketch)"""
+
+    def __init__(self, alpha=0.01, max_buckets=2048):
+        self.alpha = alpha
+        self.gamma = (1 + alpha) / (1 - alpha)
+        self.log_gamma = math.log(self.gamma)
+        self.max_buckets = max_buckets
+        self.positive = _BucketStore()
+        self.negative = _BucketStore()
+        self.zeros = 0
+
+    @property
+    def count(self):
+        return self.positive.total + self.negative.total + self.zeros
+
+    def _indices(self, magnitudes):
+        return np.ceil(np.log(magnitudes) / self.log_gamma).astype(np.int64)
+
+    def add(self, values):
+        """Add an array of finite values"""
+        values = np.asarray(values, dtype=np.float64).ravel()
+        tiny = np.finfo(np.float64).tiny
+        positive = values[values > tiny]
+        negative = -values[values < -tiny]
+        self.zeros += len(values) - len(positive) - len(negative)
+        self.positive.add(self._indices(positive))
+        self.negative.add(self._indices(negative))
+        self.positive.collapse(self.max_buckets)
+        self.negative.collapse(self.max_buckets)
+
+    def merge(self, other):
+        if other.gamma != self.gamma:
+            raise ValueError("Only sketches with the same alpha can be merged")
+        self.positive.merge(other.positive)
+        self.negative.merge(other.negative)
+        self.zeros += other.zeros
+        self.positive.collapse(self.max_buckets)
+        self.negative.collapse(self.max_buckets)
+
+    def _value(self, index):
+        return 2 * self.gamma ** index / (self.gamma + 1)
+
+    def quantile(self, q):
+        """Value at quantile q (0..1), or None for an empty sketch"""
+        count = self.count
+        if count == 0:
+            return None
+        rank = q * (count - 1)
+        # Most negative first: the negative store in descending index order
+        seen = 0
+        negative = self.negative.counts
+        for i in range(len(negative) - 1, -1, -1):
+            seen += negative[i]
+            if seen > rank:
+                return -self._value(self.negative.offset + i)
+        seen += self.zeros
+        if seen > rank:
+            return 0.0
+        positive = np.cumsum(self.positive.counts) + seen
+        i = int(np.searchsorted(positive, rank, side='right'))
+        return self._value(self.positive.offset + min(i, len(positive) - 1))
+
+
+class _Moments:
+    """Exact count, extrema, mean and variance merged block by block"""
+
+    def __init__(self):
+        self.n = 0
+        self.mean = 0.0
+        self.m2 = 0.0
+        self.min = None
+        self.max = None
+
+    def add(self, values):
+        n = len(values)
+        if n == 0:
+            return
+        mean = float(values.mean())
+        m2 = float(np.square(values - mean).sum())
+        low, high = float(values.min()), float(values.max())
+        total = self.n + n
+        delta = mean - self.mean
+        self.mean += delta * n / total
+        self.m2 += m2 + delta * delta * self.n * n / total
+        self.n = total
+        self.min = low if self.min is None else min(self.min, low)
+        self.max = high if self.max is None else max(self.max, high)
+
+
+def _blocks(hdu, max_elements):
+    """Blocks of an image HDU read through `section`, each at most max_elements"""
+    shape = tuple(hdu.header[f'NAXIS{i}'] for i in range(hdu.header['NAXIS'], 0, -1))
+    yield from _section_blocks(hdu.section, shape, max_elements, ())
+
+
+def _section_blocks(section, shape, max_elements, prefix):
+    inner = math.prod(shape[1:])
+    if len(shape) == 1 or inner <= max_elements:
+        step = max(1, max_elements // max(inner, 1))
+        for start in range(0, shape[0], step):
+            yield section[prefix + (slice(start, min(start + step, shape[0])),)]
+    else:
+        for i in range(shape[0]):
+            yield from _section_blocks(section, shape[1:], max_elements, prefix + (i,))
+
+
+def image_stats(hdu, bins=DEFAULT_BINS, value_range=None, quantiles=DEFAULT_QUANTILES,
+                alpha=0.01, block_bytes=BLOCK_BYTES):
+    """Statistics, histogram and quantiles of an image HDU, as a JSON-ready dict"""
+    if hdu.header.get('NAXIS', 0) == 0 or getattr(hdu, 'section', None) is None:
+        raise ValueError(f"HDU {hdu.name or 0} has no image data")
+    max_elements = max(1, block_bytes // 8)
+    moments = _Moments()
+    sketch = QuantileSketch(alpha)
+    count = nan = posinf = neginf = 0
+
+    for block in _blocks(hdu, max_elements):
+        block = np.asarray(block, dtype=np.float64).ravel()
+        count += len(block)
+        finite = np.isfinite(block)
+        if not finite.all():
+            nan += int(np.isnan(block).sum())
+            posinf += int(np.isposinf(block).sum())
+            neginf += int(np.isneginf(block).sum())
+            block = block[finite]
+        moments.add(block)
+        sketch.add(block)
+
+    result = {
+        'hdu': hdu.name or 'PRIMARY',
+        'shape': [hdu.header[f'NAXIS{i}'] for i in range(hdu.header['NAXIS'], 0, -1)],
+        'count': count,
+        'finite': moments.n,
+        'nan': nan,
+        'posinf': posinf,
+        'neginf': neginf,
+        'min': moments.min,
+        'max': moments.max,
+        'mean': moments.mean if moments.n else None,
+        'std': math.sqrt(moments.m2 / moments.n) if moments.n else None,
+        'quantiles': {str(q): sketch.quantile(q) for q in quantiles},
+        'quantile_relative_error': alpha,
+    }
+
+    if not bins:
+        value_range = None
+    elif value_range is None and moments.n:
+        value_range = (moments.min, moments.max)
+    if value_range is not None:
+        low, high = value_range
+        if high <= low:
+            high = low + 1
+        counts = np.zeros(bins, dtype=np.int64)
+        # Read again: the bins are only known once min and max are
+        for block in _blocks(hdu, max_elements):
+            block = np.asarray(block, dtype=np.float64).ravel()
+            counts += np.histogram(block[np.isfinite(block)], bins=bins, range=(low, high))[0]
+        result['histogram'] = {'edges': np.linspace(low, high, bins + 1).tolist(), 'counts': counts.tolist()}
+    else:
+        result['histogram'] = None
+    return result
+
+
+def setup_stats_route(app, hdul_pool, object_validators):
+    """
+    GET /api/fits-stats/?file=...
+
+    Optional: hdu (index, default the primary image), bins, min and max
+    (histogram range, default the data range) and quantiles (comma
+    separated, 0..1).
+    """
+
+    @app.route('/api/fits-stats/', methods=['GET'])
+    def get_fits_stats():
+        file_name = request.args.get('file')
+        if not file_name:
+            return jsonify({'error': 'No file specified'}), 400
+        try:
+            hdu_index = request.args.get('hdu', type=int)
+            bins = request.args.get('bins', DEFAULT_BINS, type=int)
+            low = request.args.get('min', type=float)
+            high = request.args.get('max', type=float)
+            quantiles = request.args.get('quantiles')
+            quantiles = tuple(float(q) for q in quantiles.split(',')) if quantiles else DEFAULT_QUANTILES
+        except ValueError:
+            return jsonify({'error': 'Invalid quantiles'}), 400
+        if not 0 < bins <= MAX_BINS or (low is None) != (high is None) or \
+                not all(0 <= q <= 1 for q in quantiles):
+            return jsonify({'error': 'Invalid bins, range or quantiles'}), 400
+
+        try:
+            source_etag, last_modified = object_validators(file_name)
+            etag = make_etag(source_etag, 'stats', hdu_index, bins, low, high, quantiles)
+            cached = not_modified(app, etag, last_modified)
+            if cached:
+                return cached
+
+            with hdul_pool.fetch(file_name, source_etag) as spool:
+                hdul = spool.open()
+                hdu = primary_image_hdu(hdul) if hdu_index is None else hdul[hdu_index]
+                spool.wait_for(hdu)
+                stats = image_stats(hdu, bins=bins, value_range=None if low is None else (low, high),
+                                    quantiles=quantiles)
+            return set_validators(jsonify(stats), etag, last_modified, 'public, max-age=3600')
+        except (IndexError, ValueError) as e:
+            return jsonify({'error': str(e)}), 400
+        except Exception as e:
+            logger.error("Error computing statistics of %s: %s", file_name, e)
+            return jsonify({'error': str(e)}), 500
@@ -3,31 +3,32 @@ import numpy as np
 from astropy.io import fits
 from PIL import Image
 import io
-import tempfile
+import time
 import logging
 from fits_image_cache import FITSImageCache
-from astropy.visualization import ZScaleInterval, ImageNormalize, AsinhStretch
+from metrics import render_stage
+from presign_cache import PresignedURLCache
+from object_cache import ObjectCache
+from spectrum_preview import spectrum_hdus, read_spectra, render_spectra, to_png
 
 # Configure logging
-logging.basicConfig(level=logging.DEBUG)
 logger = logging.getLogger(__name__)
 
 class FITSViewer:
-    def __init__(self, minio_client, bucket_name):
+    def __init__(self, minio_client, bucket_name, presign_cache=None, object_cache=None):
         """Initialize the FITS viewer with MinIO connection"""
         self.minio_client = minio_client
         self.bucket_name = bucket_name
         self.cache = FITSImageCache()
+        # FITS objects are shared with the app's other read paths when it passes its cache
+        self.object_cache = object_cache or ObjectCache(minio_client, bucket_name)
+        # URLs are signed with a 1 hour expiry and reused until 5 minutes before it
+        self.presign_cache = presign_cache or PresignedURLCache(minio_client)
     
     def get_download_info(self, fits_file):
         """Generate download information including presigned URL and curl command"""
         try:
-            # Generate presigned URL with 1 hour expiry
-            presigned_url = self.minio_client.presigned_get_object(
-                self.bucket_name,
-                fits_file,
-                expires=3600
-            )
+            presigned_url, expires_at = self.presign_cache.get(self.bucket_name, fits_file)
             
             # Create curl command
             curl_command = f'curl -X GET "{presigned_url}" --output {fits_file}'
@@ -36,11 +37,11 @@ class FITSViewer:
                 'presigned_url': presigned_url,
                 'curl_command': curl_command,
                 'filename': fits_file,
-                'expires_in': '1 hour'
+                'expires_in': f'{int((expires_at - time.time()) // 60)} minutes'
             }
             
         except Exception as e:
-            logger.error(f"Error generating download info: {str(e)}")
+            logger.error("Error generating download info: %s", e)
             raise
     
     def get_fits_image(self, fits_file):
@@ -49,25 +50,41 @@ class FITSViewer:
             # Check cache first
             cached_path = self.cache.get_cached_image(fits_file)
             if cached_path:
-                logger.debug(f"Returning cached image for {fits_file}")
+                logger.debug("Returning cached image for %s", fits_file)
                 return cached_path
             
             # If not in cache, process the FITS file
-            with tempfile.NamedTemporaryFile(delete=False, suffix='.fits') as temp_file:
-                self.minio_client.fget_object(self.bucket_name, fits_file, temp_file.name)
-                processed_image = self._process_fits_file(temp_file.name)
+            with self.object_cache.fetch(fits_file) as spool:
+                with render_stage('viewer', 'download'):
+                    hdul = spool.open()
+                    hdus = spectrum_hdus(hdul)
+                    # Spectra are drawn in full, images only from the first frame of the SCI extension
+                    for hdu in hdus:
+                        spool.wait_for(hdu)
+                    if not hdus and len(hdul) > 1:
+                        spool.wait_for(hdul[1], planes=1)
+                processed_image = self._process_hdul(hdul)
                 
-                # Store in cache
-                cache_path = self.cache.store_image(fits_file, processed_image)
-                return cache_path
+            # Store in cache
+            cache_path = self.cache.store_image(fits_file, processed_image)
+            return cache_path
                 
         except Exception as e:
-            logger.error(f"Error processing FITS file: {str(e)}")
+            logger.error("Error processing FITS file: %s", e)
             raise
     
     def _process_fits_file(self, file_path):
         """Process a FITS file into a viewable image"""
         with fits.open(file_path) as hdul:
+            return self._process_hdul(hdul)
+
+    def _process_hdul(self, hdul):
+        """Process an open FITS file into a viewable image"""
+        hdus = spectrum_hdus(hdul)
+        if hdus:
+            return self._process_spectra(hdus)
+
+        with render_stage('viewer', 'decode'):
             # Get the SCI extension data (index 1)
             if len(hdul) < 2:
                 raise ValueError("FITS file doesn't contain the expected SCI extension")
@@ -80,20 +97,33 @@ class FITSViewer:
             # If data is multi-dimensional, take the first frame
             if data.ndim > 2:
                 data = data[0]
-            
+        
+        with render_stage('viewer', 'normalize'):
+            from astropy.visualization import ZScaleInterval, ImageNormalize, AsinhStretch
+
             # Use ZScale normalization and AsinhStretch for better visualization
             norm = ImageNormalize(data, interval=ZScaleInterval(), stretch=AsinhStretch())
             normalized = norm(data)
             
             # Convert to 8-bit image
             image_data = (normalized * 255).astype(np.uint8)
-            
+        
+        with render_stage('viewer', 'encode'):
             # Convert to PNG
             image = Image.fromarray(image_data)
             img_byte_arr = io.BytesIO()
             image.save(img_byte_arr, format='PNG')
-            
-            return img_byte_arr.getvalue()
+        
+        return img_byte_arr.getvalue()
+
+    def _process_spectra(self, hdus):
+        """Draw 1D, echelle order and table spectra (see spectrum_preview.py)"""
+        with render_stage('viewer', 'decode'):
+            spectra = read_spectra(hdus)
+        with render_stage('viewer', 'normalize'):
+            image_data = render_spectra(spectra)
+        with render_stage('viewer', 'encode'):
+            return to_png(image_data)
 
 # Example usage
 if __name__ == "__main__":
@@ -0,0 +1,190 @@
+"""
+Per-worker pool of open, memory-mapped HDULists.
+
+Interactive use (pixel probes, tiles, slices) reads the same few files over
+and over; fits.open() and parsing the headers each time costs far more than
+the read itself. HDUListPool keeps HDULists of objects that are complete in
+the object cache (object_cache.py) open, keyed by object name and ETag, so
+a repeated read is a dict lookup.
+
+The pool is bounded by FITS_HDUL_POOL_FILES open files (each holds two
+descriptors: the cache pin and astropy's file) and FITS_HDUL_POOL_MB of
+mapped file size, and closes the least recently used HDULists first. An
+HDUList in use by a request is closed only after the request releases it.
+
+When an HDUList enters the pool, its headers are parsed and every image
+HDU is read once through `section`, which creates the memory map and
+astropy's lazy attributes. After that, section and data reads only read
+the map, so concurrent requests can share the HDUList. Callers must not
+modify it.
+
+Objects still downloading are not pooled: fetch() returns the object
+cache's reader, which has the same interface.
+
+    with hdul_pool.fetch('12345.fits', etag) as entry:
+        hdul = entry.open()
+        entry.wait_for(hdul[0], planes=1)
+"""
+
+from collections import OrderedDict
+import os
+import threading
+import logging
+
+from metrics import HDUL_POOL_LOOKUPS, HDUL_POOL_OPEN_FILES, HDUL_POOL_MAPPED_BYTES
+from object_cache import CachedObject
+
+logger = logging.getLogger(__name__)
+
+MAX_FILES = int(os.environ.get('FITS_HDUL_POOL_FILES', '64'))
+MAX_BYTES = int(os.environ.get('FITS_HDUL_POOL_MB', '16384')) * 1024 * 1024
+
+
+def _prime(hdul):
+    """Parse every header and load the lazy parts of the image HDUs"""
+    hdul.readall()
+    for hdu in hdul:
+        shape = [hdu.header.get(f'NAXIS{i}', 0) for i in range(1, hdu.header.get('NAXIS', 0) + 1)]
+        if getattr(hdu, 'section', None) is None or not shape or 0 in shape:
+            continue
+        try:
+            hdu.section[(0,) * len(shape)]
+        except Exception as e:
+            logger.debug("Could not prime HDU %s: %s", hdu.name, e)
+
+
+class _Entry:
+    def __init__(self, key, cached, hdul, size):
+        self.key = key
+        self.cached = cached
+        self.hdul = hdul
+        self.size = size
+        self.users = 0
+        self.evicted = False
+
+
+class PooledObject:
+    """A pooled HDUList leased to one request; reads like a RangeSpool"""
+
+    def __init__(self, pool, entry):
+        self.pool = pool
+        self.entry = entry
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def open(self):
+        return self.entry.hdul
+
+    def wait_for(self, hdu, planes=None):
+        pass
+
+    def wait_all(self):
+        pass
+
+    def close(self):
+        if self.entry is not None:
+            self.pool._release(self.entry)
+            self.entry = None
+
+
+class HDUListPool:
+    """LRU pool of open HDULists of cached objects"""
+
+    def __init__(self, object_cache, max_files=MAX_FILES, max_bytes=MAX_BYTES):
+        self.object_cache = object_cache
+        self.max_files = max_files
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+    def fetch(self, object_name, etag=None):
+        """
+        PooledObject for the current version of an object (`etag`, looked
+        up when not given), or the object cache's reader while it is still
+        downloading; use it as a context manager
+        """
+        if etag is None:
+            etag = self.object_cache.minio_client.stat_object(self.object_cache.bucket_name, object_name).etag
+        key = (object_name, etag)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                entry.users += 1
+                HDUL_POOL_LOOKUPS.labels('hit').inc()
+                return PooledObject(self, entry)
+
+        source = self.object_cache.fetch(object_name, etag)
+        if not isinstance(source, CachedObject):
+            HDUL_POOL_LOOKUPS.labels('downloading').inc()
+            return source
+        try:
+            hdul = source.open()
+            _prime(hdul)
+        except Exception:
+            source.close()
+            raise
+        entry = _Entry(key, source, hdul, os.path.getsize(source.path))
+
+        with self._lock:
+            existing = self._entries.get(key)
+            if existing is not None:
+                # Another request opened it meanwhile
+                existing.users += 1
+                self._entries.move_to_end(key)
+                HDUL_POOL_LOOKUPS.labels('hit').inc()
+                source.close()
+                return PooledObject(self, existing)
+            # Older versions of the object will not be asked for again
+            for stale in [e for k, e in self._entries.items() if k[0] == object_name]:
+                self._remove(stale)
+            entry.users = 1
+            self._entries[key] = entry
+            self._bytes += entry.size
+            HDUL_POOL_LOOKUPS.labels('miss').inc()
+            self._evict()
+        return PooledObject(self, entry)
+
+    def _release(self, entry):
+        with self._lock:
+            entry.users -= 1
+            if entry.users == 0 and entry.evicted:
+                self._close(entry)
+            else:
+                self._evict()
+
+    def _remove(self, entry):
+        """Take an entry out of the pool; close it now or after its last user"""
+        del self._entries[entry.key]
+        self._bytes -= entry.size
+        entry.evicted = True
+        if entry.users == 0:
+            self._close(entry)
+
+    def _close(self, entry):
+        try:
+            entry.cached.close()
+        except Exception as e:
+            logger.warning("Closing pooled %s failed: %s", entry.key[0], e)
+
+    def _evict(self):
+        """Close least recently used HDULists (not in use) until within budget"""
+        for entry in list(self._entries.values()):
+            if len(self._entries) <= self.max_files and self._bytes <= self.max_bytes:
+                break
+            if entry.users == 0:
+                self._remove(entry)
+        HDUL_POOL_OPEN_FILES.set(len(self._entries))
+        HDUL_POOL_MAPPED_BYTES.set(self._bytes)
+
+    def clear(self):
+        """Close every HDUList not in use and drop the rest once released"""
+        with self._lock:
+            for entry in list(self._entries.values()):
+                self._remove(entry)
+            self._evict()
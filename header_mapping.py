@@ -0,0 +1,397 @@
+#!/usr/bin/env python3
+"""
+Declarative mapping from FITS header keywords to fits_headers columns.
+
+HEADER_COLUMNS lists every column filled at ingest with the keywords it is
+read from (the first alias present wins) and its type. The table is checked
+against the CREATE TABLE in database/schema.sql (verify_schema(), called by
+minio_fits_backend at import), so a column that is added, renamed or
+retyped on one side only fails at startup instead of being truncated or
+rejected by Postgres on some later upload.
+
+header_to_row() extracts one row; headers_to_columns() and copy_headers()
+convert and load batches with COPY.
+
+Usage:
+    python header_mapping.py check
+    python header_mapping.py load frame1.fits frame2.fits ...
+"""
+
+import argparse
+import io
+import os
+import re
+import sys
+from datetime import datetime
+
+SCHEMA_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "database", "schema.sql")
+
+HEADER_COLUMNS = (
+    # column, keyword aliases, type
+    ('fileid', ('FILEID',), 'int'),
+    ('simple', ('SIMPLE',), 'bool'),
+    ('bitpix', ('BITPIX',), 'int'),
+    ('naxis', ('NAXIS',), 'int'),
+    ('naaxis1', ('NAXIS1',), 'int'),
+    ('naaxis2', ('NAXIS2',), 'int'),
+
+    ('data_type', ('DATA_TYP',), 'str'),
+    ('qual_fac', ('QUAL_FAC',), 'int'),
+    ('obs_cmts', ('OBS_CMTS',), 'str'),
+
+    ('pi_name', ('PI_NAME',), 'str'),
+    ('observer', ('OBSERVER',), 'str'),
+    ('tel_oprt', ('TEL_OPRT',), 'str'),
+
+    ('telescope', ('TELESCOP',), 'str'),
+    ('origin', ('ORIGIN',), 'str'),
+    ('observat', ('OBSERVAT',), 'str'),
+
+    ('obs_lat', ('OBS_LAT',), 'float'),
+    ('obs_long', ('OBS_LONG',), 'float'),
+    ('obs_elev', ('OBS_ELEV',), 'float'),
+
+    ('instrume', ('INSTRUME',), 'str'),
+    ('filter1', ('FILTER1',), 'str'),
+    ('filter2', ('FILTER2',), 'str'),
+
+    ('cat_comp', ('CAT-COMP',), 'bool'),
+    ('solarobj', ('SOLAROBJ',), 'bool'),
+    ('radecsys', ('RADECSYS',), 'str'),
+    ('epoch', ('EPOCH',), 'str'),
+
+    # Written both as plain and as HIERARCH keywords by different pipelines
+    ('trg_name', ('TRG_NAME', 'TRG NAME'), 'str'),
+    ('trg_alph', ('TRG_ALPH', 'TRG ALPH'), 'float'),
+    ('trg_delt', ('TRG_DELT', 'TRG DELT'), 'float'),
+    ('trg_type', ('TRG_TYPE', 'TRG TYPE'), 'str'),
+    ('trg_epoc', ('TRG_EPOC', 'TRG EPOC'), 'int'),
+
+    ('bunit', ('BUNIT',), 'str'),
+    ('datamax', ('DATAMAX',), 'int'),
+    ('datamin', ('DATAMIN',), 'int'),
+
+    # DATE-OBS is split into a timestamp and the night/time columns
+    ('date_obs', ('DATE-OBS',), 'timestamp'),
+    ('obs_date', ('DATE-OBS',), 'date'),
+    ('obs_time', ('DATE-OBS',), 'time'),
+    ('obs_tsys', ('OBS_TSYS',), 'str'),
+    ('obs_mjd', ('OBS MJD',), 'float'),
+
+    ('obs_airm', ('AIRMASS', 'OBS AIRM'), 'float'),
+    ('moonangl', ('MOONANGL',), 'float'),
+
+    ('obs_type', ('OBS TYPE',), 'str'),
+    ('ccd_expt', ('CCD EXPT',), 'float'),
+    ('ccd_gain', ('CCD GAIN',), 'float'),
+    ('ccd_rdns', ('CCD RDNS',), 'float'),
+
+    ('ins_lamp', ('INS_LAMP',), 'str'),
+
+    ('bscale', ('BSCALE',), 'float'),
+    ('bzero', ('BZERO',), 'float'),
+    ('o_bzero', ('O_BZERO',), 'int'),
+)
+
+# SQL types a mapping type may be stored in
+SQL_TYPES = {
+    'str': ('VARCHAR', 'TEXT'),
+    'int': ('INTEGER', 'BIGINT', 'SMALLINT'),
+    'float': ('DOUBLE PRECISION', 'REAL', 'NUMERIC'),
+    'bool': ('BOOLEAN',),
+    'timestamp': ('TIMESTAMP',),
+    'date': ('DATE',),
+    'time': ('TIME',),
+}
+
+# Columns filled by the database, not from the header
+DATABASE_COLUMNS = {'id', 'created_at', 'updated_at'}
+
+ROW_COLUMNS = tuple(column for column, _, _ in HEADER_COLUMNS)
+KEYWORDS = frozenset(keyword for _, aliases, _ in HEADER_COLUMNS for keyword in aliases)
+
+
+def _to_str(val):
+    return str(val) if val and val != "" else None
+
+
+def _to_int(val):
+    if val is None or val == "":
+        return None
+    try:
+        return int(val)
+    except (TypeError, ValueError):
+        return None
+
+
+def _to_float(val):
+    if val is None or val == "":
+        return None
+    try:
+        return float(val)
+    except (TypeError, ValueError):
+        return None
+
+
+def _to_timestamp(val):
+    iso = _to_str(val)
+    if iso is None:
+        return None
+    try:
+        return datetime.fromisoformat(iso)
+    except ValueError:
+        return None
+
+
+def _to_date(val):
+    # Only for a DATE-OBS that parses, like date_obs
+    if _to_timestamp(val) is None:
+        return None
+    return str(val).split("T")[0]
+
+
+def _to_time(val):
+    if _to_timestamp(val) is None or "T" not in str(val):
+        return None
+    return str(val).split("T")[1]
+
+
+CONVERTERS = {
+    'str': _to_str,
+    'int': _to_int,
+    'float': _to_float,
+    'bool': bool,
+    'timestamp': _to_timestamp,
+    'date': _to_date,
+    'time': _to_time,
+}
+
+
+def compile_extractor(columns=HEADER_COLUMNS):
+    """
+    Build a function header -> row dict for `columns`.
+
+    The plan (aliases and converter per column) is resolved once. The header
+    is read with one lookup per wanted keyword that is actually present, so
+    it works with astropy Headers and plain dicts alike.
+    """
+    plan = tuple((column, aliases, CONVERTERS[kind]) for column, aliases, kind in columns)
+    wanted = frozenset(keyword for _, aliases, _ in columns for keyword in aliases)
+
+    def extract(header):
+        if isinstance(header, dict):
+            values = header
+        else:
+            # Missing keywords are the expensive case for astropy's Header.get
+            values = {keyword: header[keyword] for keyword in wanted.intersection(header.keys())}
+        row = {}
+        for column, aliases, convert in plan:
+            value = None
+            for keyword in aliases:
+                value = convert(values.get(keyword))
+                if value is not None:
+                    break
+            row[column] = value
+        return row
+
+    return extract
+
+
+_extract_row = compile_extractor()
+
+
+def header_to_row(header):
+    """fits_headers row (column -> value) for one header; FILEID is required"""
+    row = _extract_row(header)
+    if row['fileid'] is None:
+        raise ValueError("FILEID missing or invalid in FITS header")
+    return row
+
+
+def headers_to_columns(headers):
+    """Rows of many headers as column arrays: {column: [value per header]}"""
+    columns = {column: [] for column in ROW_COLUMNS}
+    appenders = [columns[column].append for column in ROW_COLUMNS]
+    for header in headers:
+        row = header_to_row(header)
+        for append, column in zip(appenders, ROW_COLUMNS):
+            append(row[column])
+    return columns
+
+
+def schema_columns(path=SCHEMA_PATH):
+    """{column: SQL type} of the fits_headers CREATE TABLE in schema.sql"""
+    with open(path) as f:
+        sql = f.read()
+    match = re.search(r'CREATE TABLE fits_headers \((.*?)\n\)', sql, re.S)
+    if match is None:
+        raise ValueError(f"No CREATE TABLE fits_headers in {path}")
+    columns = {}
+    for line in match.group(1).splitlines():
+        line = line.split('--')[0].strip()
+        definition = re.match(r'([a-z_0-9]+)\s+(DOUBLE PRECISION|[A-Z]+)', line)
+        if definition and definition.group(1) != 'constraint':
+            columns[definition.group(1)] = definition.group(2)
+    return columns
+
+
+def check_schema(path=SCHEMA_PATH, columns=HEADER_COLUMNS):
+    """Differences between the mapping and schema.sql, as readable strings"""
+    schema = schema_columns(path)
+    problems = []
+    for column, _, kind in columns:
+        sql_type = schema.get(column)
+        if sql_type is None:
+            problems.append(f"{column}: not in fits_headers")
+        elif sql_type not in SQL_TYPES[kind]:
+            problems.append(f"{column}: mapped as {kind} but stored as {sql_type}")
+    mapped = {column for column, _, _ in columns}
+    for column in sorted(set(schema) - mapped - DATABASE_COLUMNS):
+        problems.append(f"{column}: in fits_headers but not filled from the header")
+    return problems
+
+
+def verify_schema(path=SCHEMA_PATH):
+    """Raise ValueError if HEADER_COLUMNS and schema.sql disagree"""
+    problems = check_schema(path)
+    if problems:
+        raise ValueError("Header mapping does not match " + path + ": " + "; ".join(problems))
+
+
+def _copy_value(value):
+    # COPY text format
+    if value is None:
+        return '\\N'
+    if value is True:
+        return 't'
+    if value is False:
+        return 'f'
+    if isinstance(value, str):
+        return (value.replace('\\', '\\\\').replace('\t', '\\t')
+                .replace('\n', '\\n').replace('\r', '\\r'))
+    if isinstance(value, datetime):
+        return value.isoformat()
+    return str(value)
+
+
+def copy_payload(rows, columns=ROW_COLUMNS):
+    """Rows as a COPY ... FROM STDIN text-format buffer"""
+    buffer = io.StringIO()
+    write = buffer.write
+    for row in rows:
+        write('\t'.join([_copy_value(row[column]) for column in columns]))
+        write('\n')
+    buffer.seek(0)
+    return buffer
+
+
+# Months whose partition this process has created or seen (YYYY-MM)
+_known_partitions = set()
+
+
+def ensure_partitions(conn, nights):
+    """
+    Create the missing monthly fits_headers partitions of `nights`.
+
+    Creating a partition locks fits_headers (ACCESS EXCLUSIVE) until commit,
+    so each is created in a short autocommit transaction of its own instead
+    of inside an upsert that may last a whole upload. Call it while `conn`
+    has no transaction open.
+    """
+    import psycopg2
+
+    months = {str(night)[:7]: night for night in nights if night}
+    missing = sorted(month for month in months if month not in _known_partitions)
+    if not missing:
+        return
+    if conn.info.transaction_status != psycopg2.extensions.TRANSACTION_STATUS_IDLE:
+        raise RuntimeError("ensure_partitions() must run before the upsert transaction starts")
+    autocommit = conn.autocommit
+    conn.autocommit = True
+    try:
+        with conn.cursor() as cur:
+            for month in missing:
+                try:
+                    cur.execute("SELECT fits_headers_ensure_partition(%s)", (months[month],))
+                except (psycopg2.errors.DuplicateTable, psycopg2.errors.UniqueViolation):
+                    # Created by another worker at the same moment
+                    pass
+                _known_partitions.add(month)
+    finally:
+        conn.autocommit = autocommit
+
+
+def copy_headers(conn, headers):
+    """
+    Upsert many headers with one COPY into a staging table, with the same
+    semantics as insert_header(): the (fileid, obs_date) row is replaced and
+    a row of the same file under another night is removed. Call it with no
+    transaction open (see ensure_partitions); the caller commits. Returns
+    the number of rows loaded.
+    """
+    # Last header of a file wins, as with one insert_header() per file
+    rows = list({row['fileid']: row for row in map(header_to_row, headers)}.values())
+    if not rows:
+        return 0
+    ensure_partitions(conn, [row['obs_date'] for row in rows])
+    column_list = ", ".join(ROW_COLUMNS)
+    updates = ", ".join(f"{c} = EXCLUDED.{c}" for c in ROW_COLUMNS if c not in ("fileid", "obs_date"))
+
+    with conn.cursor() as cur:
+        cur.execute(
+            f"CREATE TEMP TABLE fits_headers_staging ON COMMIT DROP AS "
+            f"SELECT {column_list} FROM fits_headers WITH NO DATA"
+        )
+        cur.copy_expert(f"COPY fits_headers_staging ({column_list}) FROM STDIN", copy_payload(rows))
+        cur.execute(
+            "DELETE FROM fits_headers f USING fits_headers_staging s "
+            "WHERE f.fileid = s.fileid AND f.obs_date IS DISTINCT FROM s.obs_date"
+        )
+        cur.execute(
+            f"INSERT INTO fits_headers ({column_list}) SELECT {column_list} FROM fits_headers_staging "
+            f"ON CONFLICT (fileid, obs_date) DO UPDATE SET {updates}, updated_at = now()"
+        )
+        cur.execute("DROP TABLE fits_headers_staging")
+    return len(rows)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Check the header mapping or bulk load FITS headers')
+    sub = parser.add_subparsers(dest='command', required=True)
+    sub.add_parser('check', help='Compare HEADER_COLUMNS with database/schema.sql')
+    load = sub.add_parser('load', help='Upsert the primary headers of local FITS files with COPY')
+    load.add_argument('files', nargs='+')
+    load.add_argument('--batch', type=int, default=5000, help='Headers per COPY (default: 5000)')
+    args = parser.parse_args()
+
+    if args.command == 'check':
+        problems = check_schema()
+        for problem in problems:
+            print(problem)
+        print(f"{len(HEADER_COLUMNS)} columns mapped, {len(problems)} problem(s)")
+        return 1 if problems else 0
+
+    import psycopg2
+    from astropy.io import fits
+
+    conn = psycopg2.connect(
+        host=os.environ.get("DB_HOST", "localhost"),
+        database=os.environ.get("DB_NAME", "observatory"),
+        user=os.environ.get("DB_USER", "observatory_user"),
+        password=os.environ.get("DB_PASS", "observatory_pass"),
+        port=os.environ.get("DB_PORT", "5432"),
+    )
+    loaded = 0
+    try:
+        for start in range(0, len(args.files), args.batch):
+            headers = [fits.getheader(path) for path in args.files[start:start + args.batch]]
+            loaded += copy_headers(conn, headers)
+            conn.commit()
+            print(f"{loaded} headers loaded")
+    finally:
+        conn.close()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,95 @@
+"""
+Content-hash index for /api/upload-fits/.
+
+Uploads are hashed (SHA-256) while they are copied to the temporary file.
+fits_content_hashes (database/schema.sql) maps the hash of the uploaded
+bytes and the storage variant (the compression they were stored with) to
+the object they were stored as. An upload whose hash is in the index, and
+whose object is still in MinIO, is answered without parsing the header,
+upserting fits_headers or writing to MinIO, so re-syncing a night costs
+one read of the data.
+"""
+
+import hashlib
+import logging
+
+from minio.error import S3Error
+
+logger = logging.getLogger(__name__)
+
+CHUNK_SIZE = 1024 * 1024
+
+
+def save_hashed(stream, out):
+    """Copy `stream` to the open file `out`; return (sha256 hex digest, size)"""
+    digest = hashlib.sha256()
+    size = 0
+    while True:
+        chunk = stream.read(CHUNK_SIZE)
+        if not chunk:
+            break
+        digest.update(chunk)
+        out.write(chunk)
+        size += len(chunk)
+    return digest.hexdigest(), size
+
+
+def storage_variant(compress, quantize_level, is_gzip=False):
+    """How the uploaded bytes are stored: '' (as uploaded), 'gz', 'rice', 'rice:q16', ..."""
+    if not compress:
+        return 'gz' if is_gzip else ''
+    if quantize_level is None:
+        return compress
+    return f'{compress}:q{quantize_level:g}'
+
+
+def find_stored(conn, minio_client, bucket_name, content_hash, storage):
+    """
+    (fileid, object_name) of an earlier upload of the same bytes and storage
+    variant whose object still exists, or None
+    """
+    with conn.cursor() as cur:
+        cur.execute(
+            "SELECT fileid, object_name FROM fits_content_hashes WHERE content_hash = %s AND storage = %s",
+            (content_hash, storage)
+        )
+        row = cur.fetchone()
+    if row is None:
+        return None
+    fileid, object_name = row
+    try:
+        minio_client.stat_object(bucket_name, object_name)
+    except S3Error as e:
+        if e.code not in ('NoSuchKey', 'NoSuchObject'):
+            raise
+        logger.warning("Object %s of content hash %s is missing, storing again", object_name, content_hash)
+        return None
+    return fileid, object_name
+
+
+def forget_hashes(conn, fileid):
+    """
+    Drop the index entries of `fileid`, in the caller's transaction, when
+    it is stored without a hash (e.g. by a resumable upload)
+    """
+    with conn.cursor() as cur:
+        cur.execute("DELETE FROM fits_content_hashes WHERE fileid = %s", (fileid,))
+
+
+def record_hash(conn, content_hash, storage, fileid, object_name, size):
+    """
+    Add an upload to the index, in the caller's transaction. Earlier hashes
+    of the same fileid are dropped: the row and object now hold these bytes.
+    """
+    forget_hashes(conn, fileid)
+    with conn.cursor() as cur:
+        cur.execute(
+            """
+            INSERT INTO fits_content_hashes (content_hash, storage, fileid, object_name, size)
+            VALUES (%s, %s, %s, %s, %s)
+            ON CONFLICT (content_hash, storage) DO UPDATE SET
+                fileid = EXCLUDED.fileid, object_name = EXCLUDED.object_name,
+                size = EXCLUDED.size, created_at = now()
+            """,
+            (content_hash, storage, fileid, object_name, size)
+        )
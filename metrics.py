@@ -0,0 +1,414 @@
+"""
+In-process Prometheus metrics for the Flask backends.
+
+Counters, gauges and histograms are plain Python objects guarded by a lock
+per label set, so recording a value costs a dict lookup and a lock. The
+text exposition format is rendered only when /metrics is scraped.
+
+Metrics live in the process that records them. When several serve.py
+workers share one port, /metrics on that port answers for whichever worker
+accepted the connection, so serve.py --metrics-port gives every worker a
+port of its own (serve_metrics) for Prometheus to scrape; sum across the
+`instance` label to get totals.
+"""
+
+from flask import g, request, Response
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import bisect
+import os
+import threading
+import time
+import logging
+
+from request_timing import add_timing
+
+logger = logging.getLogger(__name__)
+
+# Seconds; covers header reads (ms) up to large renders and downloads
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _format_labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{n}="{_escape(v)}"' for n, v in pairs) + '}'
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value) if isinstance(value, float) else str(value)
+
+
+class _CounterValue:
+    def __init__(self):
+        self.value = 0
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1):
+        with self._lock:
+            self.value += amount
+
+
+class _GaugeValue(_CounterValue):
+    def dec(self, amount=1):
+        with self._lock:
+            self.value -= amount
+
+    def set(self, value):
+        with self._lock:
+            self.value = value
+
+
+class _HistogramValue:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, value):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            self.counts[index] += 1
+            self.sum += value
+
+    @contextmanager
+    def time(self):
+        """Observe the wall time of the `with` block, also when it raises"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start)
+
+    def snapshot(self):
+        with self._lock:
+            return list(self.counts), self.sum
+
+
+class _Metric:
+    kind = None
+
+    def __init__(self, name, documentation, labelnames=(), registry=None):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._children = {}
+        self._lock = threading.Lock()
+        if not self.labelnames:
+            # Unlabelled metrics are exported as 0 before their first use
+            self.labels()
+        (registry or REGISTRY).register(self)
+
+    def _new_child(self):
+        raise NotImplementedError
+
+    def labels(self, *values):
+        """Return the series for these label values, creating it on first use"""
+        key = tuple(str(v) for v in values)
+        child = self._children.get(key)
+        if child is None:
+            if len(key) != len(self.labelnames):
+                raise ValueError(f"{self.name} expects labels {self.labelnames}, got {values}")
+            with self._lock:
+                child = self._children.setdefault(key, self._new_child())
+        return child
+
+    def series(self):
+        with self._lock:
+            return list(self._children.items())
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} {self.kind}']
+        for key, child in sorted(self.series()):
+            lines.append(f'{self.name}{_format_labels(self.labelnames, key)} {_format_value(child.value)}')
+        return lines
+
+
+class Counter(_Metric):
+    kind = 'counter'
+
+    def _new_child(self):
+        return _CounterValue()
+
+    def inc(self, amount=1):
+        self.labels().inc(amount)
+
+
+class Gauge(_Metric):
+    kind = 'gauge'
+
+    def _new_child(self):
+        return _GaugeValue()
+
+    def inc(self, amount=1):
+        self.labels().inc(amount)
+
+    def dec(self, amount=1):
+        self.labels().dec(amount)
+
+    def set(self, value):
+        self.labels().set(value)
+
+
+class Histogram(_Metric):
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS, registry=None):
+        self.buckets = tuple(sorted(buckets))
+        super().__init__(name, documentation, labelnames, registry)
+
+    def _new_child(self):
+        return _HistogramValue(self.buckets)
+
+    def observe(self, value):
+        self.labels().observe(value)
+
+    def time(self):
+        return self.labels().time()
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} {self.kind}']
+        for key, child in sorted(self.series()):
+            counts, total = child.snapshot()
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += count
+                labels = _format_labels(self.labelnames, key, [('le', _format_value(float(bound)))])
+                lines.append(f'{self.name}_bucket{labels} {cumulative}')
+            labels = _format_labels(self.labelnames, key)
+            lines.append(f'{self.name}_sum{labels} {_format_value(total)}')
+            lines.append(f'{self.name}_count{labels} {cumulative}')
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = []
+        self._lock = threading.Lock()
+
+    def register(self, metric):
+        with self._lock:
+            self._metrics.append(metric)
+
+    def render(self):
+        """All metrics in the Prometheus text exposition format"""
+        with self._lock:
+            metrics = list(self._metrics)
+        lines = []
+        for metric in metrics:
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+
+REGISTRY = Registry()
+
+# HTTP
+HTTP_REQUEST_SECONDS = Histogram(
+    'http_request_duration_seconds',
+    'Time until the handler returned a response (first byte for streamed responses)',
+    ['service', 'endpoint', 'method', 'status'],
+)
+
+# MinIO
+MINIO_REQUESTS = Counter(
+    'minio_requests_total', 'MinIO requests by operation and outcome', ['operation', 'outcome']
+)
+MINIO_REQUEST_SECONDS = Histogram(
+    'minio_request_duration_seconds', 'MinIO request latency by operation', ['operation']
+)
+MINIO_BYTES = Counter(
+    'minio_bytes_total', 'Bytes read from or written to MinIO by operation', ['operation']
+)
+MINIO_NODE_UP = Gauge('minio_node_up', 'Whether a MinIO node is taking requests (1) or marked down (0)', ['node'])
+MINIO_NODE_IN_FLIGHT = Gauge('minio_node_requests_in_flight', 'Requests outstanding on a MinIO node', ['node'])
+MINIO_FAILOVERS = Counter(
+    'minio_failovers_total', 'Requests retried on another MinIO node after a node failed', ['operation']
+)
+
+# Rendering
+RENDER_STAGE_SECONDS = Histogram(
+    'fits_render_stage_seconds',
+    'Time spent per image rendering stage (download, decode, normalize, encode)',
+    ['renderer', 'stage'],
+)
+IMAGE_CACHE_LOOKUPS = Counter(
+    'fits_image_cache_lookups_total', 'FITSImageCache lookups by result (hit, miss, expired)', ['result']
+)
+OBJECT_CACHE_LOOKUPS = Counter(
+    'fits_object_cache_lookups_total', 'ObjectCache lookups by result (hit, shared, miss)', ['result']
+)
+OBJECT_CACHE_BYTES = Gauge('fits_object_cache_bytes', 'Size of the cached FITS objects after the last eviction')
+HDUL_POOL_LOOKUPS = Counter(
+    'fits_hdul_pool_lookups_total', 'HDUListPool lookups by result (hit, miss, downloading)', ['result']
+)
+HDUL_POOL_OPEN_FILES = Gauge('fits_hdul_pool_open_files', 'HDULists kept open by the pool')
+HDUL_POOL_MAPPED_BYTES = Gauge('fits_hdul_pool_mapped_bytes', 'Size of the files the pooled HDULists map')
+
+# Database
+DB_POOL_WAIT_SECONDS = Histogram(
+    'db_pool_wait_seconds', 'Time to check a connection out of the pool',
+    buckets=(0.0005, 0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0),
+)
+DB_POOL_IN_USE = Gauge('db_pool_connections_in_use', 'Connections currently checked out of the pool')
+DB_POOL_ERRORS = Counter('db_pool_errors_total', 'Failed connection checkouts (pool exhausted or DB down)')
+
+# Ingest
+INGEST_FILES = Counter('fits_ingest_files_total', 'Uploaded files by outcome', ['outcome'])
+INGEST_BYTES = Counter('fits_ingest_bytes_total', 'Bytes of FITS data received by /api/upload-fits/')
+INGEST_SECONDS = Histogram('fits_ingest_duration_seconds', 'Time to ingest one uploaded file')
+
+
+@contextmanager
+def timed(series, timing_name):
+    """
+    Observe the `with` block's wall time in a histogram series and add it to
+    the request's Server-Timing header as `timing_name`
+    """
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        series.observe(elapsed)
+        add_timing(timing_name, elapsed)
+
+
+def render_stage(renderer, stage):
+    """Time one rendering stage (download, decode, normalize or encode)"""
+    return timed(RENDER_STAGE_SECONDS.labels(renderer, stage), stage)
+
+
+class InstrumentedMinio:
+    """
+    Wraps a Minio client and records request counts, latency and bytes for
+    the operations the backends use. Everything else is passed through.
+    """
+
+    def __init__(self, client):
+        self._client = client
+
+    def __getattr__(self, name):
+        return getattr(self._client, name)
+
+    def _call(self, operation, func, *args, **kwargs):
+        try:
+            with timed(MINIO_REQUEST_SECONDS.labels(operation), f'minio.{operation}'):
+                result = func(*args, **kwargs)
+        except Exception:
+            MINIO_REQUESTS.labels(operation, 'error').inc()
+            raise
+        MINIO_REQUESTS.labels(operation, 'ok').inc()
+        return result
+
+    def get_object(self, bucket_name, object_name, *args, **kwargs):
+        response = self._call('get_object', self._client.get_object, bucket_name, object_name, *args, **kwargs)
+        # Counted as requested; a client that disconnects early reads less
+        length = getattr(response, 'headers', {}).get('Content-Length')
+        if length:
+            MINIO_BYTES.labels('get_object').inc(int(length))
+        return response
+
+    def fget_object(self, bucket_name, object_name, file_path, *args, **kwargs):
+        result = self._call('fget_object', self._client.fget_object, bucket_name, object_name, file_path,
+                            *args, **kwargs)
+        MINIO_BYTES.labels('fget_object').inc(os.path.getsize(file_path))
+        return result
+
+    def fput_object(self, bucket_name, object_name, file_path, *args, **kwargs):
+        result = self._call('fput_object', self._client.fput_object, bucket_name, object_name, file_path,
+                            *args, **kwargs)
+        MINIO_BYTES.labels('fput_object').inc(os.path.getsize(file_path))
+        return result
+
+    def put_object(self, bucket_name, object_name, data, length, *args, **kwargs):
+        result = self._call('put_object', self._client.put_object, bucket_name, object_name, data, length,
+                            *args, **kwargs)
+        if length > 0:
+            MINIO_BYTES.labels('put_object').inc(length)
+        return result
+
+    # Multipart primitives used by resumable_upload.py
+    def _upload_part(self, bucket_name, object_name, data, *args, **kwargs):
+        result = self._call('upload_part', self._client._upload_part, bucket_name, object_name, data,
+                            *args, **kwargs)
+        MINIO_BYTES.labels('upload_part').inc(len(data))
+        return result
+
+    def _complete_multipart_upload(self, *args, **kwargs):
+        return self._call('complete_multipart_upload', self._client._complete_multipart_upload, *args, **kwargs)
+
+    def stat_object(self, *args, **kwargs):
+        return self._call('stat_object', self._client.stat_object, *args, **kwargs)
+
+    def remove_object(self, *args, **kwargs):
+        return self._call('remove_object', self._client.remove_object, *args, **kwargs)
+
+    def list_objects(self, *args, **kwargs):
+        # Listing is lazy and pages as it is iterated; only calls are counted
+        MINIO_REQUESTS.labels('list_objects', 'ok').inc()
+        return self._client.list_objects(*args, **kwargs)
+
+
+def setup_metrics(app, service):
+    """Time every request of `app` and register GET /metrics"""
+
+    @app.before_request
+    def start_request_timer():
+        g.metrics_start = time.perf_counter()
+
+    @app.after_request
+    def record_request_time(response):
+        start = g.pop('metrics_start', None)
+        if start is not None:
+            # The URL rule, not the path, keeps label cardinality bounded
+            endpoint = request.url_rule.rule if request.url_rule else 'unmatched'
+            HTTP_REQUEST_SECONDS.labels(service, endpoint, request.method, response.status_code).observe(
+                time.perf_counter() - start
+            )
+        return response
+
+    @app.route('/metrics', methods=['GET'])
+    def metrics():
+        """Prometheus scrape endpoint"""
+        return Response(REGISTRY.render(), content_type=CONTENT_TYPE)
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split('?')[0] != '/metrics':
+            self.send_error(404)
+            return
+        body = REGISTRY.render().encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', CONTENT_TYPE)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class _MetricsServer(ThreadingHTTPServer):
+    # A restarted worker binds the port of the worker it replaces
+    allow_reuse_address = True
+    daemon_threads = True
+
+
+def serve_metrics(host, port):
+    """Serve this process's /metrics on a port of its own, from a daemon thread"""
+    server = _MetricsServer((host, port), _MetricsHandler)
+    threading.Thread(target=server.serve_forever, name='metrics', daemon=True).start()
+    return server
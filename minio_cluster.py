@@ -0,0 +1,243 @@
+"""
+Client-side load balancing and failover across the MinIO nodes.
+
+The archive runs a distributed MinIO (docker-compose.yml, minio1..4): every
+node serves the whole namespace, so any request can go to any node.
+MinioCluster holds one Minio client, with its own connection pool, per
+node and has the same methods as Minio. Each call goes to the healthy node
+with the fewest requests in flight (a get_object stays in flight until its
+response is closed or released).
+
+A node is marked down when a connection to it fails and taken back once
+its /minio/health/live check passes; a background thread checks every node
+every MINIO_HEALTH_INTERVAL seconds. Reads (stat, get, list, presign, ...)
+that fail on a node are retried on the next one; writes are not retried,
+since they may have reached the node. Connections time out after
+MINIO_CONNECT_TIMEOUT seconds, so a dead node costs one short timeout, not
+a stalled request.
+
+    minio_client = MinioCluster(endpoints_from_env(MINIO_NODES), access_key=..., secret_key=...)
+"""
+
+from functools import partial
+import os
+import threading
+import time
+import logging
+
+import urllib3
+from urllib3.util import Retry, Timeout
+from minio import Minio
+from minio.error import ServerError
+
+from metrics import MINIO_NODE_UP, MINIO_NODE_IN_FLIGHT, MINIO_FAILOVERS
+
+logger = logging.getLogger(__name__)
+
+HEALTH_INTERVAL = float(os.environ.get('MINIO_HEALTH_INTERVAL', '5'))
+CONNECT_TIMEOUT = float(os.environ.get('MINIO_CONNECT_TIMEOUT', '2'))
+READ_TIMEOUT = float(os.environ.get('MINIO_READ_TIMEOUT', '300'))
+POOL_SIZE = int(os.environ.get('MINIO_POOL_SIZE', '20'))
+
+# The API ports of minio1..4 in docker-compose.yml
+MINIO_NODES = 'localhost:9000,localhost:9002,localhost:9004,localhost:9006'
+
+# Safe to send again to another node
+IDEMPOTENT = frozenset({
+    'bucket_exists', 'stat_object', 'get_object', 'fget_object', 'list_objects', '_list_parts',
+    'presigned_get_object', 'presigned_put_object', 'get_presigned_url', 'remove_object',
+})
+
+# The node did not answer (refused, reset, timed out); urllib3 wraps these
+NODE_ERRORS = (urllib3.exceptions.HTTPError, ConnectionError, TimeoutError)
+
+
+def endpoints_from_env(default):
+    """MINIO_ENDPOINT as a list; it may name several nodes separated by commas"""
+    value = os.environ.get('MINIO_ENDPOINT', default)
+    return [endpoint.strip() for endpoint in value.split(',') if endpoint.strip()]
+
+
+class MinioNode:
+    """One MinIO endpoint with its client and load"""
+
+    def __init__(self, endpoint, client):
+        self.endpoint = endpoint
+        self.client = client
+        self.in_flight = 0
+        self.up = True
+        MINIO_NODE_UP.labels(endpoint).set(1)
+
+
+class _NodeResponse:
+    """get_object response that stays counted on its node until it is closed or released"""
+
+    def __init__(self, response, cluster, node):
+        self._response = response
+        self._cluster = cluster
+        self._node = node
+
+    def __getattr__(self, name):
+        return getattr(self._response, name)
+
+    def _done(self):
+        # Callers close and then release; count the response once
+        if self._node is not None:
+            self._cluster._release(self._node)
+            self._node = None
+
+    def close(self):
+        self._response.close()
+        self._done()
+
+    def release_conn(self):
+        self._response.release_conn()
+        self._done()
+
+
+class MinioCluster:
+    """Drop-in replacement for a Minio client that spreads requests over several nodes"""
+
+    def __init__(self, endpoints, access_key=None, secret_key=None, secure=False, region=None,
+                 health_interval=HEALTH_INTERVAL):
+        if not endpoints:
+            raise ValueError("MinioCluster needs at least one endpoint")
+        self.nodes = [
+            MinioNode(endpoint, Minio(endpoint, access_key=access_key, secret_key=secret_key, secure=secure,
+                                      region=region, http_client=self._pool_manager()))
+            for endpoint in endpoints
+        ]
+        self.scheme = 'https' if secure else 'http'
+        self.health_interval = health_interval
+        self._lock = threading.Lock()
+        self._next = 0
+        self._health_pid = None
+        self._health_http = urllib3.PoolManager(timeout=Timeout(connect=CONNECT_TIMEOUT, read=CONNECT_TIMEOUT),
+                                                retries=False)
+
+    @staticmethod
+    def _pool_manager():
+        # Failover replaces urllib3's connect retries; 5xx answers are still
+        # retried on the same node, as the Minio default client does
+        return urllib3.PoolManager(
+            timeout=Timeout(connect=CONNECT_TIMEOUT, read=READ_TIMEOUT),
+            maxsize=POOL_SIZE,
+            retries=Retry(total=3, connect=0, backoff_factor=0.2, status_forcelist=[500, 502, 503, 504]),
+        )
+
+    def __getattr__(self, name):
+        if not callable(getattr(self.nodes[0].client, name)):
+            return getattr(self.nodes[0].client, name)
+        return partial(self._call, name)
+
+    # -- node selection --------------------------------------------------
+
+    def _acquire(self, tried):
+        """The least loaded node not tried yet, preferring nodes that are up"""
+        with self._lock:
+            candidates = [node for node in self.nodes if node not in tried]
+            if not candidates:
+                return None
+            pool = [node for node in candidates if node.up] or candidates
+            # Rotate the start so that ties do not all go to the first node
+            start = self._next % len(pool)
+            self._next += 1
+            node = min(pool[start:] + pool[:start], key=lambda n: n.in_flight)
+            node.in_flight += 1
+        MINIO_NODE_IN_FLIGHT.labels(node.endpoint).inc()
+        return node
+
+    def _release(self, node):
+        with self._lock:
+            node.in_flight -= 1
+        MINIO_NODE_IN_FLIGHT.labels(node.endpoint).dec()
+
+    def _mark(self, node, up):
+        if node.up == up:
+            return
+        node.up = up
+        MINIO_NODE_UP.labels(node.endpoint).set(1 if up else 0)
+        if up:
+            logger.info("MinIO node %s is back", node.endpoint)
+        else:
+            logger.warning("MinIO node %s marked down", node.endpoint)
+
+    # -- calls -----------------------------------------------------------
+
+    def _call(self, name, *args, **kwargs):
+        self._ensure_health_checks()
+        if name == 'list_objects':
+            return self._list_objects(*args, **kwargs)
+        tried = []
+        while True:
+            node = self._acquire(tried)
+            tried.append(node)
+            try:
+                result = getattr(node.client, name)(*args, **kwargs)
+            except (ServerError, *NODE_ERRORS) as e:
+                self._release(node)
+                if not isinstance(e, ServerError):
+                    self._mark(node, False)
+                if name not in IDEMPOTENT or len(tried) == len(self.nodes):
+                    raise
+                logger.warning("MinIO %s failed on %s, retrying on another node: %s", name, node.endpoint, e)
+                MINIO_FAILOVERS.labels(name).inc()
+                continue
+            except Exception:
+                # An answer from the node (NoSuchKey, AccessDenied, ...)
+                self._release(node)
+                raise
+            if name == 'get_object':
+                return _NodeResponse(result, self, node)
+            self._release(node)
+            return result
+
+    def _list_objects(self, *args, **kwargs):
+        """Listing moves to another node only if it failed before the first entry"""
+        tried = []
+        while True:
+            node = self._acquire(tried)
+            tried.append(node)
+            self._release(node)
+            listed = False
+            try:
+                for item in node.client.list_objects(*args, **kwargs):
+                    listed = True
+                    yield item
+                return
+            except (ServerError, *NODE_ERRORS) as e:
+                if not isinstance(e, ServerError):
+                    self._mark(node, False)
+                if listed or len(tried) == len(self.nodes):
+                    raise
+                logger.warning("MinIO listing failed on %s, retrying on another node: %s", node.endpoint, e)
+                MINIO_FAILOVERS.labels('list_objects').inc()
+
+    # -- health checks ---------------------------------------------------
+
+    def _ensure_health_checks(self):
+        # Started on first use in each process: threads do not survive the
+        # fork in serve.py
+        if self._health_pid == os.getpid() or self.health_interval <= 0:
+            return
+        with self._lock:
+            if self._health_pid == os.getpid():
+                return
+            self._health_pid = os.getpid()
+        threading.Thread(target=self._health_loop, name='minio-health', daemon=True).start()
+
+    def check_node(self, node):
+        """Probe /minio/health/live and mark the node up or down"""
+        try:
+            response = self._health_http.request('GET', f'{self.scheme}://{node.endpoint}/minio/health/live')
+            up = response.status == 200
+        except urllib3.exceptions.HTTPError:
+            up = False
+        self._mark(node, up)
+        return up
+
+    def _health_loop(self):
+        while True:
+            for node in self.nodes:
+                self.check_node(node)
+            time.sleep(self.health_interval)
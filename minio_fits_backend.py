@@ -1,19 +1,43 @@
 from flask import Flask, request, jsonify
 from flask_cors import CORS
-from minio import Minio
 from astropy.io import fits
 import tempfile
+import io
 import os
 import json
+import threading
 import numpy as np
-import matplotlib.pyplot as plt
-from astropy.visualization import (ZScaleInterval, ImageNormalize, AsinhStretch)
 import psycopg2
 from psycopg2.extras import RealDictCursor
 from psycopg2.pool import SimpleConnectionPool
 
 from datetime import datetime, date, time
-
+from time import perf_counter
+
+from fits_export import setup_export_route
+from bulk_download import setup_bulk_download_route
+from presign_cache import PresignedURLCache, setup_presign_route
+from raw_download import setup_raw_download_route
+from request_timing import setup_request_timing
+from metrics import (setup_metrics, InstrumentedMinio, render_stage, timed, DB_POOL_WAIT_SECONDS,
+                     DB_POOL_IN_USE, DB_POOL_ERRORS, INGEST_FILES, INGEST_BYTES, INGEST_SECONDS)
+from fits_header_reader import read_primary_header_list, header_to_list
+from conditional_get import ValidatorCache, stat_validators, make_etag, not_modified, set_validators
+from fits_compression import (COMPRESSION_TYPES, COMPRESSED_SUFFIX, compress_fits_file,
+                              primary_header, primary_image_hdu, first_plane, cutout)
+from structured_logging import setup_logging
+from header_mapping import header_to_row, verify_schema, ensure_partitions
+from ingest_dedup import save_hashed, storage_variant, find_stored, record_hash
+from resumable_upload import setup_resumable_upload_route
+from object_cache import ObjectCache
+from hdul_pool import HDUListPool
+from fits_stats import setup_stats_route
+from spectrum_preview import spectrum_hdus, read_spectra, render_spectra, to_png
+from minio_cluster import MinioCluster, MINIO_NODES, endpoints_from_env
+import logging
+
+setup_logging('minio_fits_backend')
+logger = logging.getLogger(__name__)
 
 app = Flask(__name__)
 
@@ -37,177 +61,130 @@ DB_CONFIG = {
     "port": os.environ.get("DB_PORT", "5432")
 }
 
-db_pool = SimpleConnectionPool(1, 10, **DB_CONFIG)
+# Fail here rather than on some later upload if the ingest mapping and
+# database/schema.sql disagree (see header_mapping.py)
+verify_schema()
+
+db_pool = None
+_db_pool_lock = threading.Lock()
+
+def get_pool():
+    """Create the connection pool on first use, so importing this module needs no database"""
+    global db_pool
+    if db_pool is None:
+        with _db_pool_lock:
+            if db_pool is None:
+                db_pool = SimpleConnectionPool(1, 10, **DB_CONFIG)
+    return db_pool
 
 def get_conn():
-    return db_pool.getconn()
+    try:
+        with timed(DB_POOL_WAIT_SECONDS.labels(), 'db.pool'):
+            conn = get_pool().getconn()
+    except Exception:
+        DB_POOL_ERRORS.inc()
+        raise
+    DB_POOL_IN_USE.inc()
+    return conn
 
 
 def release_conn(conn):
+    DB_POOL_IN_USE.dec()
     db_pool.putconn(conn)
 
+
+# ETag/Last-Modified of source objects and metadata rows, see conditional_get.py
+validators = ValidatorCache()
+
+def object_validators(file_name):
+    """(etag, last_modified) of a MinIO object, cached briefly"""
+    return validators.get(
+        ('object', file_name),
+        lambda: stat_validators(minio_client, MINIO_BUCKET, file_name)
+    )
+
+
+def row_validators(file_id):
+    """(etag, updated_at) of a fits_headers row, or None if it doesn't exist"""
+    def load():
+        conn = get_conn()
+        try:
+            with conn.cursor() as cur:
+                cur.execute("SELECT updated_at FROM fits_headers WHERE fileid = %s", (file_id,))
+                row = cur.fetchone()
+            conn.rollback()
+        finally:
+            release_conn(conn)
+        if row is None:
+            return None
+        return f"{file_id}:{row[0].isoformat()}", row[0]
+    return validators.get(('row', file_id), load)
+
     
-# MinIO configuration from environment variables with fallbacks
-MINIO_ENDPOINT = os.environ.get("MINIO_ENDPOINT", "localhost:9000")
+# MinIO configuration from environment variables with fallbacks;
+# MINIO_ENDPOINT may list several nodes of the cluster, comma separated
+MINIO_ENDPOINTS = endpoints_from_env(MINIO_NODES)
 MINIO_ACCESS_KEY = os.environ.get("MINIO_ACCESS_KEY", "Laav10user")
 MINIO_SECRET_KEY = os.environ.get("MINIO_SECRET_KEY", "Laav10pass")
 MINIO_BUCKET = os.environ.get("MINIO_BUCKET", "dataarchive")
 
-print(f"MinIO config: {MINIO_ENDPOINT}, bucket: {MINIO_BUCKET}")
+print(f"MinIO config: {','.join(MINIO_ENDPOINTS)}, bucket: {MINIO_BUCKET}")
 
 try:
-    # Initialize MinIO client
-    minio_client = Minio(
-        MINIO_ENDPOINT,
+    # Initialize MinIO client, balancing requests over the nodes
+    minio_client = InstrumentedMinio(MinioCluster(
+        MINIO_ENDPOINTS,
         access_key=MINIO_ACCESS_KEY,
         secret_key=MINIO_SECRET_KEY,
         region="minio-region",
         secure=False  # Set to True if using HTTPS
-    )
+    ))
     print("MinIO client initialized successfully")
 except Exception as e:
-    print(f"Error initializing MinIO client: {e}")
+    logger.error("Error initializing MinIO client: %s", e)
     minio_client = None
 
-def get_str(h, key):
-    val = h.get(key)
-    return str(val) if val and val != "" else None
-
-def get_int(h, key):
-    val = h.get(key)
-    if val is None or val == "":
-        return None
-    try:
-        return int(val)
-    except:
-        return None
-
-def get_float(h, key):
-    val = h.get(key)
-    # Debug print
-    if key == "MOONANGL":
-        print(f"DEBUG: {key} raw value: {repr(val)}")
-    
-    if val is None or val == "":
-        return None
-    try:
-        return float(val)
-    except:
-        return None
-
-def get_bool(h, key):
-    val = h.get(key)
-    return bool(val)
-
-
-def header_to_row(h):
-    # Ensure FILEID exists, otherwise generate or fail? 
-    # Schema says NOT NULL. 
-    fileid = get_int(h, "FILEID")
-    if fileid is None:
-        raise ValueError("FILEID missing or invalid in FITS header")
-
-    obs_date_iso = get_str(h, "DATE-OBS")
-    date_obs = None
-    obs_date = None
-    obs_time = None
-    if obs_date_iso:
-        try:
-             date_obs = datetime.fromisoformat(obs_date_iso)
-             if "T" in obs_date_iso:
-                 obs_date, obs_time = obs_date_iso.split("T")
-             else:
-                 obs_date = obs_date_iso
-        except:
-             pass
-
-    return {
-        "fileid": fileid,
-        "simple": get_bool(h, "SIMPLE"),
-        "bitpix": get_int(h, "BITPIX"),
-        "naxis": get_int(h, "NAXIS"),
-        "naaxis1": get_int(h, "NAXIS1"),
-        "naaxis2": get_int(h, "NAXIS2"),
-
-        "data_type": get_str(h, "DATA_TYP"),
-        "qual_fac": get_int(h, "QUAL_FAC"),
-        "obs_cmts": get_str(h, "OBS_CMTS"),
-
-        "pi_name": get_str(h, "PI_NAME"),
-        "observer": get_str(h, "OBSERVER"),
-        "tel_oprt": get_str(h, "TEL_OPRT"),
-
-        "telescope": get_str(h, "TELESCOP"),
-        "origin": get_str(h, "ORIGIN"),
-        "observat": get_str(h, "OBSERVAT"),
-
-        "obs_lat": get_float(h, "OBS_LAT"),
-        "obs_long": get_float(h, "OBS_LONG"),
-        "obs_elev": get_float(h, "OBS_ELEV"),
-
-        "instrume": get_str(h, "INSTRUME"),
-        "filter1": get_str(h, "FILTER1"),
-        "filter2": get_str(h, "FILTER2"),
-
-        "cat_comp": get_bool(h, "CAT-COMP"),
-        "solarobj": get_bool(h, "SOLAROBJ"),
-        "radecsys": get_str(h, "RADECSYS"),
-        "epoch": get_str(h, "EPOCH"),
-
-        "trg_name": get_str(h, "TRG_NAME") or get_str(h, "TRG NAME"),
-        "trg_alph": get_float(h, "TRG_ALPH") or get_float(h, "TRG ALPH"),
-        "trg_delt": get_float(h, "TRG_DELT") or get_float(h, "TRG DELT"),
-        "trg_type": get_str(h, "TRG_TYPE") or get_str(h, "TRG TYPE"),
-        "trg_epoc": get_int(h, "TRG_EPOC") or get_int(h, "TRG EPOC"),
-
-        "bunit": get_str(h, "BUNIT"),
-        "datamax": get_int(h, "DATAMAX"),
-        "datamin": get_int(h, "DATAMIN"),
-
-        "date_obs": date_obs,
-        "obs_date": obs_date,
-        "obs_time": obs_time,
-        "obs_tsys": get_str(h, "OBS_TSYS"),
-        "obs_mjd": get_float(h, "OBS MJD"),
-
-        "obs_airm": get_float(h, "AIRMASS") or get_float(h, "OBS AIRM"),
-        "moonangl": get_float(h, "MOONANGL"),
-
-        "obs_type": get_str(h, "OBS TYPE"),
-        "ccd_expt": get_float(h, "CCD EXPT"),
-        "ccd_gain": get_float(h, "CCD GAIN"),
-        "ccd_rdns": get_float(h, "CCD RDNS"),
-
-        "ins_lamp": get_str(h, "INS_LAMP"),
-
-        "bscale": get_float(h, "BSCALE"),
-        "bzero": get_float(h, "BZERO"),
-        "o_bzero": get_int(h, "O_BZERO"),
-    }
-
+# Objects read by the image, cutout and compressed-header paths, on local
+# disk, and the HDULists of the hot ones kept open
+object_cache = ObjectCache(minio_client, MINIO_BUCKET)
+hdul_pool = HDUListPool(object_cache)
 
 
 def insert_header(row, conn):
+    """Upsert a fits_headers row; must be the first statement of the caller's transaction"""
     cols = list(row.keys())
     vals = [row[c] for c in cols]
 
-    # Generate SET clause for UPSERT
-    set_clause = ", ".join([f"{c} = EXCLUDED.{c}" for c in cols if c != "fileid"])
+    # fits_headers is partitioned by obs_date, so the unique key is
+    # (fileid, obs_date) - see database/schema.sql
+    set_clause = ", ".join([f"{c} = EXCLUDED.{c}" for c in cols if c not in ("fileid", "obs_date")])
+    # updated_at drives Last-Modified/ETag of /api/fits-metadata/
+    set_clause += ", updated_at = now()"
 
     query = f"""
     INSERT INTO fits_headers ({",".join(cols)})
     VALUES ({",".join(["%s"] * len(cols))})
-    ON CONFLICT (fileid) DO UPDATE SET
+    ON CONFLICT (fileid, obs_date) DO UPDATE SET
     {set_clause}
     """
 
+    # Before the upsert's transaction starts: creating a partition locks
+    # fits_headers until commit, which would last for the rest of the upload
+    ensure_partitions(conn, [row.get("obs_date")])
+
     with conn.cursor() as cur:
+        # A re-upload whose DATE-OBS changed would otherwise leave the old
+        # row behind in another partition
+        cur.execute(
+            "DELETE FROM fits_headers WHERE fileid = %s AND obs_date IS DISTINCT FROM %s",
+            (row["fileid"], row.get("obs_date"))
+        )
         cur.execute(query, vals)
 
 
 @app.route('/')
 def hello():
-    print("Root endpoint called")
+    logger.debug("Root endpoint called")
     return "Hello, world!"
 
 @app.route('/api/fits-header/', methods=['GET'])
@@ -215,94 +192,140 @@ def get_fits_header():
     """
     Get FITS header from a file stored in MinIO
     """
-    print("FITS header endpoint called")
+    logger.debug("FITS header endpoint called")
     file_name = request.args.get('file')
     
     if not file_name:
         return jsonify({'error': 'No file specified'}), 400
     
     try:
-        # Download file from MinIO to temporary location
-        with tempfile.NamedTemporaryFile(delete=False, suffix='.fits') as temp_file:
-            minio_client.fget_object(MINIO_BUCKET, file_name, temp_file.name)
-            temp_file_path = temp_file.name
-        
-        # Read FITS header
-        with fits.open(temp_file_path) as hdul:
-            header = hdul[0].header
-            header_list = [
-                {
-                    'Keyword': card.keyword, 
-                    'Value': str(card.value), 
-                    'Comment': card.comment
-                }
-                for card in header.cards
-            ]
+        source_etag, last_modified = object_validators(file_name)
+        etag = make_etag(source_etag, 'header')
+        cached = not_modified(app, etag, last_modified)
+        if cached:
+            return cached
+
+        # Ranged read up to the END card (inflating .fits.gz incrementally)
+        header_list = read_primary_header_list(minio_client, MINIO_BUCKET, file_name)
+        if header_list is not None:
+            return set_validators(jsonify(header_list), etag, last_modified)
+
+        # Tile-compressed files keep the image header in an extension; only
+        # the headers have to arrive
+        with hdul_pool.fetch(file_name, source_etag) as spool:
+            header_list = header_to_list(primary_header(spool.open()))
         
-        # Clean up temporary file
-        os.unlink(temp_file_path)
-        
-        return jsonify(header_list)
+        return set_validators(jsonify(header_list), etag, last_modified)
         
     except Exception as e:
-        print(f"Error processing FITS file: {e}")
+        logger.error("Error processing FITS file: %s", e)
         return jsonify({'error': str(e)}), 500
 
+# Default compression for uploads without a "compress" form field
+INGEST_COMPRESSION = os.environ.get("FITS_INGEST_COMPRESSION", "").lower()
+
 @app.route("/api/upload-fits/", methods=["POST"])
 def upload_fits():
     """
     Upload FITS → extract header → insert Postgres → upload MinIO
+
+    Bytes already stored with the same compression (by content hash, see
+    ingest_dedup.py) are answered with status "unchanged" and not stored
+    again.
+
+    Optional form fields:
+        compress: rice, hcompress, gzip or plio to store the images
+                  tile-compressed as <fileid>.fits.fz; plio is meant for
+                  masks and falls back to rice for images with negative
+                  values or values of 2**24 and more
+        quantize_level: quantize float images when compressing (lossy)
     """
 
     if "file" not in request.files:
         return jsonify({"error": "No file uploaded"}), 400
 
+    compress = request.form.get("compress", INGEST_COMPRESSION).lower()
+    if compress in ("", "none"):
+        compress = None
+    elif compress not in COMPRESSION_TYPES:
+        return jsonify({"error": f"Unknown compression: {compress}"}), 400
+    quantize_level = request.form.get("quantize_level", type=float)
+
     file = request.files["file"]
     original_filename = file.filename or ""
     is_gzip = original_filename.lower().endswith(".gz")
     temp_suffix = ".fits.gz" if is_gzip else ".fits"
 
-    tmp = tempfile.NamedTemporaryFile(delete=False, suffix=temp_suffix)
-    tmp_path = tmp.name
-    file.save(tmp_path)
+    started = perf_counter()
+    with tempfile.NamedTemporaryFile(delete=False, suffix=temp_suffix) as tmp:
+        tmp_path = tmp.name
+        content_hash, size = save_hashed(file.stream, tmp)
+    INGEST_BYTES.inc(size)
+    upload_path = tmp_path
+    compression_stats = None
+    storage = storage_variant(compress, quantize_level, is_gzip)
 
     conn = get_conn()
 
     try:
+        stored = find_stored(conn, minio_client, MINIO_BUCKET, content_hash, storage)
+        conn.rollback()
+        if stored is not None:
+            INGEST_FILES.labels("unchanged").inc()
+            return jsonify({"status": "unchanged", "fileid": stored[0], "object": stored[1]})
+
         with fits.open(tmp_path) as hdul:
             header = hdul[0].header
             row = header_to_row(header)
 
         object_name = f"{row['fileid']}.fits"
-        if is_gzip:
+        if compress:
+            # Tile compression replaces gzip: both are decoded here
+            upload_path = tmp_path + ".fz"
+            compression_stats = compress_fits_file(
+                tmp_path, upload_path, COMPRESSION_TYPES[compress], quantize_level
+            )
+            object_name = f"{row['fileid']}{COMPRESSED_SUFFIX}"
+        elif is_gzip:
             object_name += ".gz"
 
         # TRANSACTION (atomic)
         conn.autocommit = False
 
         insert_header(row, conn)
+        record_hash(conn, content_hash, storage, row["fileid"], object_name, size)
 
         minio_client.fput_object(
             MINIO_BUCKET,
             object_name,
-            tmp_path
+            upload_path
         )
 
         conn.commit()
+        validators.invalidate(('object', object_name))
+        validators.invalidate(('row', row['fileid']))
 
-        return jsonify({
+        response = {
             "status": "stored",
             "fileid": row["fileid"],
             "object": object_name
-        })
+        }
+        if compression_stats:
+            response["compression"] = compression_stats
+        INGEST_FILES.labels("stored").inc()
+        return jsonify(response)
 
     except Exception as e:
         conn.rollback()
+        INGEST_FILES.labels("error").inc()
         return jsonify({"error": str(e)}), 500
 
     finally:
+        INGEST_SECONDS.observe(perf_counter() - started)
         release_conn(conn)
         os.unlink(tmp_path)
+        if upload_path != tmp_path and os.path.exists(upload_path):
+            os.unlink(upload_path)
 
 
 @app.route('/api/headers/', methods=['GET'])
@@ -310,7 +333,7 @@ def get_headers():
     """
     Get request headers (for testing)
     """
-    print("Headers endpoint called")
+    logger.debug("Headers endpoint called")
     return jsonify({'message': 'MinIO FITS Header API is working!'})
 
 @app.route('/api/files/', methods=['GET'])
@@ -318,12 +341,12 @@ def list_files():
     """
     List all FITS files in the MinIO bucket
     """
-    print("Files endpoint called")
+    logger.debug("Files endpoint called")
     try:
         objects = minio_client.list_objects(MINIO_BUCKET, recursive=True)
         files = []
         for obj in objects:
-            if obj.object_name.lower().endswith(('.fits', '.fit')):
+            if obj.object_name.lower().endswith(('.fits', '.fit', '.fits.gz', COMPRESSED_SUFFIX)):
                 files.append({
                     'name': obj.object_name,
                     'size': obj.size,
@@ -338,7 +361,7 @@ def get_fits_image():
     """
     Create a URL for the FITS image
     """
-    print("FITS image conversion endpoint called")
+    logger.debug("FITS image conversion endpoint called")
     file_name = request.args.get('file')
     
     if not file_name:
@@ -365,70 +388,189 @@ def get_fits_image():
         })
         
     except Exception as e:
-        print(f"Error processing FITS file: {e}")
+        logger.error("Error processing FITS file: %s", e)
         return jsonify({'error': str(e)}), 500
 
+def _image_figure(data):
+    # Imported on first render: matplotlib and astropy.visualization account
+    # for most of this module's import time
+    from astropy.visualization import ZScaleInterval, ImageNormalize, AsinhStretch
+    from matplotlib.figure import Figure
+
+    # A Figure of its own instead of pyplot's global state, which is not
+    # safe to share between request threads
+    norm = ImageNormalize(interval=ZScaleInterval(), stretch=AsinhStretch())
+    figure = Figure(figsize=(10, 10))
+    axes = figure.add_subplot()
+    axes.imshow(data, cmap='gray', origin='lower', norm=norm)
+    figure.colorbar(axes.images[0], ax=axes)
+    axes.axis('off')  # Hide axes for cleaner image
+    return figure
+
+def _figure_png(figure):
+    buf = io.BytesIO()
+    figure.savefig(buf, format='png', bbox_inches='tight', pad_inches=0)
+    return buf.getvalue()
+
+def render_image_png(data):
+    """Render a 2D image with ZScale/asinh scaling and a colorbar, returning PNG bytes"""
+    with render_stage('image', 'normalize'):
+        figure = _image_figure(data)
+
+    # Matplotlib rasterizes while saving, so this includes drawing
+    with render_stage('image', 'encode'):
+        return _figure_png(figure)
+
+def render_spectrum_png(hdus):
+    """Draw spectra with min/max decimation (spectrum_preview.py), returning PNG bytes"""
+    with render_stage('image', 'decode'):
+        spectra = read_spectra(hdus)
+    with render_stage('image', 'normalize'):
+        image_data = render_spectra(spectra)
+    with render_stage('image', 'encode'):
+        return to_png(image_data)
+
 @app.route('/api/fits-image-data/', methods=['GET'])
 def get_fits_image_data():
     """
     Convert a FITS file from MinIO to an image and return it directly
     """
-    print("FITS image data endpoint called")
+    logger.debug("FITS image data endpoint called")
     file_name = request.args.get('file')
     
     if not file_name:
         return jsonify({'error': 'No file specified'}), 400
     
     try:
-        # Retrieve FITS file from MinIO
-        ext = ".fits.gz" if file_name.endswith(".fits.gz") else ".fits"
-        with tempfile.NamedTemporaryFile(delete=False, suffix=ext) as temp_file:
-            minio_client.fget_object(MINIO_BUCKET, file_name, temp_file.name)
-            temp_file_path = temp_file.name
-        
-        # Convert FITS to image using Astropy and Matplotlib
-        with fits.open(temp_file_path) as hdul:
-            # Use primary HDU
-            data = hdul[0].data
-            
-            if data is None:
-                return jsonify({'error': 'No image data found'}), 400
-            
-            # Handle multi-dimensional data by taking the first frame
-            if data.ndim > 2:
-                data = data[0]
-
-            # Image normalization
-            norm = ImageNormalize(interval=ZScaleInterval(), stretch=AsinhStretch())
-            
-            # Plot image
-            plt.figure(figsize=(10, 10))
-            plt.imshow(data, cmap='gray', origin='lower', norm=norm)
-            plt.colorbar()
-            plt.axis('off')  # Hide axes for cleaner image
-
-            # Save image to a temporary buffer
-            buf = tempfile.NamedTemporaryFile(delete=False, suffix='.png')
-            plt.savefig(buf.name, format='png', bbox_inches='tight', pad_inches=0)
-            plt.close()
-            
-            with open(buf.name, 'rb') as img_file:
-                img_data = img_file.read()
+        source_etag, last_modified = object_validators(file_name)
+        etag = make_etag(source_etag, 'image')
+        cached = not_modified(app, etag, last_modified)
+        if cached:
+            return cached
+
+        # Retrieve FITS file from the object cache or MinIO, waiting only for
+        # the headers and the first frame
+        with hdul_pool.fetch(file_name, source_etag) as spool:
+            with render_stage('image', 'download'):
+                hdul = spool.open()
+                # Spectra (1D, echelle orders, tables) are drawn in full
+                hdus = spectrum_hdus(hdul)
+                for spectrum_hdu in hdus:
+                    spool.wait_for(spectrum_hdu)
+
+                if not hdus:
+                    # Use the primary image (the first extension of tile-compressed files)
+                    hdu = primary_image_hdu(hdul)
+                    
+                    if hdu.header.get('NAXIS', 0) == 0:
+                        return jsonify({'error': 'No image data found'}), 400
+                    spool.wait_for(hdu, planes=1)
+
+            if hdus:
+                img_data = render_spectrum_png(hdus)
+            else:
+                # Convert FITS to image using Astropy and Matplotlib
+                with render_stage('image', 'decode'):
+                    # Handle multi-dimensional data by taking the first frame; for
+                    # compressed cubes only the tiles of that frame are decompressed
+                    data = first_plane(hdu)
+
+                img_data = render_image_png(data)
         
         # Serve generated image
         response = app.response_class(img_data, content_type='image/png')
-        response.headers['Cache-Control'] = 'public, max-age=3600'  # Cache for 1 hour
-        
-        # Clean up temporary files
-        os.unlink(temp_file_path)
-        os.unlink(buf.name)
+        set_validators(response, etag, last_modified, 'public, max-age=3600')  # Cache for 1 hour
         
         return response
         
     except Exception as e:
-        print(f"Error processing FITS file: {e}")
+        logger.error("Error processing FITS file: %s", e)
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/fits-cutout/', methods=['GET'])
+def get_fits_cutout():
+    """
+    Return a 2D cutout of the primary image as a FITS file.
+
+    Query parameters: file, x, y, width, height (pixels, 0-based) and
+    plane (for cubes). For tile-compressed files only the tiles that
+    overlap the cutout are decompressed.
+    """
+    file_name = request.args.get('file')
+    if not file_name:
+        return jsonify({'error': 'No file specified'}), 400
+
+    try:
+        x = request.args.get('x', 0, type=int)
+        y = request.args.get('y', 0, type=int)
+        width = request.args.get('width', 256, type=int)
+        height = request.args.get('height', 256, type=int)
+        plane = request.args.get('plane', 0, type=int)
+        if min(x, y, plane) < 0 or width <= 0 or height <= 0:
+            return jsonify({'error': 'Invalid cutout geometry'}), 400
+
+        source_etag, last_modified = object_validators(file_name)
+        etag = make_etag(source_etag, 'cutout', x, y, width, height, plane)
+        cached = not_modified(app, etag, last_modified)
+        if cached:
+            return cached
+
+        # Only waits for the planes up to the requested one
+        with hdul_pool.fetch(file_name, source_etag) as spool:
+            hdu = primary_image_hdu(spool.open())
+            spool.wait_for(hdu, planes=plane + 1)
+            data = np.array(cutout(hdu, x, y, width, height, plane))
+            header = hdu.header.copy()
+
+        # Keep the WCS pointing at the same sky position
+        for axis, offset in (('1', x), ('2', y)):
+            if f'CRPIX{axis}' in header:
+                header[f'CRPIX{axis}'] -= offset
+        for key in ('XTENSION', 'PCOUNT', 'GCOUNT', 'NAXIS3', 'NAXIS4', 'BSCALE', 'BZERO'):
+            header.remove(key, ignore_missing=True)
+
+        buf = io.BytesIO()
+        fits.PrimaryHDU(data=data, header=header).writeto(buf)
+        response = app.response_class(buf.getvalue(), content_type='application/fits')
+        response.headers['Content-Disposition'] = f'attachment; filename="cutout_{os.path.basename(file_name)}"'
+        return set_validators(response, etag, last_modified, 'public, max-age=3600')
+
+    except Exception as e:
+        logger.error("Error creating cutout: %s", e)
         return jsonify({'error': str(e)}), 500
 
+
+def fileid_from_name(file_name):
+    """
+    Extract the fileid from an object name (e.g. "12345.fits" -> 12345).
+    Returns None if the name does not start with an integer id.
+    """
+    file_id_str = str(file_name).split('.')[0]
+    if not file_id_str.isdigit():
+        return None
+    return int(file_id_str)
+
+
+def serialize_row(row):
+    """Convert datetime values in a metadata row to strings for JSON serialization"""
+    for key, val in row.items():
+        if isinstance(val, (datetime, date, time)):
+            row[key] = val.isoformat()
+    return row
+
+
+_metadata_columns = None
+
+def get_metadata_columns(conn):
+    """Column names of fits_headers, read once from the table itself"""
+    global _metadata_columns
+    if _metadata_columns is None:
+        with conn.cursor() as cur:
+            cur.execute("SELECT * FROM fits_headers LIMIT 0")
+            _metadata_columns = [d[0] for d in cur.description]
+    return _metadata_columns
+
+
 @app.route('/api/fits-metadata/', methods=['GET'])
 def get_fits_metadata():
     """
@@ -439,13 +581,18 @@ def get_fits_metadata():
         return jsonify({'error': 'No file specified'}), 400
 
     try:
-        # Extract fileid from filename (e.g. "12345.fits" -> 12345)
         # Assumes filename starts with the ID
-        file_id_str = file_name.split('.')[0]
-        if not file_id_str.isdigit():
+        file_id = fileid_from_name(file_name)
+        if file_id is None:
              return jsonify({'error': 'Invalid filename format, expected <int>.fits'}), 400
-        
-        file_id = int(file_id_str)
+
+        row_version = row_validators(file_id)
+        if row_version is None:
+            return jsonify({'error': 'Metadata not found'}), 404
+        etag = make_etag(row_version[0], 'metadata')
+        cached = not_modified(app, etag, row_version[1])
+        if cached:
+            return cached
 
         conn = get_conn()
         try:
@@ -456,19 +603,139 @@ def get_fits_metadata():
                 if not row:
                     return jsonify({'error': 'Metadata not found'}), 404
                 
-                # Convert datetime objects to strings for JSON serialization
-                for key, val in row.items():
-                    if isinstance(val, (datetime, date, time)):
-                        row[key] = val.isoformat()
-                        
-                return jsonify(row)
+                # Validators of the row actually returned
+                updated_at = row['updated_at']
+                etag = make_etag(f"{file_id}:{updated_at.isoformat()}", 'metadata')
+                return set_validators(jsonify(serialize_row(row)), etag, updated_at)
+        finally:
+            release_conn(conn)
+
+    except Exception as e:
+        logger.error("Error fetching metadata: %s", e)
+        return jsonify({'error': str(e)}), 500
+
+
+METADATA_BATCH_LIMIT = 10000
+
+@app.route('/api/fits-metadata/batch/', methods=['POST'])
+def get_fits_metadata_batch():
+    """
+    Get metadata for many files in one query.
+
+    JSON body:
+        fileids: list of integer file ids
+        files:   list of object names (e.g. "12345.fits")
+        columns: optional list of columns to return (default: all)
+
+    Returns {"results": {<requested id or name>: row}, "missing": [...]}.
+    """
+    body = request.get_json(silent=True) or {}
+    fileids = body.get('fileids') or []
+    files = body.get('files') or []
+    columns = body.get('columns')
+
+    if not isinstance(fileids, list) or not isinstance(files, list):
+        return jsonify({'error': 'fileids and files must be lists'}), 400
+    if columns is not None and not isinstance(columns, list):
+        return jsonify({'error': 'columns must be a list'}), 400
+    if not fileids and not files:
+        return jsonify({'error': 'No fileids or files specified'}), 400
+    if len(fileids) + len(files) > METADATA_BATCH_LIMIT:
+        return jsonify({'error': f'At most {METADATA_BATCH_LIMIT} ids per request'}), 400
+
+    # Map every requested key to its fileid so results can be returned
+    # under the name the client asked for
+    requested = {}
+    for fid in fileids:
+        try:
+            requested[str(fid)] = int(fid)
+        except (TypeError, ValueError):
+            return jsonify({'error': f'Invalid fileid: {fid}'}), 400
+    for name in files:
+        file_id = fileid_from_name(name)
+        if file_id is None:
+            return jsonify({'error': f'Invalid filename format, expected <int>.fits: {name}'}), 400
+        requested[name] = file_id
+
+    try:
+        conn = get_conn()
+        try:
+            all_columns = get_metadata_columns(conn)
+            if columns:
+                unknown = [c for c in columns if c not in all_columns]
+                if unknown:
+                    return jsonify({'error': f'Unknown columns: {", ".join(map(str, unknown))}'}), 400
+                # fileid is always needed to match rows back to the request
+                selected = ['fileid'] + [c for c in columns if c != 'fileid']
+            else:
+                selected = all_columns
+
+            with conn.cursor() as cur:
+                cur.execute(
+                    f"SELECT {', '.join(selected)} FROM fits_headers WHERE fileid = ANY(%s::bigint[])",
+                    (list(set(requested.values())),)
+                )
+                rows_by_id = {}
+                for values in cur.fetchall():
+                    row = serialize_row(dict(zip(selected, values)))
+                    if columns and 'fileid' not in columns:
+                        file_id = row.pop('fileid')
+                    else:
+                        file_id = row['fileid']
+                    rows_by_id[file_id] = row
         finally:
             release_conn(conn)
 
+        results = {}
+        missing = []
+        for key, file_id in requested.items():
+            if file_id in rows_by_id:
+                results[key] = rows_by_id[file_id]
+            else:
+                missing.append(key)
+
+        return jsonify({'results': results, 'missing': missing})
+
     except Exception as e:
-        print(f"Error fetching metadata: {e}")
+        logger.error("Error fetching batch metadata: %s", e)
         return jsonify({'error': str(e)}), 500
 
+setup_export_route(app, get_conn, release_conn, get_metadata_columns)
+setup_bulk_download_route(app, minio_client, MINIO_BUCKET, get_conn, release_conn)
+
+presign_cache = PresignedURLCache(minio_client)
+setup_presign_route(app, presign_cache, MINIO_BUCKET)
+setup_raw_download_route(app, minio_client, MINIO_BUCKET)
+setup_stats_route(app, hdul_pool, object_validators)
+setup_resumable_upload_route(
+    app, minio_client, MINIO_BUCKET, get_conn, release_conn, insert_header,
+    on_stored=lambda object_name, fileid: (validators.invalidate(('object', object_name)),
+                                           validators.invalidate(('row', fileid)))
+)
+setup_metrics(app, 'minio_fits_backend')
+setup_request_timing(app)
+
+
+def preload():
+    """
+    Import the rendering stack and fill astropy's and matplotlib's caches
+    (units, font list) without touching the network; serve.py runs this
+    before forking workers so they share the result.
+    """
+    _figure_png(_image_figure(np.random.default_rng(0).normal(1000.0, 10.0, (64, 64))))
+    header_to_row(fits.Header([('FILEID', 1), ('DATE-OBS', '2024-01-01T00:00:00.000')]))
+
+
+def warm_up():
+    """Open the DB pool and a MinIO connection; run in each worker after fork"""
+    conn = get_conn()
+    try:
+        with conn.cursor() as cur:
+            cur.execute("SELECT 1")
+    finally:
+        release_conn(conn)
+    minio_client.bucket_exists(MINIO_BUCKET)
+
 if __name__ == '__main__':
     print("Starting Flask server...")
     app.run(port=5003, debug=False, host='0.0.0.0') 
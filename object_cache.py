@@ -0,0 +1,238 @@
+"""
+Disk cache of FITS objects shared by the read paths.
+
+Opening one result in the UI hits several endpoints (image, image data,
+cutout, /view-fits) that all read the same object. ObjectCache keeps whole
+objects under FITS_OBJECT_CACHE_DIR, named by object name and ETag, so a
+changed object is never served from a stale copy. The cache is bounded by
+FITS_OBJECT_CACHE_MB and evicts least recently used files first.
+
+A miss starts a parallel_fetch.RangeSpool into a partial file in the cache
+directory. The request reads as soon as its bytes arrive, as before; the
+download then finishes in the background and the file is renamed into the
+cache. Concurrent requests of one worker for the same object share that
+download. Workers share the files (not the downloads in flight).
+
+Files in use are pinned with a shared flock(); eviction takes an exclusive
+lock without blocking and skips files it cannot lock, so a file is never
+removed while a request in any worker is reading it.
+
+    with object_cache.fetch('12345.fits', etag) as entry:
+        hdul = entry.open()
+        entry.wait_for(hdul[0], planes=1)
+"""
+
+import fcntl
+import hashlib
+import os
+import tempfile
+import threading
+import time
+import logging
+
+from astropy.io import fits
+
+from metrics import OBJECT_CACHE_LOOKUPS, OBJECT_CACHE_BYTES
+from parallel_fetch import RangeSpool
+
+logger = logging.getLogger(__name__)
+
+CACHE_DIR = os.environ.get('FITS_OBJECT_CACHE_DIR', os.path.join(tempfile.gettempdir(), 'fits_objects'))
+CACHE_BYTES = int(os.environ.get('FITS_OBJECT_CACHE_MB', '4096')) * 1024 * 1024
+SUFFIX = '.fits'
+STALE_PART_SECONDS = 3600
+
+
+def _pin(path):
+    """Open and share-lock a cached file; None if it does not exist (any more)"""
+    try:
+        fd = os.open(path, os.O_RDONLY)
+    except FileNotFoundError:
+        return None
+    fcntl.flock(fd, fcntl.LOCK_SH)
+    # Evicted between the open and the lock
+    if os.fstat(fd).st_nlink == 0:
+        os.close(fd)
+        return None
+    return fd
+
+
+class CachedObject:
+    """A complete cached file, pinned until closed; reads like a RangeSpool"""
+
+    def __init__(self, path, fd):
+        self.path = path
+        self.fd = fd
+        self.hduls = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def open(self):
+        hdul = fits.open(self.path)
+        self.hduls.append(hdul)
+        return hdul
+
+    def wait_for(self, hdu, planes=None):
+        pass
+
+    def wait_all(self):
+        pass
+
+    def close(self):
+        for hdul in self.hduls:
+            hdul.close()
+        self.hduls = []
+        if self.fd is not None:
+            os.close(self.fd)
+            self.fd = None
+
+
+class SpoolReader:
+    """One request's view of a download in progress"""
+
+    def __init__(self, spool):
+        self.spool = spool
+        self.hduls = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def open(self):
+        hdul = self.spool.open()
+        self.hduls.append(hdul)
+        return hdul
+
+    def wait_for(self, hdu, planes=None):
+        self.spool.wait_for(hdu, planes)
+
+    def wait_all(self):
+        self.spool.wait_all()
+
+    def close(self):
+        if self.spool is None:
+            return
+        self.spool.release(*self.hduls)
+        self.hduls = []
+        self.spool = None
+
+
+class ObjectCache:
+    """Read-through cache of whole MinIO objects on local disk"""
+
+    def __init__(self, minio_client, bucket_name, cache_dir=CACHE_DIR, max_bytes=CACHE_BYTES):
+        self.minio_client = minio_client
+        self.bucket_name = bucket_name
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self._loading = {}
+        self._lock = threading.Lock()
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def _path(self, object_name, etag):
+        name = hashlib.sha256(object_name.encode()).hexdigest()[:32]
+        version = hashlib.sha256(str(etag).encode()).hexdigest()[:16]
+        return os.path.join(self.cache_dir, f'{name}-{version}{SUFFIX}')
+
+    def fetch(self, object_name, etag=None):
+        """
+        CachedObject or SpoolReader for the current version of an object
+        (`etag`, looked up when not given); use it as a context manager
+        """
+        size = None
+        if etag is None:
+            stat = self.minio_client.stat_object(self.bucket_name, object_name)
+            etag, size = stat.etag, stat.size
+        path = self._path(object_name, etag)
+        fd = _pin(path)
+        if fd is not None:
+            OBJECT_CACHE_LOOKUPS.labels('hit').inc()
+            # Modification time orders the files for eviction
+            os.utime(path)
+            return CachedObject(path, fd)
+
+        while True:
+            with self._lock:
+                spool = self._loading.get(path)
+                # A failed download is replaced rather than joined
+                if spool is not None and spool.error is None:
+                    OBJECT_CACHE_LOOKUPS.labels('shared').inc()
+                    spool.acquire()
+                    return SpoolReader(spool)
+                # Stored since the pin above failed
+                fd = _pin(path)
+                if fd is not None:
+                    OBJECT_CACHE_LOOKUPS.labels('hit').inc()
+                    return CachedObject(path, fd)
+                if size is not None:
+                    OBJECT_CACHE_LOOKUPS.labels('miss').inc()
+                    spool = RangeSpool(self.minio_client, self.bucket_name, object_name,
+                                       path=f'{path}.{os.getpid()}.part', size=size,
+                                       on_complete=lambda spool: self._store(spool, path))
+                    self._loading[path] = spool
+                    return SpoolReader(spool)
+            # The size takes a round trip to MinIO, which must not hold the
+            # lock every request goes through; check again afterwards
+            size = self.minio_client.stat_object(self.bucket_name, object_name).size
+
+    def _store(self, spool, path):
+        """on_complete of a miss: pin the finished file and move it into the cache"""
+        fcntl.flock(spool.file.fileno(), fcntl.LOCK_SH)
+        prefix = os.path.basename(path).split('-')[0]
+        # Earlier versions of the object are stale
+        for name in os.listdir(self.cache_dir):
+            if name.startswith(prefix) and name.endswith(SUFFIX) and name != os.path.basename(path):
+                self._remove(os.path.join(self.cache_dir, name))
+        # New requests pin the cached file from here on instead of joining the spool
+        with self._lock:
+            self._loading.pop(path, None)
+            spool.move(path)
+        self.evict()
+
+    def _remove(self, path):
+        """Delete a cached file unless it is pinned; True if it was removed"""
+        try:
+            fd = os.open(path, os.O_RDONLY)
+        except FileNotFoundError:
+            return True
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            os.close(fd)
+            return False
+        try:
+            os.unlink(path)
+        except FileNotFoundError:
+            pass
+        os.close(fd)
+        return True
+
+    def evict(self):
+        """Remove least recently used files until the cache fits its budget"""
+        entries = []
+        now = time.time()
+        for entry in os.scandir(self.cache_dir):
+            try:
+                stat = entry.stat()
+            except FileNotFoundError:
+                continue
+            if entry.name.endswith(SUFFIX):
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+            elif entry.name.endswith('.part') and now - stat.st_mtime > STALE_PART_SECONDS:
+                # Left behind by a worker that died while downloading
+                self._remove(entry.path)
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            if self._remove(path):
+                total -= size
+                logger.debug("Evicted %s from the object cache", path)
+        OBJECT_CACHE_BYTES.set(total)
+        return total
@@ -0,0 +1,296 @@
+"""
+Parallel ranged downloads of FITS objects into a memory-mapped spool file.
+
+RangeSpool splits an object into byte ranges, fetches them on several
+connections at once into a preallocated (sparse) temporary file, and opens
+it with astropy memory-mapped. Ranges are requested in file order, so the
+headers and the first planes arrive first; open() returns as soon as the
+header of every HDU is on disk, and wait_for() blocks only until the data
+a caller is about to read has arrived. Ranges nobody waited for are
+cancelled when the spool is closed, so rendering the first plane of a
+large cube does not wait for (or keep downloading) the rest.
+
+Gzipped objects cannot be memory-mapped; open() waits for the whole file.
+
+With `on_complete`, the download is never cancelled: ranges keep arriving
+after close(), and once the file is complete on_complete(spool) may keep it
+by moving it elsewhere with move() (object_cache.py does). Several readers can then share one
+spool: each calls acquire(), open() and, when done, release(*its hduls).
+
+    with RangeSpool(minio_client, bucket, 'cube.fits') as spool:
+        hdul = spool.open()
+        hdu = hdul[0]
+        spool.wait_for(hdu, planes=1)
+        plane = hdu.section[0]
+"""
+
+from astropy.io import fits
+from concurrent.futures import ThreadPoolExecutor, wait as wait_futures
+import math
+import os
+import tempfile
+import threading
+import logging
+
+from fits_header_reader import BLOCK_SIZE, GZIP_MAGIC, find_header_end, parse_header_cards
+
+logger = logging.getLogger(__name__)
+
+PART_SIZE = int(os.environ.get('FITS_FETCH_PART_MB', '8')) * 1024 * 1024
+WORKERS = int(os.environ.get('FITS_FETCH_WORKERS', '8'))
+CHUNK_SIZE = 256 * 1024
+RETRIES = 3
+
+
+class RangeSpool:
+    """One object being downloaded in parallel ranges into a temporary file"""
+
+    def __init__(self, minio_client, bucket_name, object_name, part_size=PART_SIZE, workers=WORKERS,
+                 path=None, on_complete=None, size=None):
+        self.minio_client = minio_client
+        self.bucket_name = bucket_name
+        self.object_name = object_name
+        # Callers that already know the size save a stat round trip
+        self.size = minio_client.stat_object(bucket_name, object_name).size if size is None else size
+        self.hduls = []
+        self.spans = None
+        self.gzipped = None
+        self.error = None
+        self.closed = False
+        self.cancelled = False
+        self.kept = False
+        self.on_complete = on_complete
+        # The caller (until close() or release()) and the completion thread
+        self.users = 2 if on_complete is not None else 1
+
+        if path is None:
+            fd, self.path = tempfile.mkstemp(suffix='.fits', prefix='spool_')
+            self.file = os.fdopen(fd, 'r+b')
+        else:
+            self.path = path
+            self.file = open(path, 'w+b')
+        # Sparse until the ranges are written; memmap needs the full length
+        self.file.truncate(self.size)
+
+        self.ranges = [(start, min(start + part_size, self.size)) for start in range(0, self.size, part_size)]
+        # Bytes written so far at the start of each range
+        self.filled = [start for start, _ in self.ranges]
+        self.part_size = part_size
+        self.condition = threading.Condition()
+        self.structure_lock = threading.Lock()
+        self.pool = ThreadPoolExecutor(max_workers=max(1, min(workers, len(self.ranges))),
+                                       thread_name_prefix='spool')
+        self.futures = [self.pool.submit(self._fetch, index) for index in range(len(self.ranges))]
+        if on_complete is not None:
+            threading.Thread(target=self._complete, name='spool-complete', daemon=True).start()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    # -- download --------------------------------------------------------
+
+    def _fetch(self, index):
+        start, stop = self.ranges[index]
+        for attempt in range(RETRIES):
+            position = self.filled[index]
+            if self.cancelled or position >= stop:
+                return
+            response = None
+            try:
+                response = self.minio_client.get_object(self.bucket_name, self.object_name,
+                                                        offset=position, length=stop - position)
+                for chunk in response.stream(CHUNK_SIZE):
+                    if self.cancelled:
+                        return
+                    os.pwrite(self.file.fileno(), chunk, position)
+                    position += len(chunk)
+                    with self.condition:
+                        self.filled[index] = position
+                        self.condition.notify_all()
+                if position >= stop:
+                    return
+                raise IOError(f"Range {start}-{stop} of {self.object_name} ended at {position}")
+            except Exception as e:
+                # Retries resume where the failed attempt stopped
+                if attempt == RETRIES - 1 or self.cancelled:
+                    with self.condition:
+                        self.error = self.error or e
+                        self.condition.notify_all()
+                    return
+                logger.warning("Retrying range %d-%d of %s: %s", start, stop, self.object_name, e)
+            finally:
+                if response is not None:
+                    response.close()
+                    response.release_conn()
+
+    def _complete(self):
+        wait_futures(self.futures)
+        if self.error is None and not self.cancelled:
+            try:
+                self.on_complete(self)
+            except Exception as e:
+                logger.warning("Keeping %s failed: %s", self.object_name, e)
+        self.pool.shutdown()
+        self.release()
+
+    def move(self, path):
+        """
+        Rename the complete file to `path` and keep it after the last
+        reader. Readers open the file by name, so they see the old or the
+        new name, never a missing file.
+        """
+        with self.condition:
+            os.replace(self.path, path)
+            self.path = path
+            self.kept = True
+
+    def _ready(self, start, stop):
+        first = start // self.part_size
+        last = (stop - 1) // self.part_size
+        return all(self.filled[i] >= min(stop, self.ranges[i][1]) for i in range(first, last + 1))
+
+    def wait(self, stop, start=0):
+        """Block until bytes [start, stop) are on disk"""
+        stop = min(stop, self.size)
+        if stop <= start:
+            return
+        with self.condition:
+            while not self._ready(start, stop):
+                if self.error is not None:
+                    raise self.error
+                self.condition.wait()
+
+    def wait_all(self):
+        self.wait(self.size)
+
+    def read(self, start, stop):
+        self.wait(stop, start)
+        return os.pread(self.file.fileno(), min(stop, self.size) - start, start)
+
+    # -- FITS structure --------------------------------------------------
+
+    def _header_at(self, offset):
+        """Raw header starting at `offset`, read as soon as its blocks arrive"""
+        length = BLOCK_SIZE
+        while True:
+            data = self.read(offset, offset + length)
+            end = find_header_end(data)
+            if end is not None:
+                return data[:end]
+            if offset + length >= self.size:
+                raise ValueError(f"No END card in the header at {offset} of {self.object_name}")
+            length *= 2
+
+    def _hdu_spans(self):
+        """[(header offset, data offset, padded data size)] of every HDU"""
+        spans = []
+        offset = 0
+        while offset < self.size:
+            header = self._header_at(offset)
+            cards = {keyword: value for keyword, value, _ in parse_header_cards(header)}
+            naxis = [int(cards.get(f'NAXIS{i}', 0)) for i in range(1, int(cards.get('NAXIS', 0)) + 1)]
+            if naxis and naxis[0] == 0 and cards.get('GROUPS') == 'True':
+                naxis = naxis[1:]
+            elements = math.prod(naxis) if naxis else 0
+            data_size = abs(int(cards.get('BITPIX', 8))) // 8 * int(cards.get('GCOUNT', 1)) * \
+                (int(cards.get('PCOUNT', 0)) + elements)
+            data_offset = offset + len(header)
+            padded = -(-data_size // BLOCK_SIZE) * BLOCK_SIZE
+            spans.append((offset, data_offset, padded))
+            offset = data_offset + padded
+        return spans
+
+    def open(self):
+        """
+        A new HDUList of the object, memory-mapped, returned once every
+        header has arrived. Read data only after wait_for() (or wait_all()).
+        """
+        with self.structure_lock:
+            if self.gzipped is None:
+                gzipped = self.read(0, 2) == GZIP_MAGIC
+                if not gzipped:
+                    self.spans = self._hdu_spans()
+                self.gzipped = gzipped
+        if self.gzipped:
+            self.wait_all()
+        with self.condition:
+            # memmap left at its default: mapped where possible, while scaled
+            # (BZERO/BSCALE) images are still allowed
+            hdul = fits.open(self.path)
+        if not self.gzipped:
+            # Parse every header now, while only header bytes are guaranteed
+            hdul.readall()
+        self.hduls.append(hdul)
+        return hdul
+
+    def _hdu_index(self, hdu):
+        for hdul in self.hduls:
+            for index, candidate in enumerate(hdul):
+                if candidate is hdu:
+                    return index
+        raise ValueError("HDU does not belong to an HDUList opened from this spool")
+
+    def wait_for(self, hdu, planes=None):
+        """
+        Block until the data of `hdu` (an HDU of an open() HDUList) is on
+        disk, or only its first `planes` planes along the slowest axis.
+        Compressed HDUs are always waited for in full.
+        """
+        if self.spans is None:
+            return
+        _, data_offset, data_size = self.spans[self._hdu_index(hdu)]
+        stop = data_offset + data_size
+        ndim = hdu.header.get('NAXIS', 0)
+        if planes is not None and ndim > 2 and not isinstance(hdu, fits.CompImageHDU):
+            plane_size = abs(hdu.header['BITPIX']) // 8 * math.prod(
+                hdu.header[f'NAXIS{i}'] for i in range(1, ndim)
+            )
+            stop = min(stop, data_offset + planes * plane_size)
+        self.wait(stop, data_offset)
+
+    def acquire(self):
+        """Register another reader; it must call release() when done"""
+        with self.condition:
+            if self.users == 0:
+                raise ValueError(f"Spool of {self.object_name} is already closed")
+            self.users += 1
+
+    def release(self, *hduls):
+        """
+        Close a reader's HDULists and drop the reader. The file is closed,
+        and deleted unless on_complete moved it, after the last reader.
+        """
+        for hdul in hduls:
+            hdul.close()
+            self.hduls.remove(hdul)
+        with self.condition:
+            self.users -= 1
+            last = self.users == 0
+        if last:
+            self.file.close()
+            if not self.kept:
+                try:
+                    os.unlink(self.path)
+                except FileNotFoundError:
+                    pass
+
+    def close(self):
+        """
+        Close the HDULists and, without on_complete, cancel the remaining
+        ranges and delete the spool file
+        """
+        if self.closed:
+            return
+        self.closed = True
+        for hdul in self.hduls:
+            hdul.close()
+        self.hduls = []
+        if self.on_complete is None:
+            self.cancelled = True
+            for future in self.futures:
+                future.cancel()
+            self.pool.shutdown(wait=True)
+        self.release()
@@ -0,0 +1,174 @@
+from flask import request, jsonify, Response
+from collections import OrderedDict
+from datetime import datetime, timedelta, timezone
+import threading
+import time
+import logging
+
+logger = logging.getLogger(__name__)
+
+MAX_BATCH = 10000
+
+
+class PresignedURLCache:
+    def __init__(self, minio_client, expires=3600, refresh_margin=300, max_entries=50000):
+        """
+        Cache presigned GET URLs until shortly before they expire.
+
+        Args:
+            minio_client: client used for signing
+            expires (int): lifetime of newly signed URLs in seconds
+            refresh_margin (int): URLs with less than this many seconds left
+                are re-signed, so callers always get a usable URL
+            max_entries (int): least recently used URLs beyond this are dropped
+        """
+        self.minio_client = minio_client
+        self.expires = expires
+        self.refresh_margin = refresh_margin
+        self.max_entries = max_entries
+        self._urls = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _key(bucket_name, object_name, response_headers):
+        headers = tuple(sorted(response_headers.items())) if response_headers else None
+        return (bucket_name, object_name, headers)
+
+    def peek(self, bucket_name, object_name, response_headers=None):
+        """Return a cached, still fresh (url, expires_at) or None without signing"""
+        key = self._key(bucket_name, object_name, response_headers)
+        with self._lock:
+            cached = self._urls.get(key)
+            if cached is None:
+                return None
+            if cached[1] - time.time() < self.refresh_margin:
+                del self._urls[key]
+                return None
+            self._urls.move_to_end(key)
+            return cached
+
+    def get(self, bucket_name, object_name, response_headers=None):
+        """Return (url, expires_at) for an object, signing only on a cache miss"""
+        cached = self.peek(bucket_name, object_name, response_headers)
+        if cached is not None:
+            return cached
+
+        expires_at = time.time() + self.expires
+        url = self.minio_client.presigned_get_object(
+            bucket_name,
+            object_name,
+            expires=timedelta(seconds=self.expires),
+            response_headers=response_headers
+        )
+
+        with self._lock:
+            self._urls[self._key(bucket_name, object_name, response_headers)] = (url, expires_at)
+            while len(self._urls) > self.max_entries:
+                self._urls.popitem(last=False)
+        return url, expires_at
+
+    def get_many(self, bucket_name, object_names, response_headers=None):
+        """
+        Sign a batch of objects. response_headers, if given, is a function
+        of the object name. Returns {object_name: (url, expires_at)}
+        """
+        return {
+            name: self.get(bucket_name, name, response_headers(name) if response_headers else None)
+            for name in object_names
+        }
+
+    def invalidate(self, bucket_name, object_name):
+        """Drop every cached URL for an object"""
+        with self._lock:
+            for key in [k for k in self._urls if k[:2] == (bucket_name, object_name)]:
+                del self._urls[key]
+
+
+def format_expiry(expires_at):
+    return datetime.fromtimestamp(expires_at, tz=timezone.utc).isoformat()
+
+
+_CURL_ESCAPES = str.maketrans({'\\': '\\\\', '"': '\\"', '\n': '\\n', '\r': '\\r', '\t': '\\t'})
+
+
+def _curl_quote(value):
+    """A double-quoted curl config value; backslash escapes as curl reads them"""
+    return '"' + value.translate(_CURL_ESCAPES) + '"'
+
+
+def build_download_manifest(signed, manifest_format):
+    """
+    Render signed URLs as one download manifest.
+
+    curl: config file for `curl --parallel -K manifest.txt`
+    wget: input file for `wget --content-disposition -i manifest.txt`
+    """
+    lines = []
+    if manifest_format == 'curl':
+        for name, (url, _) in signed.items():
+            lines.append(f'url = {_curl_quote(url)}')
+            lines.append(f'output = {_curl_quote(name)}')
+    else:
+        for url, _ in signed.values():
+            lines.append(url)
+    return '\n'.join(lines) + '\n'
+
+
+def setup_presign_route(app, presign_cache, bucket_name):
+    """Register /api/presign/ on `app`"""
+
+    @app.route('/api/presign/', methods=['GET', 'POST'])
+    def presign_batch():
+        """
+        Sign download URLs for many objects in one call.
+
+        Parameters (JSON body for POST, query string for GET):
+            files: object names (list, or comma separated for GET)
+            format: json (default), curl or wget
+
+        curl and wget return a single manifest file instead of one command
+        per object.
+        """
+        if request.method == 'POST':
+            params = request.get_json(silent=True) or {}
+        else:
+            params = request.args.to_dict()
+
+        files = params.get('files') or []
+        if isinstance(files, str):
+            files = [f.strip() for f in files.split(',') if f.strip()]
+        if not files:
+            return jsonify({'error': 'No files specified'}), 400
+        if len(files) > MAX_BATCH:
+            return jsonify({'error': f'At most {MAX_BATCH} files per request'}), 400
+
+        manifest_format = params.get('format', 'json')
+        if manifest_format not in ('json', 'curl', 'wget'):
+            return jsonify({'error': 'format must be json, curl or wget'}), 400
+
+        # wget names downloads after the URL path plus query string unless the
+        # server sends a Content-Disposition filename
+        response_headers = None
+        if manifest_format == 'wget':
+            response_headers = lambda name: {
+                'response-content-disposition': f'attachment; filename="{name.rsplit("/", 1)[-1]}"'
+            }
+
+        try:
+            signed = presign_cache.get_many(bucket_name, files, response_headers)
+        except Exception as e:
+            logger.error("Error generating presigned URLs: %s", e)
+            return jsonify({'error': str(e)}), 500
+
+        if manifest_format == 'json':
+            return jsonify({
+                'files': [
+                    {'filename': name, 'presigned_url': url, 'expires_at': format_expiry(expires_at)}
+                    for name, (url, expires_at) in signed.items()
+                ],
+                'count': len(signed)
+            })
+
+        response = Response(build_download_manifest(signed, manifest_format), mimetype='text/plain')
+        response.headers['Content-Disposition'] = f'attachment; filename="{manifest_format}_manifest.txt"'
+        return response
@@ -0,0 +1,191 @@
+from flask import request, jsonify, Response
+import os
+import uuid
+import logging
+
+from conditional_get import make_etag, not_modified, set_validators
+
+logger = logging.getLogger(__name__)
+
+CHUNK_SIZE = 256 * 1024
+# Larger multi-range requests are answered with the full object (RFC 9110
+# allows ignoring Range), so one request can't fan out into thousands of
+# MinIO reads
+MAX_RANGES = 64
+
+
+def content_type_for(object_name):
+    if object_name.lower().endswith('.gz'):
+        return 'application/gzip'
+    return 'application/fits'
+
+
+def parse_byte_ranges(value):
+    """
+    Parse a Range header into [(start, stop)] with an exclusive stop, using
+    (-n, None) for suffix ranges and (start, None) for open ranges. Returns
+    None for malformed headers or other units.
+
+    Unlike werkzeug's parser this accepts overlapping and unordered ranges,
+    which RFC 9110 allows; resolve_ranges() merges them.
+    """
+    if not value:
+        return None
+    units, _, spec = value.partition('=')
+    if units.strip().lower() != 'bytes' or not spec:
+        return None
+    ranges = []
+    for item in spec.split(','):
+        first, dash, last = item.strip().partition('-')
+        first, last = first.strip(), last.strip()
+        if not dash or not (first or last):
+            return None
+        if (first and not first.isdigit()) or (last and not last.isdigit()):
+            return None
+        if not first:
+            if int(last) == 0:
+                return None
+            ranges.append((-int(last), None))
+            continue
+        start = int(first)
+        stop = int(last) + 1 if last else None
+        if stop is not None and stop <= start:
+            return None
+        ranges.append((start, stop))
+    return ranges or None
+
+
+def resolve_ranges(ranges, length):
+    """
+    Turn parsed Range specs [(start, stop)] into sorted, merged, satisfiable
+    (start, end) pairs with an exclusive end. Suffix ranges come in as
+    (-n, None) and open ranges as (start, None).
+    """
+    resolved = []
+    for start, stop in ranges:
+        if start < 0:
+            start, stop = max(0, length + start), length
+        else:
+            stop = length if stop is None else min(stop, length)
+        if start < stop:
+            resolved.append((start, stop))
+
+    merged = []
+    for start, stop in sorted(resolved):
+        if merged and start <= merged[-1][1]:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], stop))
+        else:
+            merged.append((start, stop))
+    return merged
+
+
+def _stream_range(minio_client, bucket_name, object_name, start, end):
+    """Yield the bytes [start, end) of an object as MinIO sends them"""
+    response = minio_client.get_object(bucket_name, object_name, offset=start, length=end - start)
+    try:
+        # Chunks are forwarded as read from the socket, without re-buffering
+        for chunk in response.stream(CHUNK_SIZE, decode_content=False):
+            yield chunk
+    finally:
+        response.close()
+        response.release_conn()
+
+
+def _multipart_parts(ranges, length, content_type, boundary):
+    """(part header bytes, start, end) for each range, plus the closing delimiter"""
+    parts = []
+    for start, end in ranges:
+        head = (
+            f"\r\n--{boundary}\r\n"
+            f"Content-Type: {content_type}\r\n"
+            f"Content-Range: bytes {start}-{end - 1}/{length}\r\n\r\n"
+        ).encode('ascii')
+        parts.append((head, start, end))
+    closing = f"\r\n--{boundary}--\r\n".encode('ascii')
+    return parts, closing
+
+
+def setup_raw_download_route(app, minio_client, bucket_name):
+    """Register /api/fits-raw/<object> on `app`"""
+
+    @app.route('/api/fits-raw/<path:object_name>', methods=['GET'])
+    def fits_raw(object_name):
+        """
+        Stream an object from MinIO through the API.
+
+        Supports single and multiple byte ranges (multipart/byteranges),
+        If-Range, and ETag/Last-Modified revalidation, so remote FITS readers
+        can fetch just the HDUs they need from one stable origin.
+        ?inline=1 serves the file without an attachment disposition.
+        """
+        try:
+            stat = minio_client.stat_object(bucket_name, object_name)
+        except Exception as e:
+            if getattr(e, 'code', None) in ('NoSuchKey', 'NoSuchObject'):
+                return jsonify({'error': f'File not found: {object_name}'}), 404
+            logger.error("Error reading %s: %s", object_name, e)
+            return jsonify({'error': str(e)}), 500
+
+        length = stat.size
+        last_modified = stat.last_modified
+        etag = make_etag(stat.etag, 'raw')
+        cached = not_modified(app, etag, last_modified)
+        if cached:
+            return cached
+
+        content_type = content_type_for(object_name)
+        ranges = None
+        byte_ranges = parse_byte_ranges(request.headers.get('Range'))
+        if byte_ranges is not None:
+            # A stale If-Range means the client's partial copy is outdated
+            if_range = request.if_range
+            if if_range.etag is not None:
+                use_range = if_range.etag == etag
+            elif if_range.date is not None:
+                use_range = last_modified is not None and \
+                    last_modified.replace(microsecond=0) <= if_range.date
+            else:
+                use_range = True
+            if use_range and len(byte_ranges) <= MAX_RANGES:
+                ranges = resolve_ranges(byte_ranges, length)
+                if not ranges:
+                    response = Response(status=416)
+                    response.headers['Content-Range'] = f'bytes */{length}'
+                    return response
+
+        if ranges is None or (len(ranges) == 1 and ranges[0] == (0, length)):
+            response = Response(
+                _stream_range(minio_client, bucket_name, object_name, 0, length) if length else [],
+                status=200, mimetype=content_type, direct_passthrough=True
+            )
+            response.content_length = length
+        elif len(ranges) == 1:
+            start, end = ranges[0]
+            response = Response(
+                _stream_range(minio_client, bucket_name, object_name, start, end),
+                status=206, mimetype=content_type, direct_passthrough=True
+            )
+            response.headers['Content-Range'] = f'bytes {start}-{end - 1}/{length}'
+            response.content_length = end - start
+        else:
+            boundary = uuid.uuid4().hex
+            parts, closing = _multipart_parts(ranges, length, content_type, boundary)
+
+            def generate():
+                for head, start, end in parts:
+                    yield head
+                    yield from _stream_range(minio_client, bucket_name, object_name, start, end)
+                yield closing
+
+            response = Response(generate(), status=206, direct_passthrough=True)
+            response.headers['Content-Type'] = f'multipart/byteranges; boundary={boundary}'
+            response.content_length = (
+                sum(len(head) + end - start for head, start, end in parts) + len(closing)
+            )
+
+        response.headers['Accept-Ranges'] = 'bytes'
+        if not request.args.get('inline'):
+            response.headers['Content-Disposition'] = \
+                f'attachment; filename="{os.path.basename(object_name)}"'
+        logger.debug("Proxying %s (%s)", object_name, request.headers.get('Range', 'full'))
+        return set_validators(response, etag, last_modified, 'public, max-age=0, must-revalidate')
@@ -0,0 +1,210 @@
+"""
+Per-request Server-Timing breakdown and an opt-in sampling profiler.
+
+Code on the request path records named phases with server_timing() or
+add_timing(); the totals are sent as a Server-Timing header, which browser
+dev tools show next to the request.
+
+Admins can profile a single request by sending `X-Profile: 1` (or
+`?profile=1`) together with `X-Admin-Token: $FITS_ADMIN_TOKEN`. A thread
+then samples the handler's stack every few milliseconds until the response
+has been sent, and the folded stacks (flamegraph.pl / speedscope format)
+are stored for download from /api/admin/profiles/<id>. Without the token
+nothing is started, so the cost for normal requests is a header lookup.
+"""
+
+from flask import g, request, jsonify, Response, has_request_context
+from contextlib import contextmanager
+from collections import Counter
+import hmac
+import json
+import os
+import re
+import sys
+import tempfile
+import threading
+import time
+import uuid
+import logging
+
+logger = logging.getLogger(__name__)
+
+ADMIN_TOKEN = os.environ.get("FITS_ADMIN_TOKEN", "")
+PROFILE_DIR = os.environ.get("FITS_PROFILE_DIR", os.path.join(tempfile.gettempdir(), "fits_profiles"))
+PROFILE_KEEP = 50
+SAMPLE_INTERVAL = 0.005
+# Stop sampling runaway requests after this many seconds
+MAX_PROFILE_SECONDS = 120
+
+_PROFILE_ID = re.compile(r'^[0-9a-f]{32}$')
+
+
+def add_timing(name, seconds):
+    """Add `seconds` to the current request's Server-Timing entry `name`"""
+    if not has_request_context():
+        return
+    timings = g.get('server_timings')
+    if timings is None:
+        timings = g.server_timings = {}
+    total, count = timings.get(name, (0.0, 0))
+    timings[name] = (total + seconds, count + 1)
+
+
+@contextmanager
+def server_timing(name):
+    """Record the wall time of the `with` block as a Server-Timing phase"""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        add_timing(name, time.perf_counter() - start)
+
+
+def format_server_timing(timings, total=None):
+    """Server-Timing header value; repeated phases are summed"""
+    entries = []
+    for name, (seconds, count) in timings.items():
+        entry = f'{name};dur={seconds * 1000:.1f}'
+        if count > 1:
+            entry += f';desc="{count}x"'
+        entries.append(entry)
+    if total is not None:
+        entries.append(f'total;dur={total * 1000:.1f}')
+    return ', '.join(entries)
+
+
+class SamplingProfiler:
+    """Samples one thread's Python stack on a background thread"""
+
+    def __init__(self, thread_id, interval=SAMPLE_INTERVAL):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks = Counter()
+        self.samples = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def start(self):
+        self.started = time.perf_counter()
+        self._thread.start()
+        return self
+
+    def _run(self):
+        deadline = time.monotonic() + MAX_PROFILE_SECONDS
+        while not self._stop.wait(self.interval) and time.monotonic() < deadline:
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is None:
+                break
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f'{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})')
+                frame = frame.f_back
+            self.stacks[';'.join(reversed(stack))] += 1
+            self.samples += 1
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+        self.seconds = time.perf_counter() - self.started
+
+    def folded(self):
+        """Stacks in the folded format: one `frame;frame;frame count` per line"""
+        return ''.join(f'{stack} {count}\n' for stack, count in self.stacks.most_common())
+
+
+def is_admin():
+    token = request.headers.get('X-Admin-Token', '')
+    return bool(ADMIN_TOKEN) and hmac.compare_digest(token.encode(), ADMIN_TOKEN.encode())
+
+
+def _save_profile(profile_id, profiler, meta):
+    os.makedirs(PROFILE_DIR, exist_ok=True)
+    with open(os.path.join(PROFILE_DIR, f'{profile_id}.folded'), 'w') as f:
+        f.write(profiler.folded())
+    with open(os.path.join(PROFILE_DIR, f'{profile_id}.json'), 'w') as f:
+        json.dump(meta, f)
+
+    # Keep only the newest profiles
+    metas = sorted(
+        (p for p in os.listdir(PROFILE_DIR) if p.endswith('.json')),
+        key=lambda p: os.path.getmtime(os.path.join(PROFILE_DIR, p))
+    )
+    for old in metas[:-PROFILE_KEEP]:
+        for suffix in ('.json', '.folded'):
+            path = os.path.join(PROFILE_DIR, old[:-5] + suffix)
+            if os.path.exists(path):
+                os.unlink(path)
+
+
+def setup_request_timing(app):
+    """Add Server-Timing headers to every response of `app` and the profile routes"""
+
+    @app.before_request
+    def start_request_timing():
+        g.request_start = time.perf_counter()
+        if request.headers.get('X-Profile') or request.args.get('profile'):
+            if not is_admin():
+                logger.info("Ignoring profile request without a valid admin token")
+                return
+            g.profile_id = uuid.uuid4().hex
+            g.profiler = SamplingProfiler(threading.get_ident()).start()
+
+    @app.after_request
+    def add_server_timing(response):
+        start = g.get('request_start')
+        timings = g.get('server_timings') or {}
+        if start is not None:
+            response.headers['Server-Timing'] = format_server_timing(timings, time.perf_counter() - start)
+        if g.get('profile_id'):
+            response.headers['X-Profile-Id'] = g.profile_id
+        return response
+
+    @app.teardown_request
+    def finish_profile(exc):
+        # Runs after a streamed body (stream_with_context) has been sent too
+        profiler = g.pop('profiler', None)
+        if profiler is None:
+            return
+        profiler.stop()
+        meta = {
+            'id': g.profile_id,
+            'path': request.path,
+            'query': request.query_string.decode('utf-8', 'replace'),
+            'seconds': round(profiler.seconds, 4),
+            'samples': profiler.samples,
+            'interval': profiler.interval,
+            'created': time.time(),
+        }
+        try:
+            _save_profile(g.profile_id, profiler, meta)
+            logger.info("Saved profile %s for %s (%d samples)", g.profile_id, request.path, profiler.samples)
+        except OSError as e:
+            logger.error("Could not save profile %s: %s", g.profile_id, e)
+
+    @app.route('/api/admin/profiles/', methods=['GET'])
+    def list_profiles():
+        """Metadata of the stored request profiles, newest first"""
+        if not is_admin():
+            return jsonify({'error': 'Admin token required'}), 403
+        profiles = []
+        if os.path.isdir(PROFILE_DIR):
+            for name in os.listdir(PROFILE_DIR):
+                if name.endswith('.json'):
+                    with open(os.path.join(PROFILE_DIR, name)) as f:
+                        profiles.append(json.load(f))
+        profiles.sort(key=lambda p: p['created'], reverse=True)
+        return jsonify(profiles)
+
+    @app.route('/api/admin/profiles/<profile_id>', methods=['GET'])
+    def download_profile(profile_id):
+        """Folded stacks of one profile, for flamegraph.pl or speedscope"""
+        if not is_admin():
+            return jsonify({'error': 'Admin token required'}), 403
+        path = os.path.join(PROFILE_DIR, f'{profile_id}.folded')
+        if not _PROFILE_ID.match(profile_id) or not os.path.exists(path):
+            return jsonify({'error': 'Profile not found'}), 404
+        with open(path) as f:
+            response = Response(f.read(), mimetype='text/plain')
+        response.headers['Content-Disposition'] = f'attachment; filename="profile_{profile_id}.folded"'
+        return response
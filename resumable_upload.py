@@ -0,0 +1,468 @@
+#!/usr/bin/env python3
+"""
+Resumable chunked uploads for large FITS files.
+
+Protocol (all under /api/uploads/):
+    POST   /api/uploads/                      {"size": N, "filename": ..., "chunk_size": ...}
+                                              -> session id and chunk size
+    PUT    /api/uploads/<session>?offset=N    one chunk; Content-MD5 is checked if sent
+    GET    /api/uploads/<session>             confirmed chunks and the next missing offset
+    POST   /api/uploads/<session>/complete    header extraction, fits_headers upsert, store
+    DELETE /api/uploads/<session>             abandon the upload
+
+Chunk i covers bytes [i * chunk_size, (i + 1) * chunk_size) and is stored as
+part i + 1 of a MinIO multipart upload of the final object, so chunks can be
+sent in parallel and in any order and are never copied again. The first
+chunk has to be sent first: its header names the object (<fileid>.fits or
+<fileid>.fits.gz) the multipart upload is created for. Progress comes from
+MinIO's part list, so any worker can serve any request of a session and a
+client that lost its connection resumes from the confirmed chunks.
+
+Session state lives next to the parts, in <FITS_UPLOAD_PREFIX><session>.json
+in the archive bucket. Its status goes from open to completing (finalize
+started, chunks no longer accepted) to stored. `cleanup` aborts sessions older than --older-than
+hours.
+
+Usage:
+    python resumable_upload.py upload frame.fits --url http://localhost:5003 --parallel 4
+    python resumable_upload.py cleanup --older-than 168
+"""
+
+from flask import request, jsonify
+import argparse
+import base64
+import hashlib
+import io
+import json
+import os
+import re
+import sys
+import time
+import urllib.error
+import urllib.request
+import uuid
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+
+from minio.datatypes import Part
+
+from fits_header_reader import GZIP_MAGIC, header_bytes_from_prefix
+from header_mapping import header_to_row
+from ingest_dedup import forget_hashes
+from metrics import INGEST_FILES, INGEST_BYTES
+
+logger = logging.getLogger(__name__)
+
+UPLOAD_PREFIX = os.environ.get('FITS_UPLOAD_PREFIX', 'uploads/')
+DEFAULT_CHUNK_SIZE = 16 * 1024 * 1024
+# S3 rejects parts smaller than 5 MiB (except the last one)
+MIN_CHUNK_SIZE = 5 * 1024 * 1024
+# Chunks are buffered in memory while they are passed on to MinIO
+MAX_CHUNK_SIZE = 256 * 1024 * 1024
+MAX_PARTS = 10000
+
+_SESSION_ID_RE = re.compile(r'[0-9a-f]{32}')
+
+
+class UploadError(Exception):
+    def __init__(self, message, status=400, **details):
+        super().__init__(message)
+        self.status = status
+        self.details = details
+
+
+def chunk_length(session, offset):
+    return min(session['chunk_size'], session['size'] - offset)
+
+
+def session_key(session_id):
+    return f'{UPLOAD_PREFIX}{session_id}.json'
+
+
+def load_session(minio_client, bucket_name, session_id):
+    if not _SESSION_ID_RE.fullmatch(session_id):
+        raise UploadError(f'Unknown upload session: {session_id}', 404)
+    response = None
+    try:
+        response = minio_client.get_object(bucket_name, session_key(session_id))
+        return json.loads(response.read())
+    except Exception as e:
+        if getattr(e, 'code', None) in ('NoSuchKey', 'NoSuchObject'):
+            raise UploadError(f'Unknown upload session: {session_id}', 404)
+        raise
+    finally:
+        if response is not None:
+            response.close()
+            response.release_conn()
+
+
+def save_session(minio_client, bucket_name, session):
+    data = json.dumps(session).encode('utf-8')
+    minio_client.put_object(bucket_name, session_key(session['id']), io.BytesIO(data), len(data),
+                            content_type='application/json')
+
+
+def list_parts(minio_client, bucket_name, session):
+    """{part number: Part} of the session's multipart upload"""
+    parts = {}
+    if not session.get('upload_id'):
+        return parts
+    marker = None
+    while True:
+        result = minio_client._list_parts(bucket_name, session['object'], session['upload_id'],
+                                          part_number_marker=marker)
+        for part in result.parts:
+            parts[part.part_number] = part
+        if not result.is_truncated:
+            return parts
+        marker = result.next_part_number_marker
+
+
+def progress(session, parts):
+    """Offsets of the chunks MinIO holds with the expected size, and of those still missing"""
+    received, missing = [], []
+    for number, offset in enumerate(range(0, session['size'], session['chunk_size']), 1):
+        part = parts.get(number)
+        if part is not None and part.size == chunk_length(session, offset):
+            received.append(offset)
+        else:
+            missing.append(offset)
+    return received, missing
+
+
+def _start_multipart(minio_client, bucket_name, session, chunk):
+    """Name the object from the header in the first chunk and create its multipart upload"""
+    from astropy.io import fits
+
+    header_bytes = header_bytes_from_prefix(chunk)
+    if header_bytes is None:
+        raise UploadError('The first chunk does not contain the whole primary header; use a larger chunk_size')
+    try:
+        row = header_to_row(fits.Header.fromstring(header_bytes))
+    except Exception as e:
+        raise UploadError(f'Invalid FITS header: {e}')
+    object_name = f"{row['fileid']}.fits" + ('.gz' if chunk.startswith(GZIP_MAGIC) else '')
+
+    if session.get('upload_id'):
+        if object_name != session['object']:
+            raise UploadError(f'The first chunk now describes {object_name}, not {session["object"]}', 409)
+        return
+    content_type = 'application/gzip' if object_name.endswith('.gz') else 'application/fits'
+    session['upload_id'] = minio_client._create_multipart_upload(
+        bucket_name, object_name, {'Content-Type': content_type}
+    )
+    session['object'] = object_name
+    session['header'] = header_bytes.decode('latin1')
+    save_session(minio_client, bucket_name, session)
+
+
+def setup_resumable_upload_route(app, minio_client, bucket_name, get_conn, release_conn, insert_header,
+                                 on_stored=None):
+    """
+    Register the /api/uploads/ endpoints on `app`. `insert_header(row, conn)`
+    upserts the fits_headers row at finalize; `on_stored(object_name, fileid)`
+    is called once the object is stored.
+    """
+
+    @app.errorhandler(UploadError)
+    def upload_error(e):
+        return jsonify({'error': str(e), **e.details}), e.status
+
+    @app.route('/api/uploads/', methods=['POST'])
+    def create_upload():
+        """Start an upload session for a file of `size` bytes"""
+        params = request.get_json(silent=True) or {}
+        try:
+            size = int(params['size'])
+            chunk_size = int(params.get('chunk_size') or DEFAULT_CHUNK_SIZE)
+        except (KeyError, TypeError, ValueError):
+            raise UploadError('"size" (and optional "chunk_size") must be integers')
+        if size <= 0:
+            raise UploadError('"size" must be positive')
+        # Stay within the part limit for very large files
+        chunk_size = max(min(chunk_size, MAX_CHUNK_SIZE), MIN_CHUNK_SIZE, -(-size // MAX_PARTS))
+        if chunk_size > MAX_CHUNK_SIZE:
+            raise UploadError(f'File too large: {size} bytes')
+
+        session = {
+            'id': uuid.uuid4().hex,
+            'size': size,
+            'chunk_size': chunk_size,
+            'filename': params.get('filename'),
+            'created': datetime.now(timezone.utc).isoformat(),
+            'upload_id': None,
+            'object': None,
+            'status': 'open',
+        }
+        save_session(minio_client, bucket_name, session)
+        logger.info("Upload session %s: %d bytes in chunks of %d", session['id'], size, chunk_size)
+        return jsonify({
+            'session': session['id'],
+            'size': size,
+            'chunk_size': chunk_size,
+            'chunks': -(-size // chunk_size),
+        }), 201
+
+    @app.route('/api/uploads/<session_id>', methods=['PUT'])
+    def put_chunk(session_id):
+        """Store the chunk at ?offset= as one part of the multipart upload"""
+        session = load_session(minio_client, bucket_name, session_id)
+        if session['status'] != 'open':
+            raise UploadError(f'Upload already {session["status"]}', 409)
+        offset = request.args.get('offset', type=int)
+        if offset is None or offset < 0 or offset >= session['size'] or offset % session['chunk_size']:
+            raise UploadError(f'offset must be a multiple of {session["chunk_size"]} below {session["size"]}')
+        expected = chunk_length(session, offset)
+        if request.content_length != expected:
+            raise UploadError(f'Chunk at {offset} must be {expected} bytes', expected=expected)
+        chunk = request.get_data(cache=False)
+        if len(chunk) != expected:
+            raise UploadError(f'Chunk at {offset} was cut off after {len(chunk)} bytes', expected=expected)
+
+        if offset == 0:
+            _start_multipart(minio_client, bucket_name, session, chunk)
+        elif not session.get('upload_id'):
+            raise UploadError('Send the first chunk (offset 0) before the others', 409)
+
+        headers = {}
+        if request.headers.get('Content-MD5'):
+            headers['Content-MD5'] = request.headers['Content-MD5']
+        part_number = offset // session['chunk_size'] + 1
+        etag = minio_client._upload_part(bucket_name, session['object'], chunk, headers,
+                                         session['upload_id'], part_number)
+        INGEST_BYTES.inc(len(chunk))
+        return jsonify({'offset': offset, 'length': len(chunk), 'part': part_number, 'etag': etag})
+
+    @app.route('/api/uploads/<session_id>', methods=['GET'])
+    def upload_progress(session_id):
+        """Confirmed chunks; resume by sending the `missing` offsets"""
+        session = load_session(minio_client, bucket_name, session_id)
+        response = {
+            'session': session_id,
+            'status': session['status'],
+            'size': session['size'],
+            'chunk_size': session['chunk_size'],
+            'object': session['object'],
+        }
+        if session['status'] == 'open':
+            received, missing = progress(session, list_parts(minio_client, bucket_name, session))
+            response.update({
+                'received': received,
+                'missing': missing,
+                'next_offset': missing[0] if missing else None,
+                'bytes_received': sum(chunk_length(session, offset) for offset in received),
+            })
+        else:
+            response['fileid'] = session.get('fileid')
+        return jsonify(response)
+
+    def recover_completed(session):
+        """
+        The multipart upload of a 'completing' session is gone: it was
+        completed by an earlier finalize that did not get to record it
+        """
+        try:
+            minio_client.stat_object(bucket_name, session['object'])
+        except Exception as e:
+            if getattr(e, 'code', None) in ('NoSuchKey', 'NoSuchObject'):
+                raise UploadError('The upload was aborted; start a new session', 410)
+            raise
+        logger.info("Upload session %s: recovering %s stored by an earlier finalize",
+                    session['id'], session['object'])
+
+    @app.route('/api/uploads/<session_id>/complete', methods=['POST'])
+    def complete_upload(session_id):
+        """
+        Upsert the header row and complete the multipart upload in one
+        transaction. The session is saved as 'completing' first, so that a
+        finalize retried after a crash between the two (or after a failed
+        commit) finds the stored object and only upserts the row again.
+        """
+        session = load_session(minio_client, bucket_name, session_id)
+        if session['status'] == 'stored':
+            # A retried finalize whose response was lost
+            return jsonify({'status': 'stored', 'fileid': session['fileid'], 'object': session['object']})
+
+        try:
+            parts = list_parts(minio_client, bucket_name, session)
+        except Exception as e:
+            if session['status'] != 'completing' or getattr(e, 'code', None) != 'NoSuchUpload':
+                raise
+            recover_completed(session)
+            parts = None
+        if parts is not None:
+            received, missing = progress(session, parts)
+            if missing:
+                raise UploadError(f'{len(missing)} chunks missing', 409, missing=missing[:1000])
+            if session['status'] != 'completing':
+                session['status'] = 'completing'
+                save_session(minio_client, bucket_name, session)
+
+        from astropy.io import fits
+        row = header_to_row(fits.Header.fromstring(session['header']))
+        conn = get_conn()
+        try:
+            conn.autocommit = False
+            insert_header(row, conn)
+            forget_hashes(conn, row['fileid'])
+            if parts is not None:
+                minio_client._complete_multipart_upload(
+                    bucket_name, session['object'], session['upload_id'],
+                    [Part(number, parts[number].etag) for number in range(1, len(received) + 1)]
+                )
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            INGEST_FILES.labels('error').inc()
+            raise
+        finally:
+            release_conn(conn)
+
+        INGEST_FILES.labels('stored').inc()
+        session.update(status='stored', fileid=row['fileid'])
+        save_session(minio_client, bucket_name, session)
+        if on_stored is not None:
+            on_stored(session['object'], row['fileid'])
+        logger.info("Upload session %s stored as %s", session_id, session['object'])
+        return jsonify({'status': 'stored', 'fileid': row['fileid'], 'object': session['object']})
+
+    @app.route('/api/uploads/<session_id>', methods=['DELETE'])
+    def abort_upload(session_id):
+        session = load_session(minio_client, bucket_name, session_id)
+        abort_session(minio_client, bucket_name, session)
+        return jsonify({'status': 'aborted', 'session': session_id})
+
+
+def abort_session(minio_client, bucket_name, session):
+    """Drop the uploaded parts (if the upload is not stored yet) and the session"""
+    if session['status'] in ('open', 'completing') and session.get('upload_id'):
+        try:
+            minio_client._abort_multipart_upload(bucket_name, session['object'], session['upload_id'])
+        except Exception as e:
+            if getattr(e, 'code', None) != 'NoSuchUpload':
+                raise
+    minio_client.remove_object(bucket_name, session_key(session['id']))
+
+
+def cleanup_sessions(minio_client, bucket_name, older_than):
+    """Abort sessions created more than `older_than` seconds ago; return how many"""
+    cutoff = time.time() - older_than
+    removed = 0
+    for obj in minio_client.list_objects(bucket_name, prefix=UPLOAD_PREFIX):
+        session_id = obj.object_name[len(UPLOAD_PREFIX):].removesuffix('.json')
+        if not _SESSION_ID_RE.fullmatch(session_id):
+            continue
+        session = load_session(minio_client, bucket_name, session_id)
+        if datetime.fromisoformat(session['created']).timestamp() < cutoff:
+            abort_session(minio_client, bucket_name, session)
+            removed += 1
+    return removed
+
+
+# -- client -----------------------------------------------------------------
+
+def _call(method, url, body=None, headers=None, retries=5):
+    """JSON request with retries on connection errors and 5xx answers"""
+    for attempt in range(retries):
+        req = urllib.request.Request(url, data=body, method=method, headers=headers or {})
+        try:
+            with urllib.request.urlopen(req, timeout=300) as response:
+                return json.loads(response.read())
+        except urllib.error.HTTPError as e:
+            if e.code < 500 or attempt == retries - 1:
+                raise
+            error = e
+        except (urllib.error.URLError, OSError) as e:
+            if attempt == retries - 1:
+                raise
+            error = e
+        logger.warning("%s %s failed (%s), retrying", method, url, error)
+        time.sleep(2 ** attempt)
+
+
+def upload_file(base_url, path, chunk_size=None, parallel=4, state_path=None):
+    """
+    Upload `path` through the resumable protocol. The session id is kept in
+    `state_path` (default <path>.upload) until the upload completes, so
+    running this again after an interruption sends only missing chunks.
+    """
+    api = base_url.rstrip('/') + '/api/uploads/'
+    state_path = state_path or path + '.upload'
+    size = os.path.getsize(path)
+
+    status = None
+    if os.path.exists(state_path):
+        with open(state_path) as f:
+            session_id = json.load(f)['session']
+        try:
+            status = _call('GET', api + session_id)
+            logger.info("Resuming session %s", session_id)
+        except urllib.error.HTTPError as e:
+            if e.code != 404:
+                raise
+    if status is None:
+        body = json.dumps({'size': size, 'filename': os.path.basename(path), 'chunk_size': chunk_size})
+        session_id = _call('POST', api, body.encode(), {'Content-Type': 'application/json'})['session']
+        with open(state_path, 'w') as f:
+            json.dump({'session': session_id}, f)
+        status = _call('GET', api + session_id)
+    if status['size'] != size:
+        raise ValueError(f"{state_path} belongs to a file of {status['size']} bytes")
+
+    def send(offset):
+        with open(path, 'rb') as f:
+            f.seek(offset)
+            chunk = f.read(status['chunk_size'])
+        md5 = base64.b64encode(hashlib.md5(chunk).digest()).decode()
+        _call('PUT', f'{api}{session_id}?offset={offset}', chunk,
+              {'Content-Type': 'application/octet-stream', 'Content-MD5': md5})
+        return len(chunk)
+
+    if status['status'] == 'open':
+        missing = status['missing']
+        # The first chunk names the object; the rest can go in parallel
+        sent = send(missing.pop(0)) if missing and missing[0] == 0 else 0
+        with ThreadPoolExecutor(max_workers=parallel) as pool:
+            sent += sum(pool.map(send, missing))
+        logger.info("Sent %d bytes; %d were already uploaded", sent, status['bytes_received'])
+
+    result = _call('POST', f'{api}{session_id}/complete')
+    os.unlink(state_path)
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Resumable FITS uploads')
+    commands = parser.add_subparsers(dest='command', required=True)
+    upload = commands.add_parser('upload', help='Upload files, resuming earlier attempts')
+    upload.add_argument('files', nargs='+')
+    upload.add_argument('--url', default='http://localhost:5003')
+    upload.add_argument('--parallel', type=int, default=4, help='Chunks in flight (default: 4)')
+    upload.add_argument('--chunk-size', type=int, default=DEFAULT_CHUNK_SIZE // (1024 * 1024), help='MiB')
+    cleanup = commands.add_parser('cleanup', help='Abort upload sessions older than --older-than hours')
+    cleanup.add_argument('--older-than', type=float, default=168)
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format='%(message)s')
+
+    if args.command == 'upload':
+        for path in args.files:
+            result = upload_file(args.url, path, args.chunk_size * 1024 * 1024, args.parallel)
+            print(f"{path}: {result['status']} as {result['object']}")
+        return 0
+
+    from minio_cluster import MinioCluster, MINIO_NODES, endpoints_from_env
+    minio_client = MinioCluster(
+        endpoints_from_env(MINIO_NODES),
+        access_key=os.environ.get('MINIO_ACCESS_KEY', 'Laav10user'),
+        secret_key=os.environ.get('MINIO_SECRET_KEY', 'Laav10pass'),
+        region='minio-region',
+        secure=False,
+    )
+    removed = cleanup_sessions(minio_client, os.environ.get('MINIO_BUCKET', 'dataarchive'), args.older_than * 3600)
+    print(f"Aborted {removed} upload sessions")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,162 @@
+#!/usr/bin/env python3
+"""
+Production entry point: N pre-forked workers serving one of the Flask apps.
+
+The master imports the app module and calls its preload() (imports the
+rendering stack and fills astropy/matplotlib caches), then forks the
+workers, which share those pages copy-on-write. Each worker calls the
+module's warm_up() (DB pool, MinIO connection) before it accepts requests
+on the shared listening socket, and serves them with a thread per
+request. Workers that exit are restarted.
+
+Usage:
+    python serve.py minio_fits_backend --bind 0.0.0.0:5003 --workers 4
+    python serve.py fits_header --bind 0.0.0.0:5000
+
+--workers defaults to FITS_WORKERS or the number of CPUs. Metrics and the
+caches are per worker. A scrape of /metrics on the shared port reaches
+whichever worker accepts it, so with --metrics-port P (or
+FITS_METRICS_PORT) worker i also serves its metrics on port P + i;
+Prometheus scrapes those ports (see the README). A restarted worker takes
+the index, and so the port, of the one it replaces.
+
+Caches invalidated by an upload are only cleared in the worker that took
+the upload; the others serve the previous ETag of a replaced file for up
+to VALIDATOR_TTL seconds (see conditional_get.py).
+"""
+
+import argparse
+import gc
+import importlib
+import logging
+import os
+import signal
+import socket
+import sys
+import threading
+import time
+
+from werkzeug.serving import make_server
+
+logger = logging.getLogger('serve')
+
+# A worker that dies sooner than this after start is restarted with a delay
+MIN_WORKER_SECONDS = 5
+RESTART_DELAY = 1
+
+
+def parse_bind(value):
+    host, _, port = value.rpartition(':')
+    return host or '0.0.0.0', int(port)
+
+
+def run_worker(module, listener, metrics_port=None):
+    """Serve requests in a forked worker until SIGTERM; never returns"""
+    status = 0
+    try:
+        signal.signal(signal.SIGINT, signal.SIG_IGN)
+        if metrics_port:
+            from metrics import serve_metrics
+            serve_metrics(listener.getsockname()[0], metrics_port)
+            logger.info("Worker %d serves metrics on port %d", os.getpid(), metrics_port)
+        warm_up = getattr(module, 'warm_up', None)
+        if warm_up is not None:
+            started = time.perf_counter()
+            try:
+                warm_up()
+                logger.info("Worker %d warmed up in %.2fs", os.getpid(), time.perf_counter() - started)
+            except Exception as e:
+                # Serve anyway; the failing dependency is retried per request
+                logger.warning("Worker %d warm-up failed: %s", os.getpid(), e)
+
+        host, port = listener.getsockname()[:2]
+        server = make_server(host, port, module.app, threaded=True, fd=listener.fileno())
+        # Workers race to accept from the shared socket; losers get EAGAIN
+        server.socket.setblocking(False)
+        server.daemon_threads = True
+        signal.signal(signal.SIGTERM, lambda signum, frame: threading.Thread(target=server.shutdown).start())
+        server.serve_forever()
+    except Exception:
+        logger.exception("Worker %d failed", os.getpid())
+        status = 1
+    finally:
+        from structured_logging import stop_logging
+        stop_logging()
+        os._exit(status)
+
+
+def spawn(module, listener, metrics_port=None):
+    pid = os.fork()
+    if pid == 0:
+        run_worker(module, listener, metrics_port)
+    return pid
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Run a FITS backend with pre-forked workers')
+    parser.add_argument('app', help='Module with the Flask `app` (minio_fits_backend or fits_header)')
+    parser.add_argument('--bind', default='0.0.0.0:5003', help='host:port (default: 0.0.0.0:5003)')
+    parser.add_argument('--workers', type=int, default=int(os.environ.get('FITS_WORKERS', 0)) or os.cpu_count())
+    parser.add_argument('--backlog', type=int, default=1024)
+    parser.add_argument('--metrics-port', type=int, default=int(os.environ.get('FITS_METRICS_PORT', 0)),
+                        help='serve worker i\'s /metrics on this port + i (default: FITS_METRICS_PORT, off)')
+    args = parser.parse_args()
+
+    started = time.perf_counter()
+    module = importlib.import_module(args.app)
+    preload = getattr(module, 'preload', None)
+    if preload is not None:
+        preload()
+    # Keep the preloaded objects out of the collector so that its reference
+    # updates do not copy every shared page into each worker
+    gc.freeze()
+    logger.info("Preloaded %s in %.2fs", args.app, time.perf_counter() - started)
+
+    listener = socket.create_server(parse_bind(args.bind), backlog=args.backlog)
+    listener.setblocking(False)
+
+    def metrics_port(index):
+        return args.metrics_port + index if args.metrics_port else None
+
+    # pid: (start time, worker index)
+    workers = {}
+    for index in range(args.workers):
+        workers[spawn(module, listener, metrics_port(index))] = (time.monotonic(), index)
+    logger.info("Serving %s on %s with %d workers", args.app, args.bind, args.workers)
+
+    stopping = False
+
+    def stop(signum, frame):
+        nonlocal stopping
+        stopping = True
+        for pid in list(workers):
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+
+    while workers:
+        try:
+            pid, status = os.wait()
+        except ChildProcessError:
+            break
+        worker = workers.pop(pid, None)
+        if worker is None or stopping:
+            continue
+        born, index = worker
+        logger.warning("Worker %d exited with status %d, restarting", pid, os.waitstatus_to_exitcode(status))
+        if time.monotonic() - born < MIN_WORKER_SECONDS:
+            time.sleep(RESTART_DELAY)
+        if not stopping:
+            workers[spawn(module, listener, metrics_port(index))] = (time.monotonic(), index)
+
+    listener.close()
+    logger.info("All workers stopped")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,218 @@
+"""
+Preview images of spectra.
+
+The image renderers expect a 2D image; spectra (the 1.2m Echelle's
+extracted orders, 1D spectra, binary-table spectra) are drawn here instead.
+spectrum_hdus() tells them apart from the headers alone, so a caller can
+pick the path before any data is read:
+
+- a 1D image HDU is one spectrum;
+- a 2D image with at most MAX_ORDERS rows, each at least ORDER_ASPECT
+  times longer than there are rows, is a stack of echelle orders (an IRAF
+  multispec cube, bands x orders x pixels, shows its first band);
+- a binary table with a flux column (FLUX_COLUMNS) is one spectrum when the
+  column holds one value per row, or one order per row when it holds
+  arrays, of fixed or variable length.
+
+A file with any other image is left to the image renderers.
+
+Each spectrum is reduced to the output width by min/max (envelope)
+decimation: every pixel column shows the full range of the samples that
+fall into it, so narrow lines and spikes survive however many samples
+there are, and the cost is one pass over the data. Orders are drawn in
+strips of their own, each scaled to its own range, against sample index.
+
+    hdus = spectrum_hdus(hdul)
+    if hdus:
+        png = to_png(render_spectra(read_spectra(hdus)))
+"""
+
+import io
+import logging
+
+import numpy as np
+from astropy.io import fits
+from PIL import Image
+
+logger = logging.getLogger(__name__)
+
+SPECTRUM_WIDTH = 1200
+STRIP_HEIGHT = 300
+MIN_STRIP_HEIGHT = 24
+MAX_HEIGHT = 2400
+MAX_ORDERS = 200
+ORDER_ASPECT = 8
+MAX_BANDS = 4
+FLUX_COLUMNS = ('FLUX', 'SPEC', 'SPECTRUM', 'COUNTS', 'INTENSITY')
+# Big-endian element types of numeric binary table columns
+TFORM_DTYPES = {'B': 'u1', 'I': '>i2', 'J': '>i4', 'K': '>i8', 'E': '>f4', 'D': '>f8'}
+
+BACKGROUND = 255
+SEPARATOR = 200
+LINE = 0
+
+
+def _shape(header):
+    """Image shape from the header, slowest axis first"""
+    return tuple(header.get(f'NAXIS{i}', 0) for i in range(header.get('NAXIS', 0), 0, -1))
+
+
+def _is_orders(shape):
+    return len(shape) == 2 and shape[0] <= MAX_ORDERS and shape[1] >= ORDER_ASPECT * shape[0]
+
+
+def _flux_column(hdu):
+    names = {name.upper(): name for name in hdu.columns.names}
+    for candidate in FLUX_COLUMNS:
+        if candidate in names:
+            return names[candidate]
+    return None
+
+
+def _column_values(column):
+    """A table column from hdu.data, with variable-length arrays as a list"""
+    if column.dtype == object:
+        return [np.array(row) for row in column]
+    return np.array(column)
+
+
+def _read_column(hdu, name):
+    """
+    Column `name` of a binary table, read from the file: hdu.data would
+    attach the whole table to an HDU other threads may share (hdul_pool.py).
+    A variable-length (P/Q) column gives a list with one array per row.
+    """
+    info = hdu.fileinfo()
+    if info is None:
+        # Not read from a file, so not shared either
+        return _column_values(hdu.data[name])
+    if info['file'].compression:
+        # Offsets are into the decompressed stream; read a private HDUList
+        with fits.open(info['file'].name) as hdul:
+            for other in hdul:
+                if other.fileinfo()['hdrLoc'] == info['hdrLoc']:
+                    return _column_values(other.data[name])
+    column = hdu.columns[name]
+    path, offset = info['file'].name, info['datLoc']
+    rows = np.memmap(path, dtype=hdu.columns.dtype.newbyteorder('>'), mode='r',
+                     offset=offset, shape=hdu.header['NAXIS2'])[name]
+    scale = 1 if column.bscale is None else column.bscale
+    zero = column.bzero or 0
+
+    def scaled(values):
+        return values * scale + zero if (scale, zero) != (1, 0) else np.array(values)
+
+    if not column.format.p_format:
+        return scaled(rows)
+    if column.format.p_format not in TFORM_DTYPES:
+        raise ValueError(f"Unsupported {column.format} column {name}")
+    element = np.dtype(TFORM_DTYPES[column.format.p_format])
+    heap = offset + hdu.header.get('THEAP', hdu.header['NAXIS1'] * hdu.header['NAXIS2'])
+    return [scaled(np.fromfile(path, dtype=element, count=int(count), offset=heap + int(start)))
+            for count, start in rows]
+
+
+def spectrum_hdus(hdul):
+    """HDUs holding spectra, judged from the headers; empty if the file holds an image"""
+    found = []
+    for hdu in hdul:
+        if isinstance(hdu, fits.BinTableHDU):
+            if hdu.header.get('NAXIS2', 0) and _flux_column(hdu) is not None:
+                found.append(hdu)
+            continue
+        if getattr(hdu, 'section', None) is None:
+            continue
+        shape = _shape(hdu.header)
+        if not shape or 0 in shape:
+            continue
+        if len(shape) == 1 or _is_orders(shape) or \
+                (len(shape) == 3 and shape[0] <= MAX_BANDS and _is_orders(shape[1:])):
+            found.append(hdu)
+        else:
+            return []
+    return found
+
+
+def read_spectra(hdus):
+    """1D flux array of every spectrum or order in `hdus`"""
+    spectra = []
+    for hdu in hdus:
+        if isinstance(hdu, fits.BinTableHDU):
+            flux = _read_column(hdu, _flux_column(hdu))
+            if isinstance(flux, list):
+                # Variable-length arrays: one spectrum or order per row
+                spectra.extend(row for row in flux if len(row))
+                continue
+        else:
+            shape = _shape(hdu.header)
+            # Through section, so nothing is loaded onto a shared HDU (hdul_pool.py)
+            flux = hdu.section[0] if len(shape) == 3 else hdu.section[...]
+        if flux.ndim == 1:
+            spectra.append(flux)
+        else:
+            spectra.extend(flux.reshape(len(flux), -1))
+    return spectra
+
+
+def envelope(flux, width):
+    """
+    Minimum and maximum of the finite samples falling into each of `width`
+    columns (NaN for columns without any). With fewer samples than columns,
+    each sample spans several columns.
+    """
+    flux = np.asarray(flux, dtype=np.float32)
+    if not len(flux):
+        empty = np.full(width, np.nan, dtype=np.float32)
+        return empty, empty.copy()
+    starts = np.arange(width, dtype=np.int64) * len(flux) // width
+    # fmin/fmax skip NaN unless a whole column is NaN
+    low, high = np.fmin.reduceat(flux, starts), np.fmax.reduceat(flux, starts)
+    if np.isinf(low).any() or np.isinf(high).any():
+        # Masking costs more than the decimation; only do it when needed
+        flux = np.where(np.isfinite(flux), flux, np.nan)
+        low, high = np.fmin.reduceat(flux, starts), np.fmax.reduceat(flux, starts)
+    return low, high
+
+
+def _draw_strip(low, high, height):
+    """A strip `height` pixels high with the envelope drawn as filled columns"""
+    strip = np.full((height, len(low)), BACKGROUND, dtype=np.uint8)
+    finite = np.isfinite(low)
+    if not finite.any():
+        return strip
+    # Join each column to its neighbour so that steep edges have no gaps
+    low, high = (np.concatenate([low[:1], np.fmin(low[1:], high[:-1])]),
+                 np.concatenate([high[:1], np.fmax(high[1:], low[:-1])]))
+    vmin, vmax = float(np.nanmin(low)), float(np.nanmax(high))
+    scale = (height - 1) / (vmax - vmin) if vmax > vmin else 0.0
+    centre = (height - 1) / 2 if scale == 0.0 else 0.0
+    top = np.where(finite, np.rint(centre + (vmax - high) * scale), height)
+    bottom = np.where(finite, np.rint(centre + (vmax - low) * scale), -1)
+    rows = np.arange(height)[:, None]
+    strip[(rows >= top) & (rows <= bottom)] = LINE
+    return strip
+
+
+def render_spectra(spectra, width=SPECTRUM_WIDTH):
+    """8-bit grayscale image of `spectra`, one strip per spectrum or order"""
+    if not spectra:
+        raise ValueError("No spectrum found in the FITS file")
+    count = min(len(spectra), MAX_HEIGHT // MIN_STRIP_HEIGHT)
+    if count < len(spectra):
+        logger.debug("Drawing %s of %s orders", count, len(spectra))
+    height = max(MIN_STRIP_HEIGHT, min(STRIP_HEIGHT, MAX_HEIGHT // count))
+    separator = np.full((1, width), SEPARATOR, dtype=np.uint8)
+    strips = []
+    for flux in spectra[:count]:
+        if strips:
+            strips.append(separator)
+        strips.append(_draw_strip(*envelope(flux, width), height))
+    return np.vstack(strips)
+
+
+def to_png(image_data):
+    """PNG bytes of an 8-bit image"""
+    buf = io.BytesIO()
+    # optimize=True would take longer than the whole decimation
+    Image.fromarray(image_data).save(buf, format='PNG')
+    return buf.getvalue()
@@ -3,9 +3,8 @@ import { Button } from "@/components/ui/button";
 import { Badge } from "@/components/ui/badge";
 import { Table, TableBody, TableCell, TableHead, TableHeader, TableRow } from "@/components/ui/table";
 import { Download, Filter, HelpCircle, Eye, ChevronDown, ChevronUp, Terminal } from "lucide-react";
-import { useState, Fragment } from "react";
+import { useState, useEffect, Fragment } from "react";
 import { cn } from "@/lib/utils";
-import { getMinioClient } from "@/lib/minio";
 import { ImageOverlay } from "./ImageOverlay";
 import { toast } from "sonner";
 
@@ -45,21 +44,54 @@ export const ResultsSection = ({
   const [viewingFileName, setViewingFileName] = useState<string | null>(null);
   const [metadata, setMetadata] = useState<any | null>(null);
   const [isMetadataOpen, setIsMetadataOpen] = useState(false);
+  const [metadataCache, setMetadataCache] = useState<Record<string, any>>({});
 
   // SkyViewer state
   const [isSkyViewerOpen, setIsSkyViewerOpen] = useState(false);
   const [skyViewerCoordinates, setSkyViewerCoordinates] = useState<string | null>(null);
 
+  // Prefetch metadata for all result rows in a single batch request
+  useEffect(() => {
+    const names = results
+      .map((row) => row.name)
+      .filter((name) => name && /^\d+\./.test(name) && !(name in metadataCache));
+    if (names.length === 0) return;
+
+    fetch("http://localhost:5003/api/fits-metadata/batch/", {
+      method: "POST",
+      headers: { "Content-Type": "application/json" },
+      body: JSON.stringify({ files: names }),
+    })
+      .then((response) => (response.ok ? response.json() : null))
+      .then((data) => {
+        if (data?.results) {
+          setMetadataCache((prev) => ({ ...prev, ...data.results }));
+        }
+      })
+      .catch((err) => console.error("Failed to prefetch metadata:", err));
+  }, [results]);
+
+  const fetchMetadata = async (row: any) => {
+    if (metadataCache[row.name]) {
+      return metadataCache[row.name];
+    }
+
+    const response = await fetch(`http://localhost:5003/api/fits-metadata/?file=${row.name}`);
+    const data = await response.json();
+
+    if (!response.ok) {
+      throw new Error(data.error || "Failed to fetch metadata");
+    }
+
+    setMetadataCache((prev) => ({ ...prev, [row.name]: data }));
+    return data;
+  };
+
   const handleSelectRow = async (row: any, index: number) => {
     setSelectedRow(index);
 
     try {
-      const response = await fetch(`http://localhost:5003/api/fits-metadata/?file=${row.name}`);
-      const data = await response.json();
-
-      if (!response.ok) {
-        throw new Error(data.error || "Failed to fetch metadata");
-      }
+      const data = await fetchMetadata(row);
 
       setMetadata(data);
       setIsMetadataOpen(true);
@@ -71,12 +103,7 @@ export const ResultsSection = ({
 
   const handleLocateRow = async (row: any) => {
     try {
-      const response = await fetch(`http://localhost:5003/api/fits-metadata/?file=${row.name}`);
-      const data = await response.json();
-
-      if (!response.ok) {
-        throw new Error(data.error || "Failed to fetch metadata");
-      }
+      const data = await fetchMetadata(row);
 
       // Extract RA and DEC
       // Check for common variations if needed, but schema uses trg_alph and trg_delt
@@ -108,9 +135,9 @@ export const ResultsSection = ({
 
   const handleCopyCommand = async (fileName: string) => {
     try {
-      const minioClient = await getMinioClient();
-      const presignedUrl = await minioClient.presignedGetObject("dataarchive", fileName, 3600);
-      const curlCommand = `curl -X GET "${presignedUrl}" --output ${fileName}`;
+      // Proxied through the API so MinIO need not be reachable from the client
+      const downloadUrl = `http://localhost:5003/api/fits-raw/${encodeURIComponent(fileName)}`;
+      const curlCommand = `curl -X GET "${downloadUrl}" --output ${fileName}`;
 
       await navigator.clipboard.writeText(curlCommand);
       toast.success("Curl command copied to clipboard!");
@@ -0,0 +1,265 @@
+"""
+Logging setup shared by the Flask backends.
+
+setup_logging() routes every record through a bounded in-memory queue to a
+QueueListener thread, which formats it (as JSON lines or plain text) and
+writes it out; request threads only build the record and never block on
+the stream. When the queue is full, records are dropped and the number of
+dropped records is logged once the listener catches up.
+
+Configuration comes from the environment:
+    FITS_LOG_LEVEL    root level (default INFO)
+    FITS_LOG_LEVELS   per-logger levels, e.g. "fits_header=DEBUG,minio=WARNING"
+    FITS_LOG_FORMAT   json (default) or text
+    FITS_LOG_FILE     also write to this file
+    FITS_LOG_SAMPLE   keep 1 in N records of a LogSampler (default 100)
+
+Per-file debug output inside loops goes through LogSampler, which keeps a
+sample of the records and a per-second cap.
+"""
+
+from flask import g, request, has_request_context
+import atexit
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import sys
+import threading
+import time
+import uuid
+
+QUEUE_SIZE = 10000
+
+# LogRecord attributes that are not structured `extra` fields
+_RECORD_ATTRS = set(vars(logging.LogRecord('', 0, '', 0, '', (), None))) | {'message', 'asctime'}
+
+_listener = None
+_setup_lock = threading.Lock()
+
+
+class JSONFormatter(logging.Formatter):
+    """One JSON object per line; `extra={...}` fields are included as keys"""
+
+    def __init__(self, service):
+        super().__init__()
+        self.service = service
+
+    def format(self, record):
+        entry = {
+            'ts': time.strftime('%Y-%m-%dT%H:%M:%S', time.gmtime(record.created)) + f'.{int(record.msecs):03d}Z',
+            'level': record.levelname,
+            'logger': record.name,
+            'msg': record.getMessage(),
+            'service': self.service,
+            'pid': record.process,
+            'thread': record.threadName,
+        }
+        for key, value in vars(record).items():
+            if key not in _RECORD_ATTRS and not key.startswith('_'):
+                entry[key] = value
+        if record.exc_text:
+            entry['exc'] = record.exc_text
+        return json.dumps(entry, default=str)
+
+
+class TextFormatter(logging.Formatter):
+    def __init__(self, service):
+        super().__init__(f'%(asctime)s - {service} - %(name)s - %(levelname)s - %(message)s')
+
+    def format(self, record):
+        line = super().format(record)
+        extra = {k: v for k, v in vars(record).items() if k not in _RECORD_ATTRS and not k.startswith('_')}
+        if extra:
+            line += ' ' + ' '.join(f'{k}={v}' for k, v in extra.items())
+        return line
+
+
+class _NonBlockingQueueHandler(logging.handlers.QueueHandler):
+    """QueueHandler that drops records instead of blocking when the queue is full"""
+
+    def __init__(self, log_queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+        self._dropped_lock = threading.Lock()
+
+    def prepare(self, record):
+        # Only merge the arguments here; the formatter runs on the listener
+        # thread. Exceptions are rendered now, while the traceback is alive.
+        record = logging.makeLogRecord(vars(record))
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            with self._dropped_lock:
+                self.dropped += 1
+
+    def take_dropped(self):
+        with self._dropped_lock:
+            dropped, self.dropped = self.dropped, 0
+        return dropped
+
+
+class _DropReportingHandler(logging.Handler):
+    """Listener-side wrapper that reports records dropped by the queue handler"""
+
+    def __init__(self, handlers, queue_handler):
+        super().__init__()
+        self.handlers = handlers
+        self.queue_handler = queue_handler
+
+    def emit(self, record):
+        dropped = self.queue_handler.take_dropped()
+        if dropped:
+            notice = logging.makeLogRecord({
+                'name': __name__, 'levelno': logging.WARNING, 'levelname': 'WARNING',
+                'msg': 'Dropped %d log records (queue full)', 'args': (dropped,),
+            })
+            self._emit(notice)
+        self._emit(record)
+
+    def _emit(self, record):
+        for handler in self.handlers:
+            if record.levelno >= handler.level:
+                handler.handle(record)
+
+    def flush(self):
+        for handler in self.handlers:
+            handler.flush()
+
+
+class _RequestContextFilter(logging.Filter):
+    """Adds method, path and request id to records logged while serving a request"""
+
+    def filter(self, record):
+        if has_request_context():
+            record.method = request.method
+            record.path = request.path
+            request_id = g.get('request_id')
+            if request_id is None:
+                request_id = g.request_id = request.headers.get('X-Request-Id') or uuid.uuid4().hex[:12]
+            record.request_id = request_id
+        return True
+
+
+def parse_levels(value):
+    """"a=DEBUG,b.c=WARNING" -> {'a': 'DEBUG', 'b.c': 'WARNING'}"""
+    levels = {}
+    for item in (value or '').split(','):
+        name, sep, level = item.partition('=')
+        if sep and name.strip():
+            levels[name.strip()] = level.strip().upper()
+    return levels
+
+
+def setup_logging(service):
+    """
+    Configure the root logger for `service` from the environment. Safe to
+    call more than once; only the first call in a process installs handlers.
+    """
+    global _listener
+    with _setup_lock:
+        if _listener is not None:
+            return
+        formatter_class = TextFormatter if os.environ.get('FITS_LOG_FORMAT', 'json') == 'text' else JSONFormatter
+        formatter = formatter_class(service)
+        outputs = [logging.StreamHandler(sys.stderr)]
+        log_file = os.environ.get('FITS_LOG_FILE')
+        if log_file:
+            outputs.append(logging.FileHandler(log_file))
+        for output in outputs:
+            output.setFormatter(formatter)
+
+        queue_handler = _NonBlockingQueueHandler(queue.Queue(QUEUE_SIZE))
+        queue_handler.addFilter(_RequestContextFilter())
+
+        root = logging.getLogger()
+        for handler in list(root.handlers):
+            root.removeHandler(handler)
+        root.addHandler(queue_handler)
+        root.setLevel(os.environ.get('FITS_LOG_LEVEL', 'INFO').upper())
+        for name, level in parse_levels(os.environ.get('FITS_LOG_LEVELS')).items():
+            logging.getLogger(name).setLevel(level)
+
+        _listener = logging.handlers.QueueListener(
+            queue_handler.queue, _DropReportingHandler(outputs, queue_handler)
+        )
+        _listener.start()
+        atexit.register(stop_logging)
+        if hasattr(os, 'register_at_fork'):
+            os.register_at_fork(after_in_child=_restart_after_fork)
+
+
+def _restart_after_fork():
+    # Only the forking thread survives fork, so a forked worker (serve.py)
+    # needs a listener thread of its own, reading from a fresh queue
+    global _listener, _setup_lock
+    _setup_lock = threading.Lock()
+    if _listener is None:
+        return
+    output = _listener.handlers[0]
+    output.queue_handler.queue = queue.Queue(QUEUE_SIZE)
+    _listener = logging.handlers.QueueListener(output.queue_handler.queue, output)
+    _listener.start()
+
+
+def stop_logging():
+    """Flush queued records and stop the listener thread"""
+    global _listener
+    with _setup_lock:
+        if _listener is not None:
+            _listener.stop()
+            _listener = None
+
+
+class LogSampler:
+    """
+    Logs 1 in `every` calls, and at most `per_second` records per second, for
+    debug output in per-file or per-HDU loops. The level check comes first,
+    so calls cost a method call when the level is disabled. Emitted records
+    carry `sampled` (calls since the last emitted record).
+    """
+
+    def __init__(self, logger, every=None, per_second=10):
+        self.logger = logger
+        self.every = every or int(os.environ.get('FITS_LOG_SAMPLE', '100'))
+        self.per_second = per_second
+        self._calls = 0
+        self._window = 0
+        self._window_count = 0
+        self._lock = threading.Lock()
+
+    def _should_log(self):
+        with self._lock:
+            self._calls += 1
+            if self._calls < self.every:
+                return None
+            now = int(time.monotonic())
+            if now != self._window:
+                self._window, self._window_count = now, 0
+            if self.per_second is not None and self._window_count >= self.per_second:
+                return None
+            self._window_count += 1
+            calls, self._calls = self._calls, 0
+            return calls
+
+    def log(self, level, msg, *args):
+        if not self.logger.isEnabledFor(level):
+            return
+        sampled = self._should_log()
+        if sampled is not None:
+            self.logger.log(level, msg, *args, extra={'sampled': sampled}, stacklevel=3)
+
+    def debug(self, msg, *args):
+        self.log(logging.DEBUG, msg, *args)
+
+    def info(self, msg, *args):
+        self.log(logging.INFO, msg, *args)
@@ -7,6 +7,8 @@ visualization in the Streamlit app. It checks basic structure, data validity,
 and displays helpful information for debugging.
 """
 
+import argparse
+import json
 import sys
 import os
 import numpy as np
@@ -14,6 +16,25 @@ from astropy.io import fits
 from astropy.wcs import WCS
 import matplotlib.pyplot as plt
 
+from fits_stats import image_stats, DEFAULT_BINS
+
+BITPIX_DTYPES = {8: 'uint8', 16: 'int16', 32: 'int32', 64: 'int64', -32: 'float32', -64: 'float64'}
+
+def _shape(header):
+    """Data shape from the header, slowest axis first (rows for tables)"""
+    if header.get('XTENSION') in ('BINTABLE', 'TABLE'):
+        return (header.get('NAXIS2', 0),)
+    return tuple(header.get(f'NAXIS{i}', 0) for i in range(header.get('NAXIS', 0), 0, -1))
+
+def _dtype(header):
+    """Stored data type from the header; scaled data is read as float"""
+    if header.get('XTENSION') in ('BINTABLE', 'TABLE'):
+        return f"table of {header.get('TFIELDS', 0)} columns"
+    dtype = BITPIX_DTYPES.get(header.get('BITPIX'), f"BITPIX {header.get('BITPIX')}")
+    if header.get('BSCALE', 1) != 1 or header.get('BZERO', 0) != 0:
+        dtype += f" (BSCALE={header.get('BSCALE', 1)}, BZERO={header.get('BZERO', 0)})"
+    return dtype
+
 def verify_fits_file(file_path):
     """
     Verify a FITS file structure and content
@@ -41,22 +62,23 @@ def verify_fits_file(file_path):
                 print(f"\nHDU {i}: {hdu.__class__.__name__}")
                 print(f"  Type: {'Primary' if i == 0 else 'Extension'}")
                 
-                # Check data presence and type
-                if hdu.data is not None:
-                    shape = hdu.data.shape
-                    dtype = hdu.data.dtype
-                    print(f"  Data: {shape} {dtype}")
+                # Check data presence and type, from the header: hdu.data
+                # would decompress or rescale the whole HDU in memory
+                shape = _shape(hdu.header)
+                if shape and 0 not in shape:
+                    print(f"  Data: {shape} {_dtype(hdu.header)}")
                     
-                    # Data statistics (avoiding potential NaN warnings)
-                    data_flat = hdu.data.flatten()
-                    valid_data = data_flat[~np.isnan(data_flat) & ~np.isinf(data_flat)]
+                    # Data statistics, read in blocks (see fits_stats.py)
+                    stats = image_stats(hdu, bins=0) if getattr(hdu, 'section', None) is not None else None
                     
-                    if len(valid_data) > 0:
-                        print(f"  Valid values: {len(valid_data)} / {len(data_flat)} pixels ({len(valid_data)/len(data_flat)*100:.1f}%)")
-                        print(f"  Data range: {valid_data.min():.5g} to {valid_data.max():.5g}")
-                        print(f"  Mean: {valid_data.mean():.5g}")
-                        print(f"  Median: {np.median(valid_data):.5g}")
-                        print(f"  Std dev: {valid_data.std():.5g}")
+                    if stats is None:
+                        print("  Statistics: not an image")
+                    elif stats['finite'] > 0:
+                        print(f"  Valid values: {stats['finite']} / {stats['count']} pixels ({stats['finite']/stats['count']*100:.1f}%)")
+                        print(f"  Data range: {stats['min']:.5g} to {stats['max']:.5g}")
+                        print(f"  Mean: {stats['mean']:.5g}")
+                        print(f"  Median: {stats['quantiles']['0.5']:.5g} (within {stats['quantile_relative_error']:.0%})")
+                        print(f"  Std dev: {stats['std']:.5g}")
                     else:
                         print("  WARNING: No valid data (all NaN or Inf)")
                 else:
@@ -92,25 +114,26 @@ def verify_fits_file(file_path):
                         print(f"    {key}: {hdu.header[key]}")
             
             # Create a simple visualization of the primary HDU data
-            if hdul[0].data is not None:
+            shape = _shape(hdul[0].header)
+            if shape and 0 not in shape:
                 try:
                     plt.figure(figsize=(10, 8))
                     
-                    # Get data from primary HDU
-                    data = hdul[0].data
+                    # Read only the plotted plane of the primary HDU
+                    section = hdul[0].section
                     
                     # Handle different data dimensions
-                    if len(data.shape) == 2:
-                        plot_data = data
+                    if len(shape) == 2:
+                        plot_data = section[...]
                         plt.title("2D Image Data")
-                    elif len(data.shape) == 3:
-                        plot_data = data[0]  # Take first slice
-                        plt.title(f"3D Cube Data (showing slice 0/{data.shape[0]-1})")
-                    elif len(data.shape) == 4:
-                        plot_data = data[0, 0]  # Take first slice of first cube
+                    elif len(shape) == 3:
+                        plot_data = section[0]  # Take first slice
+                        plt.title(f"3D Cube Data (showing slice 0/{shape[0]-1})")
+                    elif len(shape) == 4:
+                        plot_data = section[0, 0]  # Take first slice of first cube
                         plt.title(f"4D Data (showing cube 0, slice 0)")
                     else:
-                        raise ValueError(f"Cannot visualize data with shape {data.shape}")
+                        raise ValueError(f"Cannot visualize data with shape {shape}")
                     
                     # Mask invalid values
                     masked_data = np.ma.masked_invalid(plot_data)
@@ -151,14 +174,35 @@ def verify_fits_file(file_path):
         traceback.print_exc()
         return False
 
+def print_stats(file_path, bins=DEFAULT_BINS):
+    """
+    Print statistics, histogram and quantiles of every image HDU as JSON.
+    Reads in blocks, so memory use does not grow with the file size.
+    """
+    results = []
+    with fits.open(file_path) as hdul:
+        for i, hdu in enumerate(hdul):
+            if hdu.header.get('NAXIS', 0) == 0 or getattr(hdu, 'section', None) is None:
+                continue
+            stats = image_stats(hdu, bins=bins)
+            stats['index'] = i
+            results.append(stats)
+    json.dump(results, sys.stdout, indent=2)
+    print()
+    return bool(results)
+
 def main():
-    if len(sys.argv) < 2:
-        print("Usage: python verify_fits.py <fits_file>")
-        return
-    
-    file_path = sys.argv[1]
-    verify_fits_file(file_path)
+    parser = argparse.ArgumentParser(description='Verify a FITS file before visualization')
+    parser.add_argument('fits_file')
+    parser.add_argument('--stats', action='store_true',
+                        help='only print statistics and histograms of the image HDUs as JSON')
+    parser.add_argument('--bins', type=int, default=DEFAULT_BINS, help='histogram bins for --stats')
+    args = parser.parse_args()
+
+    if args.stats:
+        return 0 if print_stats(args.fits_file, args.bins) else 1
+    verify_fits_file(args.fits_file)
 
 if __name__ == "__main__":
-    main()
+    sys.exit(main())
 
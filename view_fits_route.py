@@ -4,11 +4,10 @@ from minio import Minio
 import logging
 
 # Configure logging
-logging.basicConfig(level=logging.DEBUG)
 logger = logging.getLogger(__name__)
 
-def setup_view_fits_route(app, minio_client, bucket_name):
-    viewer = FITSViewer(minio_client, bucket_name)
+def setup_view_fits_route(app, minio_client, bucket_name, object_cache=None):
+    viewer = FITSViewer(minio_client, bucket_name, object_cache=object_cache)
     
     @app.route('/view-fits')
     def view_fits():
@@ -25,7 +24,7 @@ def setup_view_fits_route(app, minio_client, bucket_name):
             return send_file(image_path, mimetype='image/png')
             
         except Exception as e:
-            logger.error(f"Error processing FITS file: {str(e)}")
+            logger.error("Error processing FITS file: %s", e)
             return jsonify({'error': str(e)}), 500
 
 # Example usage in your main Flask app: